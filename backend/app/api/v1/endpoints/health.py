@@ -1,5 +1,14 @@
 from fastapi import APIRouter
 from datetime import datetime
+from app.core.config import settings
+from app.services.cache_service import cache_service
+from app.services.cache_warmup import cache_warmup
+from app.engine.strategy_runner import strategy_runner
+from app.engine.strategy_shards import strategy_shards
+from app.services.order_router import order_router
+from app.services.risk_engine import risk_engine
+from app.services.mark_to_market import mark_to_market
+from app.services.portfolio_service import portfolio_service
 
 router = APIRouter()
 
@@ -29,3 +38,27 @@ async def redis_health():
         "status": "healthy",
         "redis": "connected"
     }
+
+@router.get("/cache")
+async def cache_health():
+    """Cache statistics: Redis totals plus per-family hits, misses, latency and payload sizes."""
+    stats = await cache_service.get_cache_stats()
+    stats["warmup"] = cache_warmup.get_stats()
+    return stats
+
+@router.get("/orders")
+async def orders_health():
+    """Order routing per exchange (queue depth, counters, stage latencies), risk, mark-to-market and portfolio snapshots."""
+    return {
+        "routing": order_router.get_stats(),
+        "risk": risk_engine.get_stats(),
+        "mark_to_market": mark_to_market.get_stats(),
+        "portfolio": portfolio_service.get_stats(),
+    }
+
+@router.get("/strategies")
+async def strategies_health():
+    """Live strategy runner: feeds, scheduled strategies and dispatch counters."""
+    if settings.STRATEGY_SHARDS > 0:
+        return strategy_shards.get_stats()
+    return strategy_runner.get_stats()
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Optional, Dict
 from pydantic import BaseModel
 from datetime import datetime
+from app.core.serialization import negotiated_response
 from app.services.market_data import MarketDataService
 
 router = APIRouter()
@@ -26,18 +27,19 @@ async def get_ticker(symbol: str):
 
 @router.get("/ohlcv/{symbol}")
 async def get_ohlcv(
+    request: Request,
     symbol: str,
     timeframe: str = "D",
     days: int = 30
 ):
-    """Get OHLCV (candlestick) data for a symbol."""
+    """Get OHLCV (candlestick) data for a symbol (msgpack with Accept: application/msgpack)."""
     try:
         data = await market_service.get_ohlcv(symbol.upper(), timeframe, days)
-        return {
+        return negotiated_response(request, {
             "symbol": symbol.upper(),
             "timeframe": timeframe,
             "data": data
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
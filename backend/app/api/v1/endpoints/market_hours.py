@@ -3,10 +3,9 @@ Market Hours Endpoint - Información sobre horarios de mercado
 Basado en análisis de Robinhood
 """
 from fastapi import APIRouter
-from app.services.market_hours_service import MarketHoursService
+from app.services.market_hours_service import market_hours_service
 
 router = APIRouter()
-market_hours_service = MarketHoursService()
 
 @router.get("/status")
 async def get_market_status():
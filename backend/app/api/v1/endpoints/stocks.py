@@ -1,16 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import Optional
+from app.core.serialization import negotiated_response
 from app.services.market_data import MarketDataService
 
 router = APIRouter()
 market_service = MarketDataService()
 
 @router.get("/quote/{symbol}")
-async def get_stock_quote(symbol: str):
-    """Get real-time stock quote."""
+async def get_stock_quote(request: Request, symbol: str):
+    """Get real-time stock quote (msgpack with Accept: application/msgpack)."""
     try:
         quote = await market_service.get_stock_quote(symbol.upper())
-        return quote
+        return negotiated_response(request, quote)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -1,36 +1,138 @@
 import asyncio
 import json
-import random
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.services.quote_hub import quote_hub
+
+try:
+    import msgpack
+except ImportError:  # optional: binary encoding for the multiplexed stream
+    msgpack = None
 
 router = APIRouter()
 
+MAX_STREAM_SYMBOLS = 200
+STREAM_QUEUE_SIZE = 1024
+
+
+def _encode(payload: dict, binary: bool):
+    if binary:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"))
+
+
+async def _send(websocket: WebSocket, payload: dict, binary: bool):
+    data = _encode(payload, binary)
+    if binary:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+
+
+@router.websocket("/stream")
+async def multiplexed_stream(websocket: WebSocket, encoding: str = "json"):
+    """
+    One socket for many symbols.
+
+    Client -> server: {"action": "subscribe" | "unsubscribe", "symbols": [...]}
+    (JSON text, or msgpack binary when encoding=msgpack).
+    Server -> client: {"u": {"AAPL": {"p": 190.1, "cp": 0.4, ...}}} where the
+    first update per symbol is the full compact quote and later ones carry
+    only changed fields. Updates queued together are coalesced into one message.
+    """
+    binary = encoding == "msgpack"
+    await websocket.accept()
+    if binary and msgpack is None:
+        await websocket.send_text(json.dumps({"error": "msgpack encoding not available"}))
+        await websocket.close(code=1003)
+        return
+
+    updates: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    symbols = set()
+
+    async def read_commands():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            try:
+                if message.get("bytes") is not None and msgpack is not None:
+                    command = msgpack.unpackb(message["bytes"], raw=False)
+                else:
+                    command = json.loads(message.get("text") or "")
+                action = command.get("action")
+                requested = [str(s).upper() for s in command.get("symbols") or []]
+            except (ValueError, AttributeError, TypeError):
+                await _send(websocket, {"error": "invalid message"}, binary)
+                continue
+
+            if action == "subscribe":
+                requested = [s for s in requested if s not in symbols]
+                requested = requested[:max(0, MAX_STREAM_SYMBOLS - len(symbols))]
+                for symbol in requested:
+                    symbols.add(symbol)
+                    quote_hub.subscribe_mux(symbol, updates)
+            elif action == "unsubscribe":
+                for symbol in requested:
+                    if symbol in symbols:
+                        symbols.discard(symbol)
+                        quote_hub.unsubscribe_mux(symbol, updates)
+            else:
+                await _send(websocket, {"error": f"unknown action: {action}"}, binary)
+                continue
+            await _send(websocket, {"ack": action, "symbols": sorted(symbols)}, binary)
+
+    async def write_updates():
+        while True:
+            item = await updates.get()
+            batch = {}
+            while item is not None:
+                symbol, fields = item
+                # Ignore updates that raced with an unsubscribe
+                if symbol in symbols:
+                    batch.setdefault(symbol, {}).update(fields)
+                if updates.empty():
+                    break
+                item = updates.get_nowait()
+            if item is None:
+                # Dropped for falling behind; client should reconnect and resubscribe
+                await websocket.close(code=1013)
+                return
+            if batch:
+                await _send(websocket, {"u": batch}, binary)
+
+    tasks = [asyncio.create_task(read_commands()), asyncio.create_task(write_updates())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"WS stream error: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for symbol in symbols:
+            quote_hub.unsubscribe_mux(symbol, updates)
+
+
 @router.websocket("/{symbol}")
 async def websocket_endpoint(websocket: WebSocket, symbol: str):
     await websocket.accept()
-    from app.services.market_data import MarketDataService
-    market_service = MarketDataService()
+    symbol = symbol.upper()
+    # Shared producer per symbol: N viewers cost one upstream feed
+    frames = quote_hub.subscribe(symbol)
     
     try:
         while True:
-            # Fetch real data from Finnhub (via service)
-            quote = await market_service.get_stock_quote(symbol.upper())
-            
-            data = {
-                "symbol": symbol.upper(),
-                "price": quote["current_price"],
-                "timestamp": quote["timestamp"],
-                "change_percent": quote["percent_change"],
-                "is_live": not quote.get("is_simulated", False)
-            }
-            
-            await websocket.send_text(json.dumps(data))
-            
-            # If the market is closed, the price won't change. 
-            # We wait 10 seconds between checks to respect free tier rate limits (60/min)
-            await asyncio.sleep(10) 
+            frame = await frames.get()
+            if frame is None:
+                # Dropped for falling behind (or producer failure); client should reconnect
+                await websocket.close(code=1013)
+                break
+            await websocket.send_text(frame)
             
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for {symbol}")
     except Exception as e:
         print(f"WS Error: {e}")
+    finally:
+        quote_hub.unsubscribe(symbol, frames)
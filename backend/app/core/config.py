@@ -1,6 +1,11 @@
 from pydantic_settings import BaseSettings
 from pydantic import field_validator
-from typing import List
+from typing import List, Union
+
+# List settings that may come from the env as comma-separated strings. The str
+# arm keeps pydantic-settings from JSON-decoding the env value (a SettingsError
+# for "a,b"); the validator below always turns it into a list.
+CommaList = Union[List[str], str]
 
 class Settings(BaseSettings):
     # Application
@@ -14,6 +19,21 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50  # shared pool size for the app lifetime
+    REDIS_POOL_TIMEOUT: float = 1.0  # seconds to wait for a free pooled connection
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    REDIS_RETRY_BASE_DELAY: float = 1.0  # circuit breaker backoff (doubles per failure)
+    REDIS_RETRY_MAX_DELAY: float = 60.0
+    REDIS_HEALTH_CHECK_INTERVAL: float = 5.0
+    CACHE_L1_MAX_ENTRIES: int = 10000  # in-process LRU in front of Redis (0 disables)
+    CACHE_STALE_TTL: int = 60  # seconds a soft-expired entry may still be served while refreshing
+    CACHE_REFRESH_RATE_SHARE: float = 0.25  # share of the Finnhub budget proactive hot-key refreshes may use
+    CACHE_SYNC_ENABLED: bool = True  # propagate invalidations/fresh values across workers
+    CACHE_SYNC_CHANNEL: str = "nuotrade:cache-sync"
+    CACHE_SYNC_FAMILIES: CommaList = ["quote"]
+    CACHE_CODEC: str = "orjson"  # json | orjson | msgpack (falls back to json if not installed)
+    CACHE_COMPRESS_MIN_BYTES: int = 16384  # zstd-compress larger payloads (0 disables)
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
@@ -21,7 +41,7 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
     # CORS (env may be comma-separated string, e.g. CORS_ORIGINS=http://localhost:3000,http://localhost:3001)
-    CORS_ORIGINS: List[str] = [
+    CORS_ORIGINS: CommaList = [
         "http://localhost:3000",
         "http://localhost:3001",
         "http://localhost:3004",
@@ -30,7 +50,7 @@ class Settings(BaseSettings):
         "http://127.0.0.1:3004",
     ]
 
-    @field_validator("CORS_ORIGINS", mode="before")
+    @field_validator("CORS_ORIGINS", "CACHE_SYNC_FAMILIES", "WARMUP_WATCHLIST", "STRATEGY_MODULES", mode="before")
     @classmethod
     def parse_cors_origins(cls, v):
         if isinstance(v, str):
@@ -43,8 +63,84 @@ class Settings(BaseSettings):
     COINBASE_API_KEY: str = ""
     COINBASE_API_SECRET: str = ""
     
+    # Exchange market data (ccxt async sessions)
+    DATAFEED_MAX_CONCURRENCY: int = 20  # in-flight requests per multi-symbol sweep
+    DATAFEED_MARKETS_TTL: int = 3600  # seconds market metadata is cached
+
     # Market Data APIs
     FINNHUB_API_KEY: str = "demo"  # Get free key at https://finnhub.io
+    FINNHUB_WS_URL: str = "wss://ws.finnhub.io"
+
+    # Live quote stream (Finnhub trades WebSocket)
+    QUOTE_STREAM_ENABLED: bool = True
+    QUOTE_STREAM_BASELINE_TTL: int = 300  # seconds before the REST baseline is refreshed
+    QUOTE_STREAM_MAX_SYMBOLS: int = 50  # upstream subscriptions (Finnhub free tier)
+    QUOTE_STREAM_LEASE_TTL: int = 120  # seconds a REST request keeps its symbol streamed
+
+    # Local memory-mapped candle cache (one file per symbol/timeframe)
+    CANDLE_CACHE_DIR: str = "data/candles"
+
+    # Order management
+    ORDER_TERMINAL_RETENTION: int = 10000  # filled/cancelled/rejected orders kept in memory
+    ORDER_JOURNAL_ENABLED: bool = True
+    ORDER_JOURNAL_PATH: str = "data/orders.journal"
+    ORDER_JOURNAL_FLUSH_INTERVAL: float = 0.2  # seconds between batched upserts to trading.orders
+    ORDER_JOURNAL_BATCH_SIZE: int = 1000  # rows per multi-row upsert
+    ORDER_JOURNAL_MAX_BYTES: int = 64 * 1024 * 1024  # compact the journal beyond this size
+    ORDER_JOURNAL_FSYNC: bool = True  # fsync the journal on every flush
+    PAPER_TRADING_ENABLED: bool = True  # match open orders against live quotes
+    ORDER_ROUTER_QUEUE_SIZE: int = 10000  # queued submissions/cancels per exchange
+    ORDER_ROUTER_MAX_BATCH: int = 20  # orders per batch call on exchanges that support it
+    ORDER_ROUTER_MAX_INFLIGHT: int = 100  # requests sent concurrently per exchange
+    ORDER_ROUTER_POLL_INTERVAL: float = 2.0  # seconds between status polls of orders acked open
+
+    # Pre-trade risk limits per account (quote currency, 0 disables a limit)
+    RISK_ENABLED: bool = True
+    RISK_MAX_ORDER_NOTIONAL: float = 100_000.0
+    RISK_MAX_POSITION_NOTIONAL: float = 250_000.0  # per symbol, including working orders
+    RISK_MAX_GROSS_EXPOSURE: float = 1_000_000.0
+    RISK_MAX_NET_EXPOSURE: float = 500_000.0
+    RISK_MAX_OPEN_ORDER_NOTIONAL: float = 500_000.0
+    RISK_MAX_DAILY_LOSS: float = 25_000.0  # realized, resets at midnight New York time
+    RISK_REFERENCE_PRICE_TTL: int = 30  # seconds a looked-up price prices market orders
+    RISK_REFERENCE_EXCHANGE: str = "binance"  # ticker source for pairs without a mark
+
+    # Mark-to-market of open trading.positions
+    MTM_ENABLED: bool = True
+    MTM_FLUSH_INTERVAL: float = 1.0  # seconds between bulk UPDATEs of dirty symbols
+    MTM_RELOAD_INTERVAL: int = 60  # seconds between re-reads of the open positions
+    MTM_POLL_INTERVAL: int = 15  # poll a quote for symbols not marked for this long
+
+    # Portfolio snapshots
+    PORTFOLIO_DEFAULT_USER_ID: int = 1  # until requests carry an authenticated user
+    PORTFOLIO_SNAPSHOT_TTL: int = 300  # rebuild from trading.positions after this many seconds
+    PORTFOLIO_REPRICE_INTERVAL: int = 15  # re-price on read when no quote arrived for this long
+    PORTFOLIO_PERSIST_FILLS: bool = True  # write fills to trading.positions as open lots
+    PORTFOLIO_MAX_SNAPSHOTS: int = 1000  # least recently read snapshots are evicted beyond this
+
+    # Live strategy runner
+    STRATEGY_RUNNER_ENABLED: bool = True
+    STRATEGY_RING_SIZE: int = 500  # closed bars kept per (symbol, timeframe)
+    STRATEGY_MAX_CONCURRENCY: int = 50  # strategies evaluated at once
+    STRATEGY_BAR_CLOSE_GRACE: float = 0.5  # seconds after a boundary before closing quiet bars
+    STRATEGY_RELOAD_INTERVAL: int = 60  # seconds between re-reads of active strategies
+    STRATEGY_MODULES: CommaList = []  # env: comma-separated modules registering strategy classes
+    STRATEGY_SHARDS: int = 0  # worker processes for live strategies (0: run in-process)
+    STRATEGY_SHARD_BATCH_INTERVAL: float = 0.005  # seconds between tick batches to each shard
+    STRATEGY_SHARD_QUEUE_SIZE: int = 1000  # batches queued per shard before dropping
+    STRATEGY_SHARD_CHECK_INTERVAL: float = 1.0  # seconds between shard liveness checks
+    STRATEGY_SHARD_HEARTBEAT_TIMEOUT: int = 30  # restart a shard silent for this long
+
+    # Pre-market cache warm-up (watchlist plus most-requested symbols)
+    FINNHUB_RATE_LIMIT_PER_MIN: int = 60  # free tier
+    WARMUP_ENABLED: bool = True
+    WARMUP_WATCHLIST: CommaList = []  # env: comma-separated symbols, always warmed first
+    WARMUP_MAX_SYMBOLS: int = 50
+    WARMUP_RATE_SHARE: float = 0.5  # share of the Finnhub budget the warm-up may use
+    WARMUP_LEAD_MINUTES: int = 30  # earliest start before the open
+    WARMUP_FINISH_SECONDS: int = 15  # last warm-up call this long before the open
+    WARMUP_DEMAND_MAX_SYMBOLS: int = 1000  # symbols kept in the shared demand ranking
+    WARMUP_DEMAND_MIN_SCORE: float = 0.1  # decayed demand below this is forgotten
     
     class Config:
         # Load .env from backend/ and from project root (for Docker/local)
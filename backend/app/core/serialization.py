@@ -0,0 +1,187 @@
+"""
+Serialization - Pluggable codecs for cache payloads and API responses
+
+orjson, msgpack and zstandard are optional; missing libraries fall back to
+the stdlib JSON codec without compression.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """Fallback for types the fast encoders do not know (numpy scalars, sets)."""
+    if hasattr(obj, "item"):
+        return obj.item()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+class JsonCodec:
+    """Stdlib JSON, always available."""
+
+    name = "json"
+    tag = 0
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=_default).encode("utf-8")
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson: JSON-compatible output, several times faster than the stdlib."""
+
+    name = "orjson"
+    tag = 1
+
+    def encode(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    """msgpack: compact binary, not JSON-compatible."""
+
+    name = "msgpack"
+    tag = 2
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True, default=_default)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def _available_codecs() -> Dict[str, Any]:
+    codecs = {"json": JsonCodec()}
+    if orjson is not None:
+        codecs["orjson"] = OrjsonCodec()
+    if msgpack is not None:
+        codecs["msgpack"] = MsgpackCodec()
+    return codecs
+
+
+CODECS = _available_codecs()
+CODECS_BY_TAG = {codec.tag: codec for codec in CODECS.values()}
+
+
+def get_codec(name: Optional[str] = None):
+    """Codec by name, falling back to JSON when the library is missing."""
+    name = name or settings.CACHE_CODEC
+    codec = CODECS.get(name)
+    if codec is None:
+        logger.warning("Codec %s not available, falling back to json", name)
+        codec = CODECS["json"]
+    return codec
+
+
+def json_codec():
+    """Fastest available JSON-compatible codec (for HTTP responses)."""
+    return CODECS.get("orjson") or CODECS["json"]
+
+
+# Payload framing: one header byte = codec tag (low 4 bits) + compressed flag.
+# Anything starting with '{', '[' or '"' predates the framing and is plain JSON.
+COMPRESSED_FLAG = 0x10
+_LEGACY_JSON_PREFIXES = (ord("{"), ord("["), ord('"'))
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard is not None else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def encode_payload(obj: Any, codec_name: Optional[str] = None, compress_min_bytes: Optional[int] = None) -> bytes:
+    """
+    Encode an object for storage.
+
+    Payloads at or above `compress_min_bytes` (settings.CACHE_COMPRESS_MIN_BYTES,
+    0 disables) are zstd-compressed when zstandard is installed.
+    """
+    codec = get_codec(codec_name)
+    body = codec.encode(obj)
+    header = codec.tag
+    if compress_min_bytes is None:
+        compress_min_bytes = settings.CACHE_COMPRESS_MIN_BYTES
+    if _zstd_compressor is not None and compress_min_bytes and len(body) >= compress_min_bytes:
+        body = _zstd_compressor.compress(body)
+        header |= COMPRESSED_FLAG
+    return bytes((header,)) + body
+
+
+def decode_payload(data: bytes) -> Any:
+    """Decode a payload written by encode_payload (or legacy plain JSON)."""
+    if isinstance(data, str):
+        return json.loads(data)
+    if not data:
+        raise ValueError("Empty payload")
+    header = data[0]
+    if header in _LEGACY_JSON_PREFIXES:
+        return json.loads(data)
+    body = data[1:]
+    if header & COMPRESSED_FLAG:
+        if _zstd_decompressor is None:
+            raise ValueError("Compressed payload but zstandard is not installed")
+        body = _zstd_decompressor.decompress(body)
+    codec = CODECS_BY_TAG.get(header & ~COMPRESSED_FLAG)
+    if codec is None:
+        raise ValueError(f"Payload codec {header & ~COMPRESSED_FLAG} not available")
+    return codec.decode(body)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when installed (stdlib JSON otherwise)."""
+
+    def render(self, content: Any) -> bytes:
+        return json_codec().encode(content)
+
+
+class MsgpackResponse(Response):
+    """Binary msgpack response for clients that ask for it."""
+
+    media_type = "application/x-msgpack"
+
+    def render(self, content: Any) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        return CODECS["msgpack"].encode(content)
+
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def negotiated_response(request: Request, content: Any) -> Response:
+    """msgpack when the Accept header asks for it (and msgpack is installed), JSON otherwise."""
+    # Same URL, two bodies: tell shared caches to key on Accept
+    headers = {"Vary": "Accept"}
+    accept = request.headers.get("accept", "")
+    if msgpack is not None and any(media in accept for media in MSGPACK_MEDIA_TYPES):
+        return MsgpackResponse(content, headers=headers)
+    return FastJSONResponse(content, headers=headers)
@@ -1,7 +1,7 @@
 """
 Backtesting Engine - Test strategies against historical data
 """
-from typing import List, Dict
+from typing import List, Dict, Sequence
 from datetime import datetime
 
 class BacktestEngine:
@@ -33,14 +33,16 @@ class BacktestEngine:
     async def run(
         self,
         strategy,
-        historical_data: List[Dict],
+        historical_data: Sequence[Dict],
     ) -> Dict:
         """
         Run backtest on historical data.
         
         Args:
             strategy: Strategy instance to test
-            historical_data: Historical OHLCV data
+            historical_data: Historical OHLCV data, either a list of candle
+                dicts or a CandleView from the candle store (slices are
+                zero-copy, so long histories are never materialized)
             
         Returns:
             Backtest results and metrics
@@ -0,0 +1,382 @@
+"""
+Paper Trading Engine - Matches resting orders against live quotes
+"""
+import asyncio
+import heapq
+import logging
+import time
+from itertools import count
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from app.services.order_execution import (
+    OrderExecutionService,
+    OrderSide,
+    OrderStatus,
+    OrderType,
+    order_execution_service,
+)
+from app.services.quote_stream import FinnhubTradeStream, QuoteBus, quote_bus, trade_stream
+
+logger = logging.getLogger(__name__)
+
+# Without live trades, resting books poll for a fresh quote this often
+POLL_INTERVAL = 10
+# Cap on the restart backoff of a feed that keeps failing
+MAX_FEED_RETRY_DELAY = 60.0
+
+Tick = Tuple[str, Dict]
+FillListener = Callable[[Dict, Dict], None]
+
+
+def bid_ask(quote: Dict) -> Tuple[float, float]:
+    """Bid/ask from a quote, falling back to the last price for both."""
+    last = quote.get("current_price") or quote.get("price") or 0.0
+    return quote.get("bid") or last, quote.get("ask") or last
+
+
+class _Ladder:
+    """
+    Price-sorted resting orders that trigger on one side of one quote field.
+
+    A heap keyed by (signed trigger price, arrival sequence), so the next
+    order to trigger is always on top and ties fill in arrival order.
+    Cancelled orders are removed lazily when they reach the top.
+    """
+
+    __slots__ = ("field", "trigger_on_rise", "heap", "garbage")
+
+    def __init__(self, field: str, trigger_on_rise: bool):
+        self.field = field  # "bid" or "ask"
+        self.trigger_on_rise = trigger_on_rise
+        self.heap: List[Tuple[float, int, Dict]] = []
+        self.garbage = 0  # known cancelled entries still in the heap
+
+    def push(self, trigger: float, seq: int, order: Dict) -> None:
+        # Rising triggers fire lowest-first; falling triggers highest-first
+        key = trigger if self.trigger_on_rise else -trigger
+        heapq.heappush(self.heap, (key, seq, order))
+
+    def pop_triggered(self, price: float) -> List[Dict]:
+        """Pop every live order whose trigger the price has crossed."""
+        heap = self.heap
+        triggered = []
+        while heap:
+            key, _, order = heap[0]
+            trigger = key if self.trigger_on_rise else -key
+            if order["status"] != OrderStatus.OPEN.value:
+                heapq.heappop(heap)  # cancelled or filled elsewhere
+                self.garbage = max(0, self.garbage - 1)
+                continue
+            if (price >= trigger) if self.trigger_on_rise else (price <= trigger):
+                triggered.append(heapq.heappop(heap)[2])
+            else:
+                break
+        return triggered
+
+    def discard(self) -> None:
+        """Note a cancelled entry; rebuild once most of the heap is dead."""
+        self.garbage += 1
+        if self.garbage > 64 and self.garbage * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if entry[2]["status"] == OrderStatus.OPEN.value]
+            heapq.heapify(self.heap)
+            self.garbage = 0
+
+    def live_count(self) -> int:
+        return sum(1 for _, _, order in self.heap if order["status"] == OrderStatus.OPEN.value)
+
+
+class _Book:
+    """Resting orders for one symbol, split by trigger direction."""
+
+    __slots__ = ("ladders", "market", "quote")
+
+    def __init__(self):
+        self.ladders = {
+            # Buy limit / buy take-profit: fill once the ask falls to the price
+            "ask_down": _Ladder("ask", trigger_on_rise=False),
+            # Sell limit / sell take-profit: fill once the bid rises to the price
+            "bid_up": _Ladder("bid", trigger_on_rise=True),
+            # Buy stop: trigger once the ask rises to the stop
+            "ask_up": _Ladder("ask", trigger_on_rise=True),
+            # Sell stop-loss: trigger once the bid falls to the stop
+            "bid_down": _Ladder("bid", trigger_on_rise=False),
+        }
+        self.market: List[Dict] = []  # market orders waiting for a first quote
+        self.quote: Optional[Dict] = None
+
+    def is_empty(self) -> bool:
+        return not self.market and not any(ladder.heap for ladder in self.ladders.values())
+
+
+def _ladder_for(order: Dict) -> str:
+    """Which ladder a resting order belongs to."""
+    buy = order["side"] == OrderSide.BUY.value
+    if order["type"] == OrderType.STOP_LOSS.value:
+        return "ask_up" if buy else "bid_down"
+    # Limit and take-profit both fill at the price or better
+    return "ask_down" if buy else "bid_up"
+
+
+class PaperTradingEngine:
+    """
+    Paper-trading matcher on top of OrderExecutionService.
+
+    Market orders fill at the current ask (buy) or bid (sell). Limit and
+    take-profit orders rest until the quote reaches their price and fill at
+    the quote (price or better). Stop-loss orders trigger when the quote
+    crosses the stop and fill at the quote like a market order. Quotes
+    without bid/ask use the last price for both.
+
+    Each symbol keeps four price-sorted ladders, so a tick only peeks at
+    the top of each and pops the orders it actually triggers. Live quotes
+    come from the QuoteBus (with a polling fallback); `on_quote` and
+    `replay` drive the same matching from recorded ticks.
+    """
+
+    def __init__(
+        self,
+        orders: Optional[OrderExecutionService] = None,
+        bus: Optional[QuoteBus] = None,
+        market_service=None,
+        poll_interval: float = POLL_INTERVAL,
+        stream: Optional[FinnhubTradeStream] = None,
+    ):
+        """Initialize paper trading engine."""
+        self.orders = orders or order_execution_service
+        self.bus = bus or quote_bus
+        self.stream = stream or trade_stream
+        self._market_service = market_service
+        self.poll_interval = poll_interval
+        self._books: Dict[str, _Book] = {}
+        self._feeds: Dict[str, asyncio.Task] = {}
+        self._feed_failures: Dict[str, int] = {}
+        self._seq = count()
+        self._listeners: List[FillListener] = []
+        self.live = False
+        self.ticks = 0
+        self.fills = 0
+        self.skipped_quotes = 0
+
+    @property
+    def market_service(self):
+        """Shared MarketDataService, created on first use."""
+        if self._market_service is None:
+            from app.services.market_data import MarketDataService
+            self._market_service = MarketDataService()
+        return self._market_service
+
+    def add_fill_listener(self, callback: FillListener) -> None:
+        """Register a callback(order, fill) invoked after every fill."""
+        self._listeners.append(callback)
+
+    def _book(self, symbol: str) -> _Book:
+        book = self._books.get(symbol)
+        if book is None:
+            book = self._books[symbol] = _Book()
+        return book
+
+    async def place_order(
+        self,
+        symbol: str,
+        side: OrderSide,
+        order_type: OrderType,
+        amount: float,
+        price: Optional[float] = None,
+        user_id: Optional[int] = None,
+    ) -> Dict:
+        """Create an order and hand it to the matcher."""
+        if order_type != OrderType.MARKET and price is None:
+            raise ValueError(f"{order_type.value} orders need a price")
+        order = await self.orders.create_order(
+            symbol.upper(), side, order_type, amount, price, user_id=user_id
+        )
+        await self.submit(order)
+        return order
+
+    async def submit(self, order: Dict) -> None:
+        """Accept a pending (or restored open) order into the book."""
+        symbol = order["symbol"]
+        book = self._book(symbol)
+        if order["status"] == OrderStatus.PENDING.value:
+            await self.orders.update_order_status(order["id"], OrderStatus.OPEN)
+
+        if order["type"] == OrderType.MARKET.value:
+            book.market.append(order)
+        else:
+            book.ladders[_ladder_for(order)].push(order["price"], next(self._seq), order)
+
+        # Marketable on arrival: match against the last quote right away
+        if book.quote is not None:
+            await self._match(symbol, book, book.quote)
+        self._ensure_feed(symbol)
+
+    async def cancel_order(self, order_id: str) -> Dict:
+        """Cancel a resting order."""
+        order = await self.orders.cancel_order(order_id)
+        book = self._books.get(order["symbol"])
+        if book is not None and order["type"] != OrderType.MARKET.value:
+            book.ladders[_ladder_for(order)].discard()
+        return order
+
+    async def on_quote(self, symbol: str, quote: Dict) -> int:
+        """
+        Match a symbol's resting orders against a quote.
+
+        Simulated fallback quotes are ignored: they are not prices anyone
+        could have traded at, and must not become the book's last quote.
+
+        Returns:
+            Number of orders filled
+        """
+        self.ticks += 1
+        if quote.get("is_simulated"):
+            self.skipped_quotes += 1
+            return 0
+        book = self._books.get(symbol)
+        if book is None:
+            return 0
+        book.quote = quote
+        return await self._match(symbol, book, quote)
+
+    async def replay(self, ticks: Union[Iterable[Tick], AsyncIterable[Tick]]) -> int:
+        """Feed recorded `(symbol, quote)` ticks through the matcher."""
+        filled = 0
+        if hasattr(ticks, "__aiter__"):
+            async for symbol, quote in ticks:
+                filled += await self.on_quote(symbol, quote)
+        else:
+            for symbol, quote in ticks:
+                filled += await self.on_quote(symbol, quote)
+        return filled
+
+    async def _match(self, symbol: str, book: _Book, quote: Dict) -> int:
+        bid, ask = bid_ask(quote)
+        prices = {"bid": bid, "ask": ask}
+        filled = 0
+
+        if book.market:
+            waiting, book.market = book.market, []
+            for order in waiting:
+                if order["status"] == OrderStatus.OPEN.value:
+                    await self._fill(order, ask if order["side"] == OrderSide.BUY.value else bid, quote)
+                    filled += 1
+
+        for ladder in book.ladders.values():
+            price = prices[ladder.field]
+            if price <= 0:
+                continue
+            for order in ladder.pop_triggered(price):
+                await self._fill(order, price, quote)
+                filled += 1
+        return filled
+
+    async def _fill(self, order: Dict, price: float, quote: Dict) -> None:
+        """Fill an order completely at `price`."""
+        await self.orders.update_order_status(
+            order["id"], OrderStatus.FILLED, filled=order["amount"], average_price=price
+        )
+        self.fills += 1
+        fill = {
+            "order_id": order["id"],
+            "symbol": order["symbol"],
+            "side": order["side"],
+            "amount": order["amount"],
+            "price": price,
+            "timestamp": quote.get("timestamp") or int(time.time()),
+        }
+        for callback in self._listeners:
+            try:
+                callback(order, fill)
+            except Exception as e:
+                logger.warning("Fill listener failed for %s: %s", order["id"], e)
+
+    # --- Live feed ---
+
+    def _ensure_feed(self, symbol: str, delay: float = 0.0) -> None:
+        if self.live and symbol not in self._feeds and not self._book(symbol).is_empty():
+            self._feeds[symbol] = asyncio.create_task(self._feed(symbol, delay))
+
+    async def _feed(self, symbol: str, delay: float = 0.0) -> None:
+        """
+        Drive a symbol's book from the quote bus while it has resting orders.
+
+        A feed that ends (failed, or its book emptied while orders kept
+        arriving) is restarted as long as the book has orders, with
+        exponential backoff after failures.
+        """
+        updates = None
+        acquired = cancelled = False
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            updates = self.bus.subscribe(symbol)
+            acquired = True
+            await self.stream.acquire(symbol)
+            quote = await self.market_service.fetch_quote(symbol)
+            while True:
+                await self.on_quote(symbol, quote)
+                self._feed_failures.pop(symbol, None)
+                book = self._books.get(symbol)
+                if book is None or book.is_empty():
+                    break
+                try:
+                    quote = await asyncio.wait_for(updates.get(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    quote = await self.market_service.fetch_quote(symbol)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            self._feed_failures[symbol] = self._feed_failures.get(symbol, 0) + 1
+            logger.warning("Paper trading feed for %s failed: %s", symbol, e)
+        finally:
+            # Unregister first, so a submit() during the awaits below starts its own feed
+            if self._feeds.get(symbol) is asyncio.current_task():
+                del self._feeds[symbol]
+            if updates is not None:
+                self.bus.unsubscribe(symbol, updates)
+            if acquired:
+                await self.stream.release(symbol)
+            book = self._books.get(symbol)
+            if book is not None and book.is_empty():
+                del self._books[symbol]
+                self._feed_failures.pop(symbol, None)
+            elif book is not None and not cancelled:
+                failures = self._feed_failures.get(symbol, 0)
+                retry = min(MAX_FEED_RETRY_DELAY, self.poll_interval * 2 ** min(failures - 1, 16)) if failures else 0.0
+                self._ensure_feed(symbol, retry)
+
+    async def start(self) -> None:
+        """Load open orders (e.g. restored from the journal) and start live feeds."""
+        self.live = True
+        for order in await self.orders.get_orders(OrderStatus.OPEN):
+            await self.submit(order)
+
+    async def stop(self) -> None:
+        """Cancel live feeds; resting orders stay open in the order service."""
+        self.live = False
+        feeds, self._feeds = list(self._feeds.values()), {}
+        for task in feeds:
+            task.cancel()
+        for task in feeds:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def get_stats(self) -> Dict:
+        """Resting orders per symbol plus tick and fill counters."""
+        return {
+            "symbols": len(self._books),
+            "feeds": len(self._feeds),
+            "resting": {
+                symbol: sum(ladder.live_count() for ladder in book.ladders.values()) + len(book.market)
+                for symbol, book in self._books.items()
+            },
+            "ticks": self.ticks,
+            "fills": self.fills,
+            "skipped_quotes": self.skipped_quotes,
+        }
+
+
+paper_trading_engine = PaperTradingEngine()
@@ -2,7 +2,7 @@
 Base Strategy Class - Foundation for trading algorithms
 """
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import Dict, Optional, Sequence
 from datetime import datetime
 
 class StrategyBase(ABC):
@@ -24,12 +24,15 @@ class StrategyBase(ABC):
         self.is_running = False
     
     @abstractmethod
-    async def analyze(self, data: List[Dict]) -> Dict:
+    async def analyze(self, data: Sequence[Dict]) -> Dict:
         """
         Analyze market data and generate signals.
         
         Args:
-            data: OHLCV data
+            data: OHLCV candles, oldest first. A list of candle dicts
+                (backtests) or a CandleView (live runner): indexing and
+                iteration give candle dicts, `data.columns` gives the numpy
+                columns. Treat it as read-only.
             
         Returns:
             Dictionary with analysis results and signals
@@ -63,12 +66,12 @@ class StrategyBase(ABC):
         """
         pass
     
-    async def run(self, data: List[Dict]) -> Optional[Dict]:
+    async def run(self, data: Sequence[Dict]) -> Optional[Dict]:
         """
         Execute strategy logic.
         
         Args:
-            data: OHLCV data
+            data: OHLCV candles (see `analyze`)
             
         Returns:
             Trading signal if generated, None otherwise
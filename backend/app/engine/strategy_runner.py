@@ -0,0 +1,456 @@
+"""
+Strategy Runner - Live scheduling of active strategies over shared bar feeds
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple, Type
+
+import asyncpg
+import numpy as np
+
+from app.core.config import settings
+from app.core.serialization import json_codec
+from app.engine.strategy_base import StrategyBase
+from app.services.candle_store import COLUMN_DTYPES, COLUMNS, CandleStore, CandleView, candle_store
+from app.services.quote_stream import FinnhubTradeStream, QuoteBus, quote_bus, quote_price, trade_stream
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STRATEGIES_SQL = """
+SELECT id, name, symbol, timeframe, parameters
+FROM trading.strategies
+WHERE is_active
+"""
+
+TIMEFRAME_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# Registered strategy classes, keyed by `parameters["class"]` or the strategy name
+STRATEGY_CLASSES: Dict[str, Type[StrategyBase]] = {}
+
+SignalListener = Callable[[StrategyBase, Dict], None]
+FeedKey = Tuple[str, str]
+
+
+def register_strategy(key: str):
+    """Class decorator making a StrategyBase subclass loadable from trading.strategies."""
+    def decorator(cls: Type[StrategyBase]) -> Type[StrategyBase]:
+        STRATEGY_CLASSES[key] = cls
+        return cls
+    return decorator
+
+
+async def fetch_active_rows(database_url: Optional[str] = None) -> List[Dict]:
+    """Active rows of trading.strategies as plain dicts."""
+    conn = await asyncpg.connect(database_url or settings.DATABASE_URL)
+    try:
+        rows = await conn.fetch(ACTIVE_STRATEGIES_SQL)
+    finally:
+        await conn.close()
+    return [dict(row) for row in rows]
+
+
+def timeframe_seconds(timeframe: str) -> int:
+    """Bar length of a timeframe such as '1m', '15m', '4h' or '1d'."""
+    try:
+        return int(timeframe[:-1]) * TIMEFRAME_UNITS[timeframe[-1].lower()]
+    except (KeyError, ValueError):
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+
+
+class BarRing:
+    """
+    Fixed-size columnar ring buffer of closed bars.
+
+    Every bar is written twice, at `i` and `i + capacity`, so the latest
+    bars are always one contiguous slice and `view()` is zero-copy. A view
+    is only valid until the next bar is appended (which may overwrite its
+    slots); `snapshot()` copies the window for readers that outlive that.
+    """
+
+    __slots__ = ("capacity", "columns", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(2 * capacity, dtype=COLUMN_DTYPES[name]) for name in COLUMNS}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    @property
+    def last_time(self) -> Optional[int]:
+        return int(self.columns["time"][(self.count - 1) % self.capacity]) if self.count else None
+
+    def append(self, bar: Tuple[int, float, float, float, float, float]) -> None:
+        i = self.count % self.capacity
+        for name, value in zip(COLUMNS, bar):
+            column = self.columns[name]
+            column[i] = column[i + self.capacity] = value
+        self.count += 1
+
+    def view(self) -> CandleView:
+        n = len(self)
+        start = self.count % self.capacity if self.count >= self.capacity else 0
+        return CandleView({name: col[start:start + n] for name, col in self.columns.items()})
+
+    def snapshot(self) -> CandleView:
+        """Copy of the current window, unaffected by later appends."""
+        return CandleView({name: col.copy() for name, col in self.view().columns.items()})
+
+
+class _Feed:
+    """One (symbol, timeframe): the shared ring, the forming bar and its strategies."""
+
+    __slots__ = ("symbol", "timeframe", "seconds", "ring", "strategies", "bar_start", "bar")
+
+    def __init__(self, symbol: str, timeframe: str, capacity: int):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.seconds = timeframe_seconds(timeframe)
+        self.ring = BarRing(capacity)
+        self.strategies: List[StrategyBase] = []
+        self.bar_start: Optional[int] = None  # open time of the forming bar
+        self.bar: Optional[List[float]] = None  # [open, high, low, close, volume]
+
+
+class StrategyRunner:
+    """
+    Runs active strategies live over shared bar feeds.
+
+    Strategies are grouped by (symbol, timeframe). Each group has one
+    fixed-size ring of closed bars and one forming bar, built from the
+    QuoteBus ticks of the symbol, so memory and per-tick work grow with
+    distinct feeds rather than strategies. When a bar closes — on the first
+    tick of the next period, or on the timeframe's clock for quiet
+    symbols — every running strategy on the feed is woken once with one
+    shared copy of the ring window (a strategy may still be analyzing it
+    when the next bar lands). Strategies run concurrently (bounded by
+    STRATEGY_MAX_CONCURRENCY); one still busy with the previous bar skips
+    the new one. Signals are logged and go to the registered signal
+    listeners.
+
+    The runner holds an upstream trade subscription (`stream.acquire`)
+    for every symbol it has feeds on, so bars form whether or not a
+    client is watching the symbol.
+
+    Active strategies are loaded from `trading.strategies` and instantiated
+    from classes registered with `register_strategy`. Bars are aligned to
+    UTC epoch multiples of the timeframe.
+    """
+
+    def __init__(
+        self,
+        bus: Optional[QuoteBus] = None,
+        store: Optional[CandleStore] = None,
+        database_url: Optional[str] = None,
+        ring_size: Optional[int] = None,
+        stream: Optional[FinnhubTradeStream] = None,
+        subscribe_upstream: bool = True,
+    ):
+        """Initialize strategy runner."""
+        self.bus = bus or quote_bus
+        self.stream = stream or trade_stream
+        self.subscribe_upstream = subscribe_upstream
+        self._streamed: Set[str] = set()
+        self.store = store or candle_store
+        self.database_url = database_url or settings.DATABASE_URL
+        self.ring_size = ring_size or settings.STRATEGY_RING_SIZE
+        self._feeds: Dict[FeedKey, _Feed] = {}
+        self._by_symbol: Dict[str, List[_Feed]] = {}
+        self._by_id: Dict[int, StrategyBase] = {}
+        self._busy: Set[int] = set()  # id() of strategies still running
+        self._listeners: List[SignalListener] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._clocks: Dict[int, asyncio.Task] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self._reloader: Optional[asyncio.Task] = None
+        self._attached = False
+        self._listening = False
+        self.bars_closed = 0
+        self.wakeups = 0
+        self.skipped = 0
+        self.errors = 0
+        self.signals = 0
+
+    def add_signal_listener(self, callback: SignalListener) -> None:
+        """Register a callback(strategy, signal) invoked for every signal."""
+        self._listeners.append(callback)
+
+    # --- Strategies and feeds ---
+
+    def add_strategy(self, strategy: StrategyBase) -> None:
+        """Schedule a strategy on its (symbol, timeframe) feed."""
+        symbol = strategy.symbol.upper()
+        key = (symbol, strategy.timeframe)
+        feed = self._feeds.get(key)
+        if feed is None:
+            feed = self._feeds[key] = _Feed(symbol, strategy.timeframe, self.ring_size)
+            self._by_symbol.setdefault(symbol, []).append(feed)
+            self._hold(symbol)
+            self._seed(feed)
+            self._ensure_clock(feed.seconds)
+        feed.strategies.append(strategy)
+        strategy.start()
+
+    def remove_strategy(self, strategy: StrategyBase) -> None:
+        """Stop a strategy and drop its feed once no strategy uses it."""
+        strategy.stop()
+        key = (strategy.symbol.upper(), strategy.timeframe)
+        feed = self._feeds.get(key)
+        if feed is None or strategy not in feed.strategies:
+            return
+        feed.strategies.remove(strategy)
+        if not feed.strategies:
+            del self._feeds[key]
+            feeds = self._by_symbol[feed.symbol]
+            feeds.remove(feed)
+            if not feeds:
+                del self._by_symbol[feed.symbol]
+                self._unhold(feed.symbol)
+
+    def _hold(self, symbol: str) -> None:
+        """Keep the symbol subscribed upstream while the runner is attached."""
+        if self.subscribe_upstream and self._attached and symbol not in self._streamed:
+            self._streamed.add(symbol)
+            asyncio.ensure_future(self.stream.acquire(symbol))
+
+    def _unhold(self, symbol: str) -> None:
+        if symbol in self._streamed:
+            self._streamed.discard(symbol)
+            asyncio.ensure_future(self.stream.release(symbol))
+
+    def _seed(self, feed: _Feed) -> None:
+        """Backfill the ring from the local candle store when it has the series."""
+        if not self.store.exists(feed.symbol, feed.timeframe):
+            return
+        try:
+            history = self.store.open(feed.symbol, feed.timeframe, readonly=True).tail(feed.ring.capacity)
+        except Exception as e:
+            logger.warning("Seeding %s %s from the candle store failed: %s", feed.symbol, feed.timeframe, e)
+            return
+        for i in range(len(history)):
+            feed.ring.append(tuple(history.columns[name][i] for name in COLUMNS))
+
+    # --- Bars ---
+
+    def on_tick(self, symbol: str, price: float, timestamp: Optional[float] = None, volume: float = 0.0) -> None:
+        """Fold a trade or quote into the forming bar of every feed on the symbol."""
+        feeds = self._by_symbol.get(symbol.upper())
+        if not feeds or not price:
+            return
+        now = time.time() if timestamp is None else timestamp
+        for feed in feeds:
+            start = int(now // feed.seconds) * feed.seconds
+            if feed.bar is not None and start > feed.bar_start:
+                self._close(feed)
+            bar = feed.bar
+            if bar is None:
+                feed.bar_start, feed.bar = start, [price, price, price, price, volume]
+            else:
+                if price > bar[1]:
+                    bar[1] = price
+                if price < bar[2]:
+                    bar[2] = price
+                bar[3] = price
+                bar[4] += volume
+
+    def on_quote(self, symbol: str, quote: Dict) -> None:
+        """QuoteBus listener."""
+        self.on_tick(symbol, quote_price(quote))
+
+    def _close(self, feed: _Feed) -> None:
+        """Append the forming bar to the ring and wake the feed's strategies."""
+        if feed.bar is None:
+            return
+        feed.ring.append((feed.bar_start, *feed.bar))
+        feed.bar = None
+        self.bars_closed += 1
+        self._wake(feed)
+
+    def close_due(self, seconds: int, now: Optional[float] = None) -> int:
+        """Close forming bars of `seconds`-long feeds whose period has ended."""
+        now = time.time() if now is None else now
+        closed = 0
+        for feed in list(self._feeds.values()):
+            if feed.seconds == seconds and feed.bar is not None and feed.bar_start + seconds <= now:
+                self._close(feed)
+                closed += 1
+        return closed
+
+    async def _clock(self, seconds: int) -> None:
+        """Close quiet feeds of one timeframe at each bar boundary."""
+        while True:
+            boundary = (int(time.time() // seconds) + 1) * seconds
+            await asyncio.sleep(boundary + settings.STRATEGY_BAR_CLOSE_GRACE - time.time())
+            if not any(feed.seconds == seconds for feed in self._feeds.values()):
+                del self._clocks[seconds]
+                return
+            self.close_due(seconds)
+
+    def _ensure_clock(self, seconds: int) -> None:
+        if self._attached and seconds not in self._clocks:
+            self._clocks[seconds] = asyncio.ensure_future(self._clock(seconds))
+
+    # --- Dispatch ---
+
+    def _wake(self, feed: _Feed) -> None:
+        if not feed.strategies:
+            return
+        # Copied once per close: the ring slots are reused by the next bar
+        view = feed.ring.snapshot()
+        for strategy in feed.strategies:
+            if not strategy.is_running:
+                continue
+            if id(strategy) in self._busy:
+                self.skipped += 1
+                continue
+            self._busy.add(id(strategy))
+            task = asyncio.ensure_future(self._run_strategy(strategy, view))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _run_strategy(self, strategy: StrategyBase, view: CandleView) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.STRATEGY_MAX_CONCURRENCY)
+        try:
+            async with self._semaphore:
+                self.wakeups += 1
+                signal = await strategy.run(view)
+            if signal:
+                self.signals += 1
+                logger.info(
+                    "Signal from strategy %s (%s %s): %s",
+                    getattr(strategy, "id", strategy.name), strategy.symbol, strategy.timeframe, signal.get("action"),
+                )
+                for callback in self._listeners:
+                    try:
+                        callback(strategy, signal)
+                    except Exception as e:
+                        logger.warning("Signal listener failed for %s: %s", strategy.name, e)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Strategy %s on %s %s failed: %s", strategy.name, strategy.symbol, strategy.timeframe, e)
+        finally:
+            self._busy.discard(id(strategy))
+
+    # --- Active strategies ---
+
+    @staticmethod
+    def build(row) -> Optional[StrategyBase]:
+        """Instantiate a strategy row from trading.strategies, None if its class is unknown."""
+        parameters = row["parameters"] or {}
+        if isinstance(parameters, str):
+            parameters = json_codec().decode(parameters)
+        cls = STRATEGY_CLASSES.get(parameters.get("class", row["name"]))
+        if cls is None:
+            return None
+        strategy = cls(row["name"], row["symbol"], row["timeframe"])
+        strategy.id = row["id"]
+        strategy.parameters = parameters
+        return strategy
+
+    def add_row(self, row) -> bool:
+        """Schedule the strategy of one trading.strategies row; False if it cannot be loaded."""
+        strategy_id = row["id"]
+        if strategy_id in self._by_id:
+            return True
+        try:
+            timeframe_seconds(row["timeframe"])
+            strategy = self.build(row)
+        except Exception as e:
+            logger.warning("Cannot load strategy %s (%s): %s", strategy_id, row["name"], e)
+            return False
+        if strategy is None:
+            logger.warning("No registered class for strategy %s (%s)", strategy_id, row["name"])
+            return False
+        self._by_id[strategy_id] = strategy
+        self.add_strategy(strategy)
+        return True
+
+    def remove_id(self, strategy_id: int) -> None:
+        """Unschedule a strategy loaded from trading.strategies."""
+        strategy = self._by_id.pop(strategy_id, None)
+        if strategy is not None:
+            self.remove_strategy(strategy)
+
+    def sync(self, rows) -> int:
+        """Make the scheduled strategies match a set of active rows."""
+        active = {row["id"]: row for row in rows}
+        for strategy_id in [sid for sid in self._by_id if sid not in active]:
+            self.remove_id(strategy_id)
+        for row in active.values():
+            self.add_row(row)
+        return len(self._by_id)
+
+    async def load_active(self) -> int:
+        """Sync scheduled strategies with the active rows in trading.strategies."""
+        return self.sync(await fetch_active_rows(self.database_url))
+
+    async def _reload_loop(self) -> None:
+        while True:
+            try:
+                await self.load_active()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Loading active strategies failed: %s", e)
+            await asyncio.sleep(settings.STRATEGY_RELOAD_INTERVAL)
+
+    def start(self, load_active: bool = True) -> None:
+        """
+        Follow the quote bus, start bar clocks and keep active strategies loaded.
+
+        With `load_active=False` strategies are only added by the caller
+        (e.g. a shard worker fed by the shard supervisor).
+        """
+        if self._attached:
+            return
+        self._attached = True
+        if not self._listening:
+            self.bus.add_listener(self.on_quote)
+            self._listening = True
+        for seconds in {feed.seconds for feed in self._feeds.values()}:
+            self._ensure_clock(seconds)
+        for symbol in list(self._by_symbol):
+            self._hold(symbol)
+        if load_active:
+            self._reloader = asyncio.ensure_future(self._reload_loop())
+
+    async def stop(self) -> None:
+        """Stop clocks and the reloader, waiting for running strategies."""
+        tasks = list(self._clocks.values()) + ([self._reloader] if self._reloader else [])
+        self._clocks.clear()
+        self._reloader = None
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        for symbol in list(self._streamed):
+            self._streamed.discard(symbol)
+            await self.stream.release(symbol)
+        self._attached = False
+
+    def get_stats(self) -> Dict:
+        """Feeds, strategies and dispatch counters."""
+        return {
+            "feeds": len(self._feeds),
+            "strategies": sum(len(feed.strategies) for feed in self._feeds.values()),
+            "ring_bytes": sum(
+                sum(col.nbytes for col in feed.ring.columns.values()) for feed in self._feeds.values()
+            ),
+            "bars_closed": self.bars_closed,
+            "wakeups": self.wakeups,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "signals": self.signals,
+            "busy": len(self._busy),
+        }
+
+
+strategy_runner = StrategyRunner()
@@ -0,0 +1,493 @@
+"""
+Strategy Shards - Live strategies sharded across worker processes by symbol
+"""
+import asyncio
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.cache_metrics import LATENCY_BUCKETS_MS, Histogram
+from app.services.quote_stream import FinnhubTradeStream, QuoteBus, quote_bus, quote_price, trade_stream
+
+logger = logging.getLogger(__name__)
+
+# Worker stats / heartbeat period
+STATS_INTERVAL = 1.0
+# Inbox poll timeout of a worker's reader thread (bounds its heartbeat jitter)
+READ_TIMEOUT = 0.5
+MAX_RESTART_DELAY = 30.0
+
+Tick = Tuple[str, float, float]  # (symbol, price, timestamp)
+ShardSignalListener = Callable[[int, Dict], None]
+
+
+def shard_of(symbol: str, shards: int) -> int:
+    """Stable shard for a symbol (same in every process, unlike hash())."""
+    return zlib.crc32(symbol.upper().encode()) % shards
+
+
+def import_strategy_modules(modules: List[str]) -> None:
+    """Import the modules that register strategy classes."""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning("Cannot import strategy module %s: %s", name, e)
+
+
+# --- Worker process ---
+
+def _shard_main(shard: int, inbox: mp.Queue, outbox: mp.Queue, modules: List[str]) -> None:
+    """Entry point of a shard process: one StrategyRunner on its own event loop."""
+    import_strategy_modules(modules)
+    try:
+        asyncio.run(_ShardWorker(shard, inbox, outbox).run())
+    except KeyboardInterrupt:
+        pass
+
+
+class _ShardWorker:
+    """Applies supervisor messages to a local StrategyRunner and reports back."""
+
+    def __init__(self, shard: int, inbox: mp.Queue, outbox: mp.Queue):
+        from app.engine.strategy_runner import StrategyRunner
+
+        self.shard = shard
+        self.inbox = inbox
+        self.outbox = outbox
+        # The supervisor holds the upstream subscriptions for the whole shard
+        self.runner = StrategyRunner(bus=QuoteBus(), subscribe_upstream=False)
+        self.runner.add_signal_listener(self._emit)
+        self.tick_lag_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.ticks = 0
+        self._stopped: Optional[asyncio.Future] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._last_beat = 0.0
+
+    def _emit(self, strategy, signal: Dict) -> None:
+        self.outbox.put(("signal", self.shard, getattr(strategy, "id", None), signal, time.time()))
+
+    def _handle(self, message: Tuple) -> None:
+        kind = message[0]
+        if kind == "ticks":
+            _, sent_at, ticks = message
+            self.tick_lag_ms.observe((time.time() - sent_at) * 1000)
+            self.ticks += len(ticks)
+            for symbol, price, timestamp in ticks:
+                self.runner.on_tick(symbol, price, timestamp)
+        elif kind == "add":
+            self.runner.add_row(message[1])
+        elif kind == "remove":
+            self.runner.remove_id(message[1])
+        elif kind == "stop" and not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def _beat(self) -> None:
+        """Send a heartbeat at most once per STATS_INTERVAL (reader thread only)."""
+        now = time.time()
+        if now - self._last_beat >= STATS_INTERVAL:
+            self._last_beat = now
+            self.outbox.put(("heartbeat", self.shard, now))
+
+    def _read(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Reader thread: hand inbox messages to the event loop's bounded queue.
+
+        The thread waits while that queue is full, so a slow shard leaves its
+        inbox full and the supervisor drops tick batches instead of the
+        backlog piling up in this process.
+
+        Heartbeats come from here rather than from the event loop, so a
+        CPU-heavy `analyze` that stalls the loop does not get a busy shard
+        restarted; only a dead or wedged process stops them.
+        """
+        while not self._stopped.done():
+            self._beat()
+            try:
+                message = self.inbox.get(timeout=READ_TIMEOUT)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                message = ("stop",)
+            try:
+                future = asyncio.run_coroutine_threadsafe(self._queue.put(message), loop)
+                while True:
+                    try:
+                        future.result(timeout=READ_TIMEOUT)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        self._beat()  # loop busy or queue full: still alive
+            except (RuntimeError, concurrent.futures.CancelledError):
+                return  # loop closed or shutting down
+            if message[0] == "stop":
+                return
+
+    async def _consume(self) -> None:
+        while True:
+            self._handle(await self._queue.get())
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.outbox.put(("stats", self.shard, {
+                **self.runner.get_stats(),
+                "ticks": self.ticks,
+                "tick_lag_ms": self.tick_lag_ms.snapshot(),
+                "at": time.time(),
+            }))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+        self._queue = asyncio.Queue(maxsize=settings.STRATEGY_SHARD_QUEUE_SIZE)
+        self.runner.start(load_active=False)
+        reader = threading.Thread(target=self._read, args=(loop,), daemon=True)
+        reader.start()
+        consumer = asyncio.ensure_future(self._consume())
+        reporter = asyncio.ensure_future(self._report())
+        try:
+            await self._stopped
+        finally:
+            consumer.cancel()
+            reporter.cancel()
+            await self.runner.stop()
+
+
+# --- Supervisor ---
+
+class _Shard:
+    """Supervisor-side state of one worker process."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[mp.Process] = None
+        self.inbox: Optional[mp.Queue] = None
+        self.outbox: Optional[mp.Queue] = None
+        self.generation = 0
+        self.rows: Dict[int, Dict] = {}  # strategy id -> row assigned to this shard
+        self.pending: List[Tick] = []
+        self.control: Deque[Tuple] = deque()  # adds/removes waiting for inbox room
+        self.started_at = 0.0
+        self.last_heartbeat = 0.0
+        self.restarts = 0
+        self.dropped = 0
+        self.signals = 0
+        self.stats: Dict = {}
+        self.signal_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+
+
+class StrategyShardSupervisor:
+    """
+    Runs live strategies across `STRATEGY_SHARDS` worker processes.
+
+    Strategies are assigned to a shard by a stable hash of their symbol,
+    so every feed lives in exactly one process and one CPU-heavy
+    `analyze` only delays its own shard. Each worker runs a
+    StrategyRunner on its own event loop. The supervisor follows the
+    QuoteBus, buffers ticks per shard and ships them every
+    `STRATEGY_SHARD_BATCH_INTERVAL` as one message over that shard's
+    multiprocessing queue; strategy adds/removes travel the same way, so
+    they stay ordered with the ticks. Signals, once-a-second stats and
+    heartbeats (sent by the worker's reader thread, so a busy event loop
+    does not look hung) come back on a per-shard result queue. The flush
+    loop sleeps while no shard has buffered ticks or a control backlog.
+
+    A monitor restarts shards whose process died or whose heartbeat is
+    older than `STRATEGY_SHARD_HEARTBEAT_TIMEOUT` (with backoff), on fresh
+    queues, and re-sends their strategies. Per shard it reports tick lag
+    (supervisor send to worker apply), signal latency (worker emit to
+    supervisor), dropped batches and restarts.
+
+    The event loop never blocks on a shard: adds/removes wait in a
+    per-shard backlog until the inbox has room (retried before every
+    tick batch, which is dropped while the backlog is non-empty), and
+    the upstream trade subscriptions for the assigned strategies are
+    held here rather than in the workers.
+    """
+
+    def __init__(
+        self,
+        shards: Optional[int] = None,
+        bus: Optional[QuoteBus] = None,
+        modules: Optional[List[str]] = None,
+        database_url: Optional[str] = None,
+        stream: Optional[FinnhubTradeStream] = None,
+    ):
+        """Initialize shard supervisor."""
+        self.shards = [_Shard(i) for i in range(shards or settings.STRATEGY_SHARDS)]
+        self.bus = bus or quote_bus
+        self.stream = stream or trade_stream
+        self.modules = list(modules if modules is not None else settings.STRATEGY_MODULES)
+        self.database_url = database_url or settings.DATABASE_URL
+        self._ctx = mp.get_context("spawn")
+        self._listeners: List[ShardSignalListener] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._listening = False
+        self._running = False
+        self._streamed: Dict[int, str] = {}  # strategy id -> symbol held upstream
+        self._flush_needed = asyncio.Event()
+
+    def add_signal_listener(self, callback: ShardSignalListener) -> None:
+        """Register a callback(strategy_id, signal) invoked for every signal."""
+        self._listeners.append(callback)
+
+    def shard_for(self, symbol: str) -> _Shard:
+        return self.shards[shard_of(symbol, len(self.shards))]
+
+    # --- Processes ---
+
+    def _spawn(self, shard: _Shard) -> None:
+        """Start (or restart) a shard process on fresh queues and re-send its strategies."""
+        shard.generation += 1
+        shard.inbox = self._ctx.Queue(maxsize=settings.STRATEGY_SHARD_QUEUE_SIZE)
+        shard.outbox = self._ctx.Queue()
+        shard.process = self._ctx.Process(
+            target=_shard_main,
+            args=(shard.index, shard.inbox, shard.outbox, self.modules),
+            name=f"strategy-shard-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+        shard.started_at = shard.last_heartbeat = time.time()
+        shard.pending = []
+        shard.control = deque(("add", row) for row in shard.rows.values())
+        self._send(shard)
+        threading.Thread(
+            target=self._read, args=(shard, shard.generation, shard.outbox), daemon=True
+        ).start()
+
+    def _read(self, shard: _Shard, generation: int, outbox: mp.Queue) -> None:
+        """Reader thread for one shard generation's result queue."""
+        while self._running and shard.generation == generation:
+            try:
+                message = outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._on_message, shard, message)
+
+    def _send(self, shard: _Shard, message: Optional[Tuple] = None) -> bool:
+        """
+        Queue a control message and push the backlog into the inbox without blocking.
+
+        Returns:
+            True once the shard's backlog is empty
+        """
+        if message is not None:
+            shard.control.append(message)
+        while shard.control:
+            try:
+                shard.inbox.put_nowait(shard.control[0])
+            except queue.Full:
+                self._flush_needed.set()  # the flush loop retries the backlog
+                return False
+            shard.control.popleft()
+        return True
+
+    def _on_message(self, shard: _Shard, message: Tuple) -> None:
+        kind = message[0]
+        shard.last_heartbeat = time.time()
+        if kind == "stats":
+            shard.stats = message[2]
+        elif kind == "signal":
+            _, _, strategy_id, signal, emitted_at = message
+            shard.signal_latency_ms.observe((time.time() - emitted_at) * 1000)
+            shard.signals += 1
+            logger.info(
+                "Strategy %s signal on shard %s: %s %s",
+                strategy_id, shard.index, signal.get("action"), signal.get("symbol"),
+            )
+            for callback in self._listeners:
+                try:
+                    callback(strategy_id, signal)
+                except Exception as e:
+                    logger.warning("Signal listener failed for strategy %s: %s", strategy_id, e)
+
+    def _kill(self, shard: _Shard) -> None:
+        process = shard.process
+        if process is not None and process.is_alive():
+            process.kill()
+            process.join(timeout=1)
+
+    async def _monitor(self) -> None:
+        """Restart dead or unresponsive shards with exponential backoff."""
+        while True:
+            await asyncio.sleep(settings.STRATEGY_SHARD_CHECK_INTERVAL)
+            now = time.time()
+            for shard in self.shards:
+                dead = shard.process is None or not shard.process.is_alive()
+                hung = now - shard.last_heartbeat > settings.STRATEGY_SHARD_HEARTBEAT_TIMEOUT
+                if not (dead or hung):
+                    continue
+                delay = min(MAX_RESTART_DELAY, 2 ** min(shard.restarts, 16) - 1)
+                if now - shard.started_at < delay:
+                    continue
+                logger.warning(
+                    "Restarting strategy shard %s (%s)", shard.index, "exited" if dead else "no heartbeat"
+                )
+                self._kill(shard)
+                shard.restarts += 1
+                self._spawn(shard)
+
+    # --- Ticks ---
+
+    def on_quote(self, symbol: str, quote: Dict) -> None:
+        """QuoteBus listener: buffer the tick for the symbol's shard."""
+        if not self._running:
+            return
+        shard = self.shard_for(symbol)
+        price = quote_price(quote)
+        # A shard without strategies has nothing to feed
+        if price and shard.rows:
+            shard.pending.append((symbol.upper(), price, time.time()))
+            self._flush_needed.set()
+
+    def flush(self) -> None:
+        """Ship buffered ticks, one batch message per shard."""
+        sent_at = time.time()
+        for shard in self.shards:
+            ready = self._send(shard)
+            if not shard.pending:
+                continue
+            ticks, shard.pending = shard.pending, []
+            if not ready:
+                # Adds/removes go first so they stay ordered with the ticks
+                shard.dropped += 1
+                continue
+            try:
+                shard.inbox.put_nowait(("ticks", sent_at, ticks))
+            except queue.Full:
+                # The shard is behind; its bars catch up from later ticks
+                shard.dropped += 1
+
+    async def _flush_loop(self) -> None:
+        """Flush every batch interval while there is work, sleep on the tick event otherwise."""
+        while True:
+            if not any(shard.control for shard in self.shards):
+                # Nothing to retry: idle until a tick is buffered or a send backs up
+                await self._flush_needed.wait()
+            await asyncio.sleep(settings.STRATEGY_SHARD_BATCH_INTERVAL)
+            self._flush_needed.clear()
+            self.flush()
+
+    # --- Strategies ---
+
+    def _hold(self, strategy_id: int, symbol: str) -> None:
+        """Keep a strategy's symbol subscribed upstream while the supervisor runs."""
+        if self._running and strategy_id not in self._streamed:
+            self._streamed[strategy_id] = symbol
+            asyncio.ensure_future(self.stream.acquire(symbol))
+
+    def _unhold(self, strategy_id: int) -> None:
+        symbol = self._streamed.pop(strategy_id, None)
+        if symbol is not None:
+            asyncio.ensure_future(self.stream.release(symbol))
+
+    def sync(self, rows: List[Dict]) -> int:
+        """Assign active strategy rows to shards, sending adds and removes."""
+        active = {row["id"]: row for row in rows}
+        for shard in self.shards:
+            for strategy_id in [sid for sid in shard.rows if sid not in active]:
+                del shard.rows[strategy_id]
+                self._unhold(strategy_id)
+                self._send(shard, ("remove", strategy_id))
+        for strategy_id, row in active.items():
+            shard = self.shard_for(row["symbol"])
+            if strategy_id not in shard.rows:
+                shard.rows[strategy_id] = row
+                self._hold(strategy_id, row["symbol"])
+                self._send(shard, ("add", row))
+        return len(active)
+
+    async def _reload_loop(self) -> None:
+        from app.engine.strategy_runner import fetch_active_rows
+
+        while True:
+            try:
+                self.sync(await fetch_active_rows(self.database_url))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Loading active strategies failed: %s", e)
+            await asyncio.sleep(settings.STRATEGY_RELOAD_INTERVAL)
+
+    # --- Lifecycle ---
+
+    def start(self, load_active: bool = True) -> None:
+        """Spawn the shards and start the flush, monitor and reload loops."""
+        if self._running:
+            return
+        self._running = True
+        self._loop = asyncio.get_running_loop()
+        import_strategy_modules(self.modules)
+        for shard in self.shards:
+            self._spawn(shard)
+            for strategy_id, row in shard.rows.items():
+                self._hold(strategy_id, row["symbol"])
+        if not self._listening:
+            self.bus.add_listener(self.on_quote)
+            self._listening = True
+        self._tasks = [asyncio.ensure_future(self._flush_loop()), asyncio.ensure_future(self._monitor())]
+        if load_active:
+            self._tasks.append(asyncio.ensure_future(self._reload_loop()))
+
+    async def stop(self) -> None:
+        """Stop the loops and the shard processes."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for shard in self.shards:
+            if shard.process is not None and shard.process.is_alive():
+                try:
+                    shard.inbox.put_nowait(("stop",))
+                except queue.Full:
+                    pass  # killed after the join timeout below
+        deadline = time.time() + 5
+        for shard in self.shards:
+            if shard.process is not None:
+                await asyncio.to_thread(shard.process.join, max(0.0, deadline - time.time()))
+                self._kill(shard)
+        self._running = False
+        for strategy_id, symbol in list(self._streamed.items()):
+            del self._streamed[strategy_id]
+            await self.stream.release(symbol)
+
+    def get_stats(self) -> Dict:
+        """Per-shard liveness, lag, dispatch counters and restarts."""
+        now = time.time()
+        return {
+            "shards": [
+                {
+                    "shard": shard.index,
+                    "alive": shard.process is not None and shard.process.is_alive(),
+                    "pid": shard.process.pid if shard.process is not None else None,
+                    "assigned": len(shard.rows),
+                    "restarts": shard.restarts,
+                    "dropped_batches": shard.dropped,
+                    "queued_control": len(shard.control),
+                    "signals": shard.signals,
+                    "heartbeat_age": round(now - shard.last_heartbeat, 3) if shard.last_heartbeat else None,
+                    "signal_latency_ms": shard.signal_latency_ms.snapshot(),
+                    **shard.stats,
+                }
+                for shard in self.shards
+            ],
+        }
+
+
+strategy_shards = StrategyShardSupervisor()
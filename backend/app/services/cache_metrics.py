@@ -0,0 +1,113 @@
+"""
+Cache Metrics - Per-key-family counters and histograms for CacheService
+"""
+import bisect
+from typing import Dict, List, Sequence
+
+# Bucket upper bounds; the last bucket catches everything above
+LATENCY_BUCKETS_MS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+SIZE_BUCKETS_BYTES = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+COUNTERS = ("hits", "l1_hits", "misses", "stale_hits", "errors", "sets")
+
+
+class Histogram:
+    """Fixed-bucket histogram with cheap O(log buckets) observations."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """Record one observation."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (0-100), capped at the max seen."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict:
+        """Summary plus per-bucket counts keyed by upper bound."""
+        buckets = {str(bound): n for bound, n in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "max": round(self.max, 4),
+            "p50": round(self.percentile(50), 4),
+            "p90": round(self.percentile(90), 4),
+            "p99": round(self.percentile(99), 4),
+            "buckets": buckets,
+        }
+
+
+class FamilyMetrics:
+    """Counters and histograms for one key family (quote, indicators, ...)."""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+        self.get_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.set_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.payload_bytes = Histogram(SIZE_BUCKETS_BYTES)
+
+    def snapshot(self) -> Dict:
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        served = self.counters["hits"] + self.counters["stale_hits"]
+        return {
+            **self.counters,
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            "get_latency_ms": self.get_latency_ms.snapshot(),
+            "set_latency_ms": self.set_latency_ms.snapshot(),
+            "payload_bytes": self.payload_bytes.snapshot(),
+        }
+
+
+class CacheMetrics:
+    """Metrics registry keyed by family (the key prefix before ':')."""
+
+    def __init__(self):
+        self.families: Dict[str, FamilyMetrics] = {}
+
+    @staticmethod
+    def family_of(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    def family(self, key: str) -> FamilyMetrics:
+        name = self.family_of(key)
+        metrics = self.families.get(name)
+        if metrics is None:
+            metrics = self.families[name] = FamilyMetrics()
+        return metrics
+
+    def incr(self, key: str, counter: str, amount: int = 1):
+        self.family(key).counters[counter] += amount
+
+    def observe_get(self, key: str, elapsed_ms: float):
+        self.family(key).get_latency_ms.observe(elapsed_ms)
+
+    def observe_set(self, key: str, elapsed_ms: float):
+        self.family(key).set_latency_ms.observe(elapsed_ms)
+
+    def observe_size(self, key: str, size: int):
+        self.family(key).payload_bytes.observe(size)
+
+    def snapshot(self) -> Dict:
+        return {name: metrics.snapshot() for name, metrics in sorted(self.families.items())}
+
+    def reset(self):
+        self.families.clear()
@@ -2,47 +2,231 @@
 Cache Service - Cache inteligente con Redis
 Basado en análisis de Robinhood: cache eficiente para reducir llamadas a APIs
 """
-import json
+import asyncio
+import functools
+import heapq
+import inspect
 import logging
-from typing import Dict, Optional, Any
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime, timedelta
 import redis.asyncio as redis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+from app.core.serialization import decode_payload, encode_payload
+from app.services.cache_metrics import CacheMetrics
 
 logger = logging.getLogger(__name__)
 
+# Errores que indican que Redis no está disponible (abren el circuit breaker)
+CONNECTION_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError, asyncio.TimeoutError)
+
+
+class LocalTTLCache:
+    """Cache L1 en proceso: LRU acotado por tamaño con expiración por entrada.
+
+    Los valores se comparten entre lectores (no se copian): quien los lea
+    debe tratarlos como de solo lectura.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        """Inicializar cache local"""
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Obtener valor si existe y no expiró"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Como `get`, pero sin cambiar el orden LRU ni borrar nada"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Guardar valor con TTL en segundos, expulsando el menos usado si está lleno"""
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        """Eliminar keys"""
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Vaciar cache local"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class CacheService:
-    """Servicio de cache inteligente con TTL dinámico"""
+    """Servicio de cache inteligente con TTL dinámico.
+
+    Dos niveles: un LRU en proceso (L1) delante de Redis (L2). Las entradas
+    L1 expiran con el mismo TTL que su key en Redis.
+
+    Cada entrada guarda una expiración blanda (fin de la vida fresca) y una
+    dura (el TTL de Redis). Los getters simples solo devuelven datos frescos;
+    `get_or_load` sirve datos viejos mientras revalida en segundo plano.
+
+    Con varios workers, las invalidaciones y los valores frescos de las
+    familias en CACHE_SYNC_FAMILIES se propagan por Redis pub/sub al L1 de
+    los demás procesos.
+
+    Si Redis cae, un circuit breaker con backoff exponencial evita reintentar
+    la conexión en cada petición: el servicio funciona solo con L1 hasta que
+    la sonda de salud (o el siguiente intento tras el backoff) reconecta.
+    """
     
     def __init__(self):
         """Inicializar servicio de cache"""
         self.redis_client: Optional[redis.Redis] = None
+        self._pool: Optional[redis.BlockingConnectionPool] = None
         self._connected = False
+        # Circuit breaker: sin intentos de conexión hasta _retry_at
+        self._failures = 0
+        self._retry_at = 0.0
+        self._connect_lock = asyncio.Lock()
+        self._probe: Optional[asyncio.Future] = None
+        self.local = LocalTTLCache(settings.CACHE_L1_MAX_ENTRIES)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._access: Dict[str, Dict] = {}
+        self._max_tracked = max(1, settings.CACHE_L1_MAX_ENTRIES)
+        # Las recargas proactivas gastan una parte del límite de Finnhub
+        self.refresh_limiter = RateLimiter(
+            settings.FINNHUB_RATE_LIMIT_PER_MIN * settings.CACHE_REFRESH_RATE_SHARE / 60
+        )
+        self._refresher: Optional[asyncio.Future] = None
+        self.metrics = CacheMetrics()
+        # Sincronización entre workers (Redis pub/sub)
+        self.worker_id = uuid.uuid4().hex
+        self._sync_task: Optional[asyncio.Future] = None
+        self._update_listeners: Dict[str, List[Callable[[str, Any], None]]] = {}
     
     async def connect(self):
-        """Conectar a Redis"""
-        if self._connected:
+        """Conectar a Redis con un pool compartido.
+
+        No hace nada mientras el circuit breaker está abierto o si otra
+        tarea ya está conectando: quien llama sigue sin cache en vez de
+        esperar un timeout de conexión.
+        """
+        if self._connected or time.time() < self._retry_at or self._connect_lock.locked():
             return
         
-        try:
-            redis_url = getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
-            self.redis_client = await redis.from_url(
-                redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
-            await self.redis_client.ping()
-            self._connected = True
-            logger.info("Redis cache connected")
-        except Exception as e:
-            logger.warning(f"Redis not available, cache disabled: {e}")
-            self._connected = False
+        async with self._connect_lock:
+            try:
+                if self.redis_client is None:
+                    # Payloads son bytes (orjson/msgpack, opcionalmente zstd)
+                    self._pool = redis.BlockingConnectionPool.from_url(
+                        settings.REDIS_URL,
+                        max_connections=settings.REDIS_MAX_CONNECTIONS,
+                        timeout=settings.REDIS_POOL_TIMEOUT,
+                        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+                        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                        decode_responses=False,
+                    )
+                    self.redis_client = redis.Redis(connection_pool=self._pool)
+                await self.redis_client.ping()
+                self._connected = True
+                self._failures = 0
+                self._retry_at = 0.0
+                logger.info("Redis cache connected")
+            except Exception as e:
+                self._trip(e)
     
     async def disconnect(self):
-        """Desconectar de Redis"""
+        """Desconectar de Redis y cerrar el pool"""
+        await self.stop_health_probe()
         if self.redis_client:
-            await self.redis_client.close()
-            self._connected = False
+            await self.redis_client.aclose()
+            self.redis_client = None
+        if self._pool is not None:
+            await self._pool.disconnect()
+            self._pool = None
+        self._connected = False
+    
+    def _trip(self, error: Exception):
+        """Abrir el circuit breaker con backoff exponencial"""
+        self._failures += 1
+        delay = min(
+            settings.REDIS_RETRY_MAX_DELAY,
+            settings.REDIS_RETRY_BASE_DELAY * 2 ** min(self._failures - 1, 16),
+        )
+        self._retry_at = time.time() + delay
+        if self._connected or self._failures == 1:
+            logger.warning(f"Redis not available, cache disabled for {delay:.1f}s: {error}")
+        self._connected = False
+    
+    def _record_failure(self, error: Exception):
+        """Abrir el breaker si el error es de conexión (no por datos inválidos)"""
+        if isinstance(error, CONNECTION_ERRORS):
+            self._trip(error)
+    
+    @property
+    def _probing(self) -> bool:
+        return self._probe is not None and not self._probe.done()
+    
+    async def _available(self) -> bool:
+        """¿Se puede usar Redis ahora?
+
+        Con la sonda de salud activa las peticiones nunca reconectan; sin
+        ella (scripts, tests) se reintenta en línea respetando el backoff.
+        """
+        if not self._connected and not self._probing:
+            await self.connect()
+        return self._connected and self.redis_client is not None
+    
+    async def _health_loop(self, interval: float):
+        """Sonda de salud: PING periódico y reconexión cuando vence el backoff"""
+        while True:
+            if self._connected:
+                await asyncio.sleep(interval)
+                try:
+                    await self.redis_client.ping()
+                except Exception as e:
+                    self._trip(e)
+            else:
+                await asyncio.sleep(max(0.0, self._retry_at - time.time()))
+                await self.connect()
+                if not self._connected:
+                    # connect() no reintenta antes de _retry_at; evitar un bucle activo
+                    await asyncio.sleep(0.1)
+    
+    def start_health_probe(self, interval: Optional[float] = None):
+        """Iniciar la sonda de salud de Redis"""
+        if not self._probing:
+            self._probe = asyncio.ensure_future(
+                self._health_loop(interval or settings.REDIS_HEALTH_CHECK_INTERVAL)
+            )
+    
+    async def stop_health_probe(self):
+        """Detener la sonda de salud de Redis"""
+        if self._probe is not None:
+            self._probe.cancel()
+            try:
+                await self._probe
+            except asyncio.CancelledError:
+                pass
+            self._probe = None
     
     def _get_quote_key(self, symbol: str) -> str:
         """Obtener key de cache para quote"""
@@ -60,160 +244,748 @@ class CacheService:
         """Obtener key de cache para horarios de mercado"""
         return "market:hours"
     
-    async def get_cached_quote(self, symbol: str) -> Optional[Dict]:
-        """Obtener quote del cache con TTL inteligente"""
-        if not self._connected:
-            await self.connect()
+    def quote_ttl(self, at: Optional[float] = None) -> int:
+        """TTL dinámico: corto durante horas de mercado, largo fuera de horas (en `at`, por defecto ahora)"""
+        from app.services.market_hours_service import market_hours_service
+        phase = market_hours_service.calendar.phase(time.time() if at is None else at)
+        if phase == "regular":
+            return 5  # 5 segundos durante mercado abierto
+        elif phase in ("pre_market", "after_hours"):
+            return 30  # 30 segundos en extended hours
+        return 300  # 5 minutos cuando mercado cerrado
+    
+    def ohlcv_ttl(self, resolution: str, at: Optional[float] = None) -> int:
+        """TTL de velas: intradía sigue al TTL de quotes, diarias o mayores duran más"""
+        from app.services.market_hours_service import market_hours_service
+        phase = market_hours_service.calendar.phase(time.time() if at is None else at)
+        if resolution in ("D", "W", "M"):
+            return 300 if phase == "regular" else 3600
+        if phase == "regular":
+            return 30
+        elif phase in ("pre_market", "after_hours"):
+            return 60
+        return 600
+    
+    @staticmethod
+    def _pack(value: Any, soft_expires_at: float) -> bytes:
+        """Serializar el valor junto con su expiración blanda (epoch) con el codec configurado"""
+        return encode_payload({"v": value, "s": soft_expires_at})
+    
+    @staticmethod
+    def _unpack(raw: bytes) -> Tuple[Any, float]:
+        """Deserializar (valor, expiración blanda); acepta cualquier codec y JSON plano"""
+        envelope = decode_payload(raw)
+        return envelope["v"], envelope["s"]
+    
+    def _observe(self, keys: List[str], started: float, kind: str = "get"):
+        """Registrar la latencia de una operación una vez por familia de keys"""
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        observe = self.metrics.observe_get if kind == "get" else self.metrics.observe_set
+        seen = set()
+        for key in keys:
+            family = self.metrics.family_of(key)
+            if family not in seen:
+                seen.add(family)
+                observe(key, elapsed_ms)
+    
+    async def _get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Leer (valor, expiración blanda): primero L1, luego Redis.
+
+        La entrada existe hasta su expiración dura (el TTL de Redis); puede
+        estar ya vencida en blando.
+        """
+        started = time.perf_counter()
+        entry = self.local.get(key)
+        if entry is not None:
+            self.metrics.incr(key, "l1_hits")
+            self._observe([key], started)
+            return entry
         
-        if not self._connected or not self.redis_client:
+        if not await self._available():
             return None
         
         try:
-            key = self._get_quote_key(symbol)
-            cached = await self.redis_client.get(key)
+            # GET + PTTL en un solo round trip para que L1 expire junto con Redis
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            cached, pttl = await pipe.execute()
             if cached:
-                return json.loads(cached)
+                self.metrics.observe_size(key, len(cached))
+                entry = self._unpack(cached)
+                if pttl and pttl > 0:
+                    self.local.set(key, entry, pttl / 1000)
         except Exception as e:
-            logger.warning(f"Error reading cache for {symbol}: {e}")
+            self.metrics.incr(key, "errors")
+            self._record_failure(e)
+            logger.warning(f"Error reading cache key {key}: {e}")
         
-        return None
+        self._observe([key], started)
+        return entry
     
-    async def cache_quote(self, symbol: str, quote: Dict, ttl: Optional[int] = None):
-        """Cachear quote con TTL dinámico"""
-        if not self._connected:
-            await self.connect()
+    async def _get(self, key: str) -> Optional[Any]:
+        """Leer una key solo si sigue fresca"""
+        entry = await self._get_entry(key)
+        if entry is None or entry[1] <= time.time():
+            self.metrics.incr(key, "misses")
+            return None
+        self.metrics.incr(key, "hits")
+        return entry[0]
+    
+    async def _set(self, key: str, value: Any, ttl: int, stale_ttl: int = 0):
+        """Escribir una key en L1 y Redis.
+
+        `ttl` es la vida fresca; la key se conserva `stale_ttl` segundos más
+        para servirse como dato viejo mientras se revalida.
+        """
+        started = time.perf_counter()
+        hard_ttl = ttl + stale_ttl
+        entry = (value, time.time() + ttl)
+        self.local.set(key, entry, hard_ttl)
+        self.metrics.incr(key, "sets")
         
-        if not self._connected or not self.redis_client:
+        if not await self._available():
             return
         
         try:
-            key = self._get_quote_key(symbol)
-            
-            # TTL dinámico: corto durante horas de mercado, largo fuera de horas
-            if ttl is None:
-                from app.services.market_hours_service import MarketHoursService
-                market_service = MarketHoursService()
-                if market_service.is_market_open():
-                    ttl = 5  # 5 segundos durante mercado abierto
-                elif market_service.is_extended_hours():
-                    ttl = 30  # 30 segundos en extended hours
-                else:
-                    ttl = 300  # 5 minutos cuando mercado cerrado
-            
-            await self.redis_client.setex(
-                key,
-                ttl,
-                json.dumps(quote)
-            )
+            payload = self._pack(*entry)
+            self.metrics.observe_size(key, len(payload))
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(key, hard_ttl, payload)
+            if self._is_broadcast(key):
+                pipe.publish(settings.CACHE_SYNC_CHANNEL, self._sync_message(
+                    "set", items=[[key, entry[0], entry[1], hard_ttl]]
+                ))
+            await pipe.execute()
         except Exception as e:
-            logger.warning(f"Error caching quote for {symbol}: {e}")
+            self.metrics.incr(key, "errors")
+            self._record_failure(e)
+            logger.warning(f"Error caching key {key}: {e}")
+        self._observe([key], started, "set")
     
-    async def get_cached_indicators(self, symbol: str) -> Optional[Dict]:
-        """Obtener indicadores del cache"""
-        if not self._connected:
-            await self.connect()
+    async def _get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Leer varias keys frescas: L1 primero, el resto con MGET + PTTL en un solo pipeline"""
+        started = time.perf_counter()
+        now = time.time()
+        found: Dict[str, Any] = {}
+        remote: List[str] = []
+        for key in keys:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.metrics.incr(key, "l1_hits")
+                if entry[1] > now:
+                    found[key] = entry[0]
+            else:
+                remote.append(key)
         
-        if not self._connected or not self.redis_client:
-            return None
+        if remote:
+            if await self._available():
+                try:
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    pipe.mget(remote)
+                    for key in remote:
+                        pipe.pttl(key)
+                    results = await pipe.execute()
+                    for key, cached, pttl in zip(remote, results[0], results[1:]):
+                        if not cached:
+                            continue
+                        self.metrics.observe_size(key, len(cached))
+                        entry = self._unpack(cached)
+                        if pttl and pttl > 0:
+                            self.local.set(key, entry, pttl / 1000)
+                        if entry[1] > now:
+                            found[key] = entry[0]
+                except Exception as e:
+                    for key in remote:
+                        self.metrics.incr(key, "errors")
+                    self._record_failure(e)
+                    logger.warning(f"Error reading {len(remote)} cache keys: {e}")
+        
+        for key in keys:
+            self.metrics.incr(key, "hits" if key in found else "misses")
+        self._observe(keys, started)
+        return found
+    
+    async def _set_many(self, items: Dict[str, Tuple[Any, int]]):
+        """Escribir varias keys (valor, TTL propio) con SETEX en un solo pipeline"""
+        if not items:
+            return
+        started = time.perf_counter()
+        now = time.time()
+        for key, (value, ttl) in items.items():
+            self.local.set(key, (value, now + ttl), ttl)
+            self.metrics.incr(key, "sets")
+        
+        if not await self._available():
+            return
         
         try:
-            key = self._get_indicators_key(symbol)
-            cached = await self.redis_client.get(key)
-            if cached:
-                return json.loads(cached)
+            pipe = self.redis_client.pipeline(transaction=False)
+            broadcast = []
+            for key, (value, ttl) in items.items():
+                payload = self._pack(value, now + ttl)
+                self.metrics.observe_size(key, len(payload))
+                pipe.setex(key, ttl, payload)
+                if self._is_broadcast(key):
+                    broadcast.append([key, value, now + ttl, ttl])
+            if broadcast:
+                pipe.publish(settings.CACHE_SYNC_CHANNEL, self._sync_message("set", items=broadcast))
+            await pipe.execute()
         except Exception as e:
-            logger.warning(f"Error reading indicators cache for {symbol}: {e}")
+            for key in items:
+                self.metrics.incr(key, "errors")
+            self._record_failure(e)
+            logger.warning(f"Error caching {len(items)} keys: {e}")
+        self._observe(list(items), started, "set")
+    
+    def _record_access(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ):
+        """Contar accesos por key y recordar cómo recargarla"""
+        stats = self._access.get(key)
+        if stats is None:
+            if len(self._access) >= 2 * self._max_tracked:
+                # Lleno hasta la próxima pasada de `refresh_hot_keys`, que recorta en bloque
+                return
+            stats = self._access[key] = {"hits": 0.0}
+        stats["hits"] += 1
+        stats["loader"] = loader
+        stats["ttl"] = ttl
+        stats["stale_ttl"] = stale_ttl
+        stats["cacheable"] = cacheable
+    
+    async def _load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Cargar desde upstream una sola vez por key aunque haya llamadas concurrentes"""
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        async def run():
+            try:
+                value = await loader()
+                if value is not None and (cacheable is None or cacheable(value)):
+                    await self._set(key, value, ttl, stale_ttl)
+                return value
+            finally:
+                self._inflight.pop(key, None)
         
-        return None
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+    
+    def _refresh_in_background(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ):
+        """Lanzar una revalidación en segundo plano si no hay una en curso"""
+        if key in self._inflight:
+            return
+        
+        async def refresh():
+            try:
+                await self._load(key, loader, ttl, stale_ttl, cacheable)
+            except Exception as e:
+                logger.warning(f"Background refresh failed for {key}: {e}")
+        
+        asyncio.ensure_future(refresh())
+    
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: Optional[int] = None,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Cache-aside con stale-while-revalidate.
+
+        - Fresco: se devuelve el valor cacheado.
+        - Vencido en blando (dentro de `stale_ttl`): se devuelve el valor
+          viejo al instante y se lanza una única recarga en segundo plano.
+        - Ausente: se carga upstream; las llamadas concurrentes comparten la
+          misma carga (sin estampida).
+
+        `cacheable` permite descartar resultados que no deben guardarse
+        (por ejemplo datos simulados de respaldo).
+        """
+        if stale_ttl is None:
+            stale_ttl = settings.CACHE_STALE_TTL
+        self._record_access(key, loader, ttl, stale_ttl, cacheable)
+        
+        entry = await self._get_entry(key)
+        if entry is not None:
+            value, soft_expires_at = entry
+            if soft_expires_at <= time.time():
+                self.metrics.incr(key, "stale_hits")
+                self._refresh_in_background(key, loader, ttl, stale_ttl, cacheable)
+            else:
+                self.metrics.incr(key, "hits")
+            return value
+        
+        self.metrics.incr(key, "misses")
+        return await self._load(key, loader, ttl, stale_ttl, cacheable)
+    
+    @staticmethod
+    def _streamed(key: str) -> bool:
+        """Quotes que el stream de trades ya mantiene al día no necesitan recarga"""
+        if not key.startswith("quote:"):
+            return False
+        from app.services.quote_stream import trade_stream
+        return trade_stream.is_streaming(key[len("quote:"):])
+    
+    async def refresh_hot_keys(self, lead_seconds: float = 2.0, min_hits: float = 5.0) -> int:
+        """Revalidar proactivamente las keys populares que están por vencer.
+
+        Los contadores de acceso decaen a la mitad en cada pasada, así que la
+        popularidad refleja el uso reciente; aquí también se recorta el
+        registro a las `_max_tracked` keys más populares. Las recargas van
+        de la más popular a la menos y solo mientras `refresh_limiter` tenga
+        cupo (el resto se sirve viejo y se revalida al pedirse); se saltan
+        las quotes que llegan por el stream de trades.
+
+        Returns:
+            Número de recargas lanzadas
+        """
+        now = time.time()
+        due = []
+        for key, stats in list(self._access.items()):
+            hits = stats["hits"]
+            stats["hits"] = hits / 2
+            if hits < min_hits or key in self._inflight:
+                if stats["hits"] < 0.5:
+                    del self._access[key]
+                continue
+            entry = self.local.peek(key)
+            if entry is not None and entry[1] - now > lead_seconds:
+                continue
+            due.append((hits, key))
+        if len(self._access) > self._max_tracked:
+            excess = len(self._access) - self._max_tracked
+            for key in heapq.nsmallest(excess, self._access, key=lambda k: self._access[k]["hits"]):
+                del self._access[key]
+        
+        launched = 0
+        for _, key in sorted(due, reverse=True):
+            stats = self._access.get(key)
+            if stats is None or self._streamed(key):
+                continue
+            if not self.refresh_limiter.try_acquire():
+                break
+            self._refresh_in_background(
+                key, stats["loader"], stats["ttl"], stats["stale_ttl"], stats["cacheable"]
+            )
+            launched += 1
+        return launched
+    
+    async def _refresh_loop(self, interval: float, lead_seconds: float, min_hits: float):
+        """Bucle de revalidación proactiva"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_hot_keys(lead_seconds, min_hits)
+            except Exception as e:
+                logger.warning(f"Hot key refresh failed: {e}")
+    
+    def start_refresher(self, interval: float = 1.0, lead_seconds: float = 2.0, min_hits: float = 5.0):
+        """Iniciar la revalidación proactiva de keys populares"""
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_loop(interval, lead_seconds, min_hits))
+    
+    async def stop_refresher(self):
+        """Detener la revalidación proactiva"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+    
+    @staticmethod
+    def _split_hits(symbols: List[str], keys: List[str], found: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """Separar símbolos en aciertos {symbol: valor} y fallos [symbol]"""
+        hits: Dict[str, Any] = {}
+        misses: List[str] = []
+        for symbol, key in zip(symbols, keys):
+            if key in found:
+                hits[symbol] = found[key]
+            else:
+                misses.append(symbol)
+        return hits, misses
+    
+    async def get_cached_quote(self, symbol: str) -> Optional[Dict]:
+        """Obtener quote del cache con TTL inteligente"""
+        return await self._get(self._get_quote_key(symbol))
+    
+    async def cache_quote(self, symbol: str, quote: Dict, ttl: Optional[int] = None):
+        """Cachear quote con TTL dinámico"""
+        if ttl is None:
+            ttl = self.quote_ttl()
+        await self._set(self._get_quote_key(symbol), quote, ttl)
+    
+    async def get_cached_quotes(self, symbols: List[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """Obtener quotes de varios símbolos en un round trip.
+
+        Returns:
+            (hits, misses): quotes encontradas por símbolo y símbolos a pedir upstream
+        """
+        symbols = [s.upper() for s in symbols]
+        keys = [self._get_quote_key(s) for s in symbols]
+        found = await self._get_many(keys)
+        return self._split_hits(symbols, keys, found)
+    
+    async def cache_quotes(self, quotes: Dict[str, Dict], ttl: Optional[Union[int, Dict[str, int]]] = None):
+        """Cachear quotes de varios símbolos en un round trip.
+
+        Args:
+            quotes: {symbol: quote}
+            ttl: TTL común, TTL por símbolo, o None para el TTL dinámico de mercado
+        """
+        default_ttl = ttl if isinstance(ttl, int) else self.quote_ttl()
+        await self._set_many({
+            self._get_quote_key(symbol): (
+                quote,
+                ttl.get(symbol, default_ttl) if isinstance(ttl, dict) else default_ttl,
+            )
+            for symbol, quote in quotes.items()
+        })
+    
+    async def get_cached_indicators(self, symbol: str) -> Optional[Dict]:
+        """Obtener indicadores del cache"""
+        return await self._get(self._get_indicators_key(symbol))
     
     async def cache_indicators(self, symbol: str, indicators: Dict, ttl: int = 300):
         """Cachear indicadores técnicos"""
-        if not self._connected:
-            await self.connect()
+        await self._set(self._get_indicators_key(symbol), indicators, ttl)
+    
+    async def get_cached_indicators_many(self, symbols: List[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """Obtener indicadores de varios símbolos en un round trip"""
+        symbols = [s.upper() for s in symbols]
+        keys = [self._get_indicators_key(s) for s in symbols]
+        found = await self._get_many(keys)
+        return self._split_hits(symbols, keys, found)
+    
+    async def cache_indicators_many(self, indicators: Dict[str, Dict], ttl: Union[int, Dict[str, int]] = 300):
+        """Cachear indicadores de varios símbolos en un round trip"""
+        await self._set_many({
+            self._get_indicators_key(symbol): (
+                value,
+                ttl.get(symbol, 300) if isinstance(ttl, dict) else ttl,
+            )
+            for symbol, value in indicators.items()
+        })
+    
+    async def get_cached_analysis(self, symbol: str) -> Optional[Dict]:
+        """Obtener análisis completo del cache"""
+        return await self._get(self._get_analysis_key(symbol))
+    
+    async def cache_analysis(self, symbol: str, analysis: Dict, ttl: int = 60):
+        """Cachear análisis completo"""
+        await self._set(self._get_analysis_key(symbol), analysis, ttl)
+    
+    def _is_broadcast(self, key: str) -> bool:
+        """Familias cuyos valores frescos se propagan al resto de workers"""
+        return settings.CACHE_SYNC_ENABLED and self.metrics.family_of(key) in settings.CACHE_SYNC_FAMILIES
+    
+    def _sync_message(self, kind: str, **fields) -> bytes:
+        """Mensaje pub/sub con el id del worker de origen"""
+        return encode_payload({"o": self.worker_id, "type": kind, **fields})
+    
+    def add_update_listener(self, family: str, callback: Callable[[str, Any], None]):
+        """Registrar un callback(id, valor) para valores recibidos de otros workers.
+
+        `id` es la key sin el prefijo de familia (p. ej. el símbolo en `quote:AAPL`).
+        """
+        self._update_listeners.setdefault(family, []).append(callback)
+    
+    def _handle_sync_message(self, data: bytes):
+        """Aplicar una invalidación o un valor fresco publicado por otro worker"""
+        message = decode_payload(data)
+        if message.get("o") == self.worker_id:
+            return
+        kind = message.get("type")
+        if kind == "invalidate":
+            self.local.delete(*message.get("keys", []))
+        elif kind == "set":
+            for key, value, soft_expires_at, ttl in message.get("items", []):
+                self.local.set(key, (value, soft_expires_at), ttl)
+                family, _, ident = key.partition(":")
+                for callback in self._update_listeners.get(family, ()):
+                    try:
+                        callback(ident, value)
+                    except Exception as e:
+                        logger.warning(f"Cache update listener failed for {key}: {e}")
+    
+    async def _sync_loop(self):
+        """Escuchar el canal de sincronización, reconectando si se cae"""
+        while True:
+            if not await self._available():
+                await asyncio.sleep(max(1.0, self._retry_at - time.time()))
+                continue
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(settings.CACHE_SYNC_CHANNEL)
+                while True:
+                    # Lectura con timeout: el socket_timeout del pool cortaría un listen() bloqueante
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get("type") == "message":
+                        try:
+                            self._handle_sync_message(message["data"])
+                        except Exception as e:
+                            logger.warning(f"Invalid cache sync message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record_failure(e)
+                logger.warning(f"Cache sync channel error: {e}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+    
+    def start_sync(self):
+        """Iniciar la sincronización entre workers"""
+        if not settings.CACHE_SYNC_ENABLED:
+            return
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.ensure_future(self._sync_loop())
+    
+    async def stop_sync(self):
+        """Detener la sincronización entre workers"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+    
+    async def get_quote_or_load(self, symbol: str, loader: Callable[[], Awaitable[Dict]]) -> Dict:
+        """Quote con stale-while-revalidate y TTL dinámico de mercado"""
+        return await self.get_or_load(self._get_quote_key(symbol), loader, self.quote_ttl())
+    
+    async def get_indicators_or_load(self, symbol: str, loader: Callable[[], Awaitable[Dict]], ttl: int = 300) -> Dict:
+        """Indicadores con stale-while-revalidate"""
+        return await self.get_or_load(self._get_indicators_key(symbol), loader, ttl)
+    
+    async def get_analysis_or_load(self, symbol: str, loader: Callable[[], Awaitable[Dict]], ttl: int = 60) -> Dict:
+        """Análisis completo con stale-while-revalidate"""
+        return await self.get_or_load(self._get_analysis_key(symbol), loader, ttl)
+    
+    async def invalidate_symbol(self, symbol: str):
+        """Invalidar cache de un símbolo (L1 y Redis)"""
+        keys = [
+            self._get_quote_key(symbol),
+            self._get_indicators_key(symbol),
+            self._get_analysis_key(symbol),
+        ]
+        self.local.delete(*keys)
         
-        if not self._connected or not self.redis_client:
+        if not await self._available():
             return
         
         try:
-            key = self._get_indicators_key(symbol)
-            await self.redis_client.setex(
-                key,
-                ttl,
-                json.dumps(indicators)
-            )
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.delete(*keys)
+            pipe.publish(settings.CACHE_SYNC_CHANNEL, self._sync_message("invalidate", keys=keys))
+            await pipe.execute()
         except Exception as e:
-            logger.warning(f"Error caching indicators for {symbol}: {e}")
+            self._record_failure(e)
+            logger.warning(f"Error invalidating cache for {symbol}: {e}")
     
-    async def get_cached_analysis(self, symbol: str) -> Optional[Dict]:
-        """Obtener análisis completo del cache"""
-        if not self._connected:
-            await self.connect()
-        
-        if not self._connected or not self.redis_client:
+    async def incr_scores(self, key: str, scores: Dict[str, float]):
+        """Sumar puntuaciones a un sorted set de Redis (p. ej. demanda por símbolo)"""
+        if not scores or not await self._available():
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member, score in scores.items():
+                pipe.zincrby(key, score, member)
+            await pipe.execute()
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"Error updating scores in {key}: {e}")
+    
+    async def top_scores(self, key: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        """Miembros con mayor puntuación; None si Redis no está disponible"""
+        if not await self._available():
             return None
-        
         try:
-            key = self._get_analysis_key(symbol)
-            cached = await self.redis_client.get(key)
-            if cached:
-                return json.loads(cached)
+            rows = await self.redis_client.zrevrange(key, 0, limit - 1, withscores=True)
+            return [(member.decode() if isinstance(member, bytes) else member, score) for member, score in rows]
         except Exception as e:
-            logger.warning(f"Error reading analysis cache for {symbol}: {e}")
-        
-        return None
+            self._record_failure(e)
+            logger.warning(f"Error reading scores from {key}: {e}")
+            return None
     
-    async def cache_analysis(self, symbol: str, analysis: Dict, ttl: int = 60):
-        """Cachear análisis completo"""
-        if not self._connected:
-            await self.connect()
-        
-        if not self._connected or not self.redis_client:
+    async def decay_scores(self, key: str, factor: float = 0.5):
+        """Multiplicar todas las puntuaciones por `factor` (envejecer el ranking)"""
+        if not await self._available():
             return
-        
         try:
-            key = self._get_analysis_key(symbol)
-            await self.redis_client.setex(
-                key,
-                ttl,
-                json.dumps(analysis)
-            )
+            await self.redis_client.zunionstore(key, {key: factor})
         except Exception as e:
-            logger.warning(f"Error caching analysis for {symbol}: {e}")
+            self._record_failure(e)
+            logger.warning(f"Error decaying scores in {key}: {e}")
     
-    async def invalidate_symbol(self, symbol: str):
-        """Invalidar cache de un símbolo"""
-        if not self._connected:
-            await self.connect()
-        
-        if not self._connected or not self.redis_client:
+    async def trim_scores(self, key: str, keep: int, min_score: float = 0.0):
+        """Conservar solo los `keep` miembros con mayor puntuación y >= `min_score`"""
+        if not await self._available():
             return
-        
         try:
-            keys = [
-                self._get_quote_key(symbol),
-                self._get_indicators_key(symbol),
-                self._get_analysis_key(symbol),
-            ]
-            await self.redis_client.delete(*keys)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zremrangebyrank(key, 0, -(keep + 1))
+            if min_score > 0:
+                pipe.zremrangebyscore(key, "-inf", f"({min_score}")
+            await pipe.execute()
         except Exception as e:
-            logger.warning(f"Error invalidating cache for {symbol}: {e}")
+            self._record_failure(e)
+            logger.warning(f"Error trimming scores in {key}: {e}")
+    
+    async def try_lock(self, key: str, ttl: int) -> bool:
+        """Lock best-effort entre workers (SET NX EX).
+
+        Sin Redis devuelve True: cada worker actúa por su cuenta.
+        """
+        if not await self._available():
+            return True
+        try:
+            return bool(await self.redis_client.set(key, self.worker_id, nx=True, ex=ttl))
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"Error acquiring lock {key}: {e}")
+            return True
     
     async def get_cache_stats(self) -> Dict:
-        """Obtener estadísticas del cache"""
-        if not self._connected:
-            await self.connect()
+        """Obtener estadísticas del cache (Redis global y por familia de keys)"""
+        available = await self._available()
         
-        if not self._connected or not self.redis_client:
-            return {"connected": False}
+        stats = {
+            "connected": False,
+            "local_entries": len(self.local),
+            "circuit": {
+                "state": "closed" if self._connected else "open",
+                "failures": self._failures,
+                "retry_in": round(max(0.0, self._retry_at - time.time()), 3),
+            },
+            "pool": {"max_connections": settings.REDIS_MAX_CONNECTIONS},
+            "families": self.metrics.snapshot(),
+        }
+        if not available:
+            return stats
         
         try:
             info = await self.redis_client.info("stats")
-            return {
+            stats.update({
                 "connected": True,
                 "keys": await self.redis_client.dbsize(),
                 "hits": info.get("keyspace_hits", 0),
                 "misses": info.get("keyspace_misses", 0),
-            }
+            })
         except Exception as e:
+            self._record_failure(e)
             logger.warning(f"Error getting cache stats: {e}")
-            return {"connected": False, "error": str(e)}
+            stats["error"] = str(e)
+        return stats
+
+
+cache_service = CacheService()
+
+
+# Normalización de parámetros para que variantes equivalentes compartan key;
+# la función cacheada recibe los valores normalizados, no los originales
+RESOLUTION_ALIASES = {
+    "1D": "D", "DAY": "D", "DAILY": "D",
+    "1H": "60", "H": "60",
+    "1W": "W", "WEEK": "W", "WEEKLY": "W",
+}
+
+
+def normalize_symbol(symbol: str) -> str:
+    return str(symbol).strip().upper()
+
+
+def normalize_resolution(resolution: str) -> str:
+    value = str(resolution).strip().upper()
+    return RESOLUTION_ALIASES.get(value, value)
+
+
+def normalize_days(days: int) -> int:
+    return max(1, int(days))
+
+
+# Solo resoluciones de Finnhub: un `timeframe` de ccxt ("1h") no debe convertirse en "60"
+KEY_NORMALIZERS = {
+    "symbol": normalize_symbol,
+    "resolution": normalize_resolution,
+    "days": normalize_days,
+}
+
+
+def is_real_data(value: Any) -> bool:
+    """No cachear respuestas de respaldo simuladas (también en listas y dicts anidados)"""
+    if isinstance(value, dict):
+        if value.get("is_simulated"):
+            return False
+        return all(is_real_data(v) for v in value.values() if isinstance(v, (dict, list)))
+    if isinstance(value, list):
+        return all(is_real_data(v) for v in value if isinstance(v, (dict, list)))
+    return True
+
+
+def cached(family: str, ttl: Union[int, Callable[[Dict[str, str]], int]], stale_ttl: Optional[int] = None):
+    """Decorador cache-aside para métodos async de servicios.
+
+    La key es `family` seguida de los argumentos normalizados en orden
+    (p. ej. `ohlcv:AAPL:D:30`), así que `quote:AAPL` coincide con el esquema
+    de keys de CacheService. La función se llama con esos mismos argumentos
+    normalizados, así que todas las variantes que comparten key piden lo
+    mismo upstream. `ttl` puede ser fijo o una función que recibe los
+    argumentos normalizados. Usa stale-while-revalidate y no guarda
+    respuestas simuladas.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            for name, normalize in KEY_NORMALIZERS.items():
+                if name in bound.arguments:
+                    bound.arguments[name] = normalize(bound.arguments[name])
+            params = {
+                name: str(value)
+                for name, value in bound.arguments.items()
+                if name != "self"
+            }
+            key = ":".join([family, *params.values()])
+            key_ttl = ttl(params) if callable(ttl) else ttl
+            return await cache_service.get_or_load(
+                key,
+                lambda: func(*bound.args, **bound.kwargs),
+                key_ttl,
+                stale_ttl,
+                cacheable=is_real_data,
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,255 @@
+"""
+Cache Warm-up - Pre-market prefetch of quotes, candles and indicators
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.cache_service import CacheService, cache_service
+from app.services.market_hours_service import MarketHoursService, market_hours_service
+
+logger = logging.getLogger(__name__)
+
+DEMAND_KEY = "demand:symbols"
+LOCK_KEY = "lock:warmup:{open_ts}"
+# How often locally counted demand is pushed to the shared Redis ranking
+DEMAND_FLUSH_INTERVAL = 60
+# Candle requests to warm, matching the /market/ohlcv defaults
+OHLCV_PARAMS = (("D", 30),)
+# Long-lived entries first; quotes (shortest TTL) last so they land closest to the open
+JOB_KINDS = ("ohlcv", "indicators", "quote")
+
+# Set inside warm-up tasks so prefetching does not count as demand
+_warming: contextvars.ContextVar[bool] = contextvars.ContextVar("cache_warming", default=False)
+
+Job = Tuple[float, str, str]
+
+
+class CacheWarmupScheduler:
+    """
+    Prefetch the hottest symbols into CacheService ahead of the open.
+
+    Demand is counted per symbol in memory and flushed to a Redis sorted set
+    shared by all workers; it decays by half after every warm-up so the
+    ranking follows recent interest, and is trimmed to the
+    `WARMUP_DEMAND_MAX_SYMBOLS` best symbols. Before each open (from
+    `MarketHoursService`), one worker (Redis lock) warms the watchlist plus
+    the top-ranked symbols with calls spaced evenly over
+    `WARMUP_RATE_SHARE` of the Finnhub rate limit, ending just before the
+    bell. Every entry is fetched late enough to still be servable at the
+    open; what does not fit is dropped from the tail of the ranking.
+    """
+
+    def __init__(
+        self,
+        market_service=None,
+        cache: Optional[CacheService] = None,
+        hours: Optional[MarketHoursService] = None,
+    ):
+        """Initialize warm-up scheduler."""
+        self._market_service = market_service
+        self.cache = cache or cache_service
+        self.hours = hours or market_hours_service
+        self._demand: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.last_run: Dict = {}
+
+    @property
+    def market_service(self):
+        """MarketDataService used for prefetching, created on first use."""
+        if self._market_service is None:
+            from app.services.market_data import MarketDataService
+            self._market_service = MarketDataService()
+        return self._market_service
+
+    @property
+    def interval(self) -> float:
+        """Seconds between warm-up calls within the allowed rate budget."""
+        per_minute = max(1e-6, settings.FINNHUB_RATE_LIMIT_PER_MIN * settings.WARMUP_RATE_SHARE)
+        return 60.0 / per_minute
+
+    def record_demand(self, symbol: str) -> None:
+        """Count a request for a symbol (cheap, in memory)."""
+        if not _warming.get():
+            self._demand[symbol.upper()] += 1
+
+    async def flush_demand(self) -> None:
+        """Push locally counted demand to the shared ranking."""
+        if not self._demand:
+            return
+        counts, self._demand = self._demand, Counter()
+        await self.cache.incr_scores(DEMAND_KEY, dict(counts))
+
+    async def select_symbols(self, limit: Optional[int] = None) -> List[str]:
+        """Watchlist first, then the most-requested symbols."""
+        limit = limit or settings.WARMUP_MAX_SYMBOLS
+        symbols = [s.upper() for s in settings.WARMUP_WATCHLIST]
+        ranked = await self.cache.top_scores(DEMAND_KEY, limit)
+        if ranked is None:
+            # Redis unavailable: fall back to this worker's own counts
+            ranked = self._demand.most_common(limit)
+        for symbol, _ in ranked:
+            symbol = symbol.upper()
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols[:limit]
+
+    def max_age(self, kind: str, target: str, at: float) -> float:
+        """Seconds an entry fetched at `at` can still be served (TTL plus stale grace)."""
+        if kind == "quote":
+            ttl = self.cache.quote_ttl(at)
+        elif kind == "indicators":
+            from app.services.market_data import INDICATORS_TTL
+            ttl = INDICATORS_TTL
+        else:
+            ttl = self.cache.ohlcv_ttl(target.split(":")[1], at)
+        return ttl + settings.CACHE_STALE_TTL
+
+    def plan(self, symbols: List[str], open_ts: float, now: Optional[float] = None) -> List[Job]:
+        """
+        Schedule `(run_at, kind, target)` jobs ending before the open.
+
+        Jobs are spaced `interval` seconds apart, counting back from
+        `WARMUP_FINISH_SECONDS` before the open to no earlier than
+        `WARMUP_LEAD_MINUTES` before it (or now). Shorter-lived kinds take
+        the slots closest to the open, higher-ranked symbols first, and a
+        job is only planned if its entry will not have expired by the open,
+        so lower-ranked symbols lose their quotes first.
+        """
+        now = time.time() if now is None else now
+        interval = self.interval
+        finish = open_ts - settings.WARMUP_FINISH_SECONDS
+        earliest = max(now, open_ts - settings.WARMUP_LEAD_MINUTES * 60)
+
+        jobs = []
+        run_at = finish
+        for kind in reversed(JOB_KINDS):
+            if kind == "ohlcv":
+                targets = [f"{symbol}:{res}:{days}" for symbol in symbols for res, days in OHLCV_PARAMS]
+            else:
+                targets = symbols
+            for target in targets:
+                if run_at < max(earliest, open_ts - self.max_age(kind, target, finish)):
+                    break
+                jobs.append((run_at, kind, target))
+                run_at -= interval
+        return sorted(jobs)
+
+    async def _run_job(self, kind: str, target: str) -> None:
+        """Fetch one entry through MarketDataService so it lands in the cache."""
+        if kind == "ohlcv":
+            symbol, resolution, days = target.split(":")
+            await self.market_service.get_ohlcv(symbol, resolution, int(days))
+        elif kind == "indicators":
+            await self.market_service.get_technical_indicators(target)
+        else:
+            # Internal fetch: no demand and no upstream subscription
+            await self.market_service.fetch_quote(target)
+
+    async def warm(self, symbols: List[str], open_ts: float) -> Dict:
+        """Run the warm-up plan for one open; returns a summary."""
+        token = _warming.set(True)
+        jobs = self.plan(symbols, open_ts)
+        tasks = []
+        try:
+            for run_at, kind, target in jobs:
+                delay = run_at - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.ensure_future(self._run_job(kind, target)))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            _warming.reset(token)
+
+        failed = [
+            f"{kind}:{target}"
+            for (_, kind, target), result in zip(jobs, results)
+            if isinstance(result, Exception)
+        ]
+        for job in failed:
+            logger.warning("Cache warm-up job %s failed", job)
+        warmed = {target.split(":")[0] for _, _, target in jobs}
+        return {
+            "open": open_ts,
+            "symbols": len(warmed),
+            "skipped": len(symbols) - len(warmed),
+            "calls": len(jobs),
+            "failed": len(failed),
+            "finished_at": time.time(),
+        }
+
+    async def run_once(self, open_ts: float) -> Optional[Dict]:
+        """Warm up for one open unless another worker already does."""
+        lock_ttl = settings.WARMUP_LEAD_MINUTES * 60 + 600
+        if not await self.cache.try_lock(LOCK_KEY.format(open_ts=int(open_ts)), lock_ttl):
+            return None
+        await self.flush_demand()
+        symbols = await self.select_symbols()
+        summary = await self.warm(symbols, open_ts)
+        await self.cache.decay_scores(DEMAND_KEY, 0.5)
+        await self.cache.trim_scores(
+            DEMAND_KEY, settings.WARMUP_DEMAND_MAX_SYMBOLS, settings.WARMUP_DEMAND_MIN_SCORE
+        )
+        self.last_run = summary
+        logger.info("Cache warm-up done: %s", summary)
+        return summary
+
+    async def _run(self) -> None:
+        """Wait for each pre-market window and warm up."""
+        while True:
+            open_ts = self.hours.calendar.next_open(time.time())
+            if open_ts is None:
+                logger.warning("Session calendar exhausted, cache warm-up stopped")
+                return
+            await asyncio.sleep(max(0.0, open_ts - settings.WARMUP_LEAD_MINUTES * 60 - time.time()))
+            try:
+                await self.run_once(open_ts)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cache warm-up failed: %s", e)
+            # Move past this open before looking for the next one
+            await asyncio.sleep(max(0.0, open_ts - time.time()) + 1)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(DEMAND_FLUSH_INTERVAL)
+            try:
+                await self.flush_demand()
+            except Exception as e:
+                logger.warning("Demand flush failed: %s", e)
+
+    def start(self) -> None:
+        """Start the scheduler and the demand flusher."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop background tasks, flushing pending demand."""
+        for task in (self._task, self._flusher):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._flusher = None
+        await self.flush_demand()
+
+    def get_stats(self) -> Dict:
+        """Pending demand and the last warm-up summary."""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending_demand": sum(self._demand.values()),
+            "last_run": self.last_run,
+        }
+
+
+cache_warmup = CacheWarmupScheduler()
@@ -0,0 +1,352 @@
+"""
+Candle Store - Memory-mapped columnar on-disk OHLCV cache
+"""
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NUOCNDL1"
+HEADER_SIZE = 64
+# Column order on disk; time is epoch seconds, the rest are prices/volume
+COLUMNS = ("time", "open", "high", "low", "close", "volume")
+COLUMN_DTYPES = {
+    "time": np.int64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.float64,
+}
+ITEM_SIZE = 8
+INITIAL_CAPACITY = 4096
+
+
+def _file_name(symbol: str, timeframe: str) -> str:
+    """Filesystem-safe file name for a (symbol, timeframe) pair."""
+    safe_symbol = re.sub(r"[^A-Za-z0-9._-]", "_", symbol.upper())
+    safe_timeframe = re.sub(r"[^A-Za-z0-9._-]", "_", timeframe)
+    return f"{safe_symbol}__{safe_timeframe}.cndl"
+
+
+class CandleView:
+    """
+    Zero-copy, list-like view over a range of candles.
+
+    Indexing returns a candle dict (with both `time` and `timestamp` keys),
+    slicing returns another view, so code written for lists of dicts such as
+    `BacktestEngine.run` works unchanged without materializing the history.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["time"])
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return CandleView({name: col[index] for name, col in self.columns.items()})
+        t = int(self.columns["time"][index])
+        return {
+            "time": t,
+            "timestamp": t,
+            "open": float(self.columns["open"][index]),
+            "high": float(self.columns["high"][index]),
+            "low": float(self.columns["low"][index]),
+            "close": float(self.columns["close"][index]),
+            "volume": float(self.columns["volume"][index]),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.columns["time"]
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.columns["open"]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.columns["high"]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.columns["low"]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.columns["close"]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.columns["volume"]
+
+    def to_candles(self) -> List[Dict]:
+        """Materialize as a list of candle dicts (same shape as get_ohlcv)."""
+        return list(self)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame with the column names used by the indicator code."""
+        return pd.DataFrame(
+            {
+                "Close": self.columns["close"],
+                "High": self.columns["high"],
+                "Low": self.columns["low"],
+                "Open": self.columns["open"],
+                "Volume": self.columns["volume"],
+                "Timestamp": self.columns["time"],
+            },
+            copy=False,
+        )
+
+
+class CandleSeries:
+    """
+    Append-only, memory-mapped candle file for one (symbol, timeframe).
+
+    Layout: a 64-byte header (magic, row count, capacity) followed by one
+    contiguous block per column, each `capacity` items long. Rows must be
+    appended in increasing time order; range queries binary-search the time
+    column. When capacity runs out the file is rewritten with double the
+    capacity and atomically swapped in, so appends are amortized O(1) and
+    views handed out earlier stay valid. A series has a single writer.
+    """
+
+    def __init__(self, path: str, readonly: bool = False):
+        """Open (or create) the candle file at `path`."""
+        self.path = path
+        self.readonly = readonly
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            self._create(path, INITIAL_CAPACITY)
+        self._map()
+
+    @staticmethod
+    def _create(path: str, capacity: int, columns: Optional[Dict[str, np.ndarray]] = None, count: int = 0):
+        """Write a new file with the given capacity and optional initial data."""
+        tmp_path = f"{path}.tmp"
+        size = HEADER_SIZE + len(COLUMNS) * capacity * ITEM_SIZE
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+            header = np.zeros(HEADER_SIZE // ITEM_SIZE, dtype=np.uint64)
+            header[1] = count
+            header[2] = capacity
+            f.seek(0)
+            f.write(header.tobytes())
+            f.seek(0)
+            f.write(MAGIC)
+            if columns is not None and count:
+                for i, name in enumerate(COLUMNS):
+                    f.seek(HEADER_SIZE + i * capacity * ITEM_SIZE)
+                    f.write(np.ascontiguousarray(columns[name][:count], dtype=COLUMN_DTYPES[name]).tobytes())
+        os.replace(tmp_path, path)
+
+    def _map(self):
+        """Memory-map the file and build column views."""
+        mode = "r" if self.readonly else "r+"
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode=mode)
+        self._inode = os.stat(self.path).st_ino
+        if bytes(self._mm[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a candle file: {self.path}")
+        self._header = self._mm[:HEADER_SIZE].view(np.uint64)
+        self.capacity = int(self._header[2])
+        self._columns = {}
+        for i, name in enumerate(COLUMNS):
+            start = HEADER_SIZE + i * self.capacity * ITEM_SIZE
+            end = start + self.capacity * ITEM_SIZE
+            self._columns[name] = self._mm[start:end].view(COLUMN_DTYPES[name])
+
+    def refresh(self):
+        """Re-map the file, picking up growth from another writer process."""
+        self._map()
+
+    def _check_replaced(self):
+        """Readers re-map when the writer has swapped in a grown file."""
+        if self.readonly and os.stat(self.path).st_ino != self._inode:
+            self._map()
+
+    @property
+    def count(self) -> int:
+        """Number of stored candles."""
+        return int(self._header[1])
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def first_time(self) -> Optional[int]:
+        return int(self._columns["time"][0]) if self.count else None
+
+    @property
+    def last_time(self) -> Optional[int]:
+        return int(self._columns["time"][self.count - 1]) if self.count else None
+
+    def view(self) -> CandleView:
+        """Zero-copy view of every stored candle."""
+        self._check_replaced()
+        n = self.count
+        return CandleView({name: col[:n] for name, col in self._columns.items()})
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None) -> CandleView:
+        """
+        Zero-copy view of candles with start <= time <= end (epoch seconds).
+
+        Both bounds are located with binary search on the time column.
+        """
+        self._check_replaced()
+        n = self.count
+        times = self._columns["time"][:n]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = n if end is None else int(np.searchsorted(times, end, side="right"))
+        return CandleView({name: col[lo:hi] for name, col in self._columns.items()})
+
+    def tail(self, bars: int) -> CandleView:
+        """Zero-copy view of the last `bars` candles."""
+        self._check_replaced()
+        n = self.count
+        lo = max(0, n - bars)
+        return CandleView({name: col[lo:n] for name, col in self._columns.items()})
+
+    def append(
+        self,
+        time: Iterable[int],
+        open: Iterable[float],
+        high: Iterable[float],
+        low: Iterable[float],
+        close: Iterable[float],
+        volume: Iterable[float],
+    ) -> int:
+        """
+        Append candles given as column arrays.
+
+        Input is sorted by time; rows at or before the last stored candle
+        are skipped, so re-appending an overlapping fetch is harmless.
+
+        Returns:
+            Number of rows actually appended
+        """
+        if self.readonly:
+            raise PermissionError(f"Candle file opened read-only: {self.path}")
+
+        incoming = {
+            "time": np.asarray(time, dtype=np.int64),
+            "open": np.asarray(open, dtype=np.float64),
+            "high": np.asarray(high, dtype=np.float64),
+            "low": np.asarray(low, dtype=np.float64),
+            "close": np.asarray(close, dtype=np.float64),
+            "volume": np.asarray(volume, dtype=np.float64),
+        }
+        order = np.argsort(incoming["time"], kind="stable")
+        if not np.all(order[:-1] < order[1:]):
+            incoming = {name: col[order] for name, col in incoming.items()}
+
+        # Drop duplicates within the batch (keep the last) and overlap with the file
+        times = incoming["time"]
+        keep = np.ones(len(times), dtype=bool)
+        if len(times) > 1:
+            keep[:-1] = times[:-1] != times[1:]
+        last = self.last_time
+        if last is not None:
+            keep &= times > last
+        if not keep.all():
+            incoming = {name: col[keep] for name, col in incoming.items()}
+
+        added = len(incoming["time"])
+        if added == 0:
+            return 0
+
+        n = self.count
+        if n + added > self.capacity:
+            self._grow(n + added)
+
+        for name in COLUMNS:
+            self._columns[name][n:n + added] = incoming[name]
+        self._mm.flush()
+        # Publish the new rows only after the data is in place
+        self._header[1] = n + added
+        self._mm.flush()
+        return added
+
+    def append_candles(self, candles: List[Dict]) -> int:
+        """
+        Append candle dicts as returned by `MarketDataService.get_ohlcv`
+        (`time` in seconds) or `DataFeedService.fetch_ohlcv` (`timestamp` in ms).
+        """
+        if not candles:
+            return 0
+        if "time" in candles[0]:
+            times = [c["time"] for c in candles]
+        else:
+            times = [c["timestamp"] // 1000 for c in candles]
+        return self.append(
+            times,
+            [c["open"] for c in candles],
+            [c["high"] for c in candles],
+            [c["low"] for c in candles],
+            [c["close"] for c in candles],
+            [c["volume"] or 0.0 for c in candles],
+        )
+
+    def _grow(self, needed: int):
+        """Rewrite the file with enough capacity and re-map it."""
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        n = self.count
+        current = {name: col[:n] for name, col in self._columns.items()}
+        self._create(self.path, capacity, current, n)
+        self._map()
+        logger.debug("Grew candle file %s to capacity %s", self.path, capacity)
+
+
+class CandleStore:
+    """Directory of candle files, one per (symbol, timeframe)."""
+
+    def __init__(self, root: Optional[str] = None):
+        """Initialize store rooted at `root` (defaults to settings.CANDLE_CACHE_DIR)."""
+        self.root = root or settings.CANDLE_CACHE_DIR
+        self._open: Dict[str, CandleSeries] = {}
+
+    def path_for(self, symbol: str, timeframe: str) -> str:
+        """File path for a (symbol, timeframe) pair."""
+        return os.path.join(self.root, _file_name(symbol, timeframe))
+
+    def exists(self, symbol: str, timeframe: str) -> bool:
+        """Whether a candle file exists for the pair."""
+        return os.path.exists(self.path_for(symbol, timeframe))
+
+    def open(self, symbol: str, timeframe: str, readonly: bool = False) -> CandleSeries:
+        """Open a series, creating the file when writable and missing."""
+        path = self.path_for(symbol, timeframe)
+        key = f"{path}:{'r' if readonly else 'w'}"
+        series = self._open.get(key)
+        if series is None:
+            if not readonly:
+                os.makedirs(self.root, exist_ok=True)
+            series = CandleSeries(path, readonly=readonly)
+            self._open[key] = series
+        return series
+
+    def range(
+        self, symbol: str, timeframe: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> CandleView:
+        """Zero-copy candles for a pair between two epoch-second bounds."""
+        writer = self._open.get(f"{self.path_for(symbol, timeframe)}:w")
+        series = writer or self.open(symbol, timeframe, readonly=True)
+        return series.range(start, end)
+
+
+candle_store = CandleStore()
@@ -1,67 +1,177 @@
 """
 Data Feed Service - Market data ingestion and management
 """
-import ccxt
-from typing import List, Dict, Optional
+import asyncio
+import logging
+import time
+import ccxt.async_support as ccxt
+from typing import List, Dict, Optional, Sequence
 from datetime import datetime
 
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# One long-lived async session per exchange id, shared by every DataFeedService
+_exchanges: Dict[str, ccxt.Exchange] = {}
+_markets_loaded_at: Dict[str, float] = {}
+_markets_locks: Dict[str, asyncio.Lock] = {}
+
+
+def get_exchange(exchange_id: str) -> ccxt.Exchange:
+    """Shared ccxt async exchange instance (created on first use)."""
+    exchange = _exchanges.get(exchange_id)
+    if exchange is None:
+        exchange_class = getattr(ccxt, exchange_id)
+        # enableRateLimit throttles concurrent calls to the exchange's limits
+        exchange = _exchanges[exchange_id] = exchange_class({
+            'enableRateLimit': True,
+        })
+    return exchange
+
+
+async def close_exchanges():
+    """Close every shared exchange session (app shutdown)."""
+    exchanges = list(_exchanges.values())
+    _exchanges.clear()
+    _markets_loaded_at.clear()
+    _markets_locks.clear()
+    for exchange in exchanges:
+        try:
+            await exchange.close()
+        except Exception as e:
+            logger.warning("Error closing exchange %s: %s", exchange.id, e)
+
+
+def _format_ticker(symbol: str, ticker: Dict) -> Dict:
+    return {
+        "symbol": symbol,
+        "price": ticker.get("last"),
+        "bid": ticker.get("bid"),
+        "ask": ticker.get("ask"),
+        "volume": ticker.get("baseVolume"),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def _format_ohlcv(ohlcv: List[List]) -> List[Dict]:
+    return [
+        {
+            "timestamp": candle[0],
+            "open": candle[1],
+            "high": candle[2],
+            "low": candle[3],
+            "close": candle[4],
+            "volume": candle[5],
+        }
+        for candle in ohlcv
+    ]
+
+
 class DataFeedService:
-    """Service for fetching market data from exchanges."""
-    
+    """
+    Service for fetching market data from exchanges.
+
+    Built on ccxt's asyncio client: instances for the same exchange share
+    one session (and its rate limiter), market metadata is cached for
+    DATAFEED_MARKETS_TTL seconds, and the `*_many` methods fetch many
+    symbols concurrently (bounded by DATAFEED_MAX_CONCURRENCY, throttled by
+    ccxt to the exchange's rate limit).
+    """
+
     def __init__(self, exchange_id: str = "binance"):
         """Initialize the data feed with a specific exchange."""
         self.exchange_id = exchange_id
-        self.exchange = self._initialize_exchange(exchange_id)
-    
-    def _initialize_exchange(self, exchange_id: str):
-        """Initialize CCXT exchange instance."""
-        exchange_class = getattr(ccxt, exchange_id)
-        return exchange_class({
-            'enableRateLimit': True,
-        })
-    
+        self.exchange = get_exchange(exchange_id)
+
+    async def load_markets(self) -> Dict:
+        """Market metadata, loaded once per exchange and refreshed after the TTL."""
+        loaded_at = _markets_loaded_at.get(self.exchange_id)
+        if loaded_at is not None and time.time() - loaded_at < settings.DATAFEED_MARKETS_TTL:
+            return self.exchange.markets
+        lock = _markets_locks.setdefault(self.exchange_id, asyncio.Lock())
+        async with lock:
+            loaded_at = _markets_loaded_at.get(self.exchange_id)
+            if loaded_at is None or time.time() - loaded_at >= settings.DATAFEED_MARKETS_TTL:
+                await self.exchange.load_markets(reload=loaded_at is not None)
+                _markets_loaded_at[self.exchange_id] = time.time()
+        return self.exchange.markets
+
     async def fetch_ticker(self, symbol: str) -> Dict:
         """Fetch current ticker data for a symbol."""
         try:
-            ticker = self.exchange.fetch_ticker(symbol)
-            return {
-                "symbol": symbol,
-                "price": ticker.get("last"),
-                "bid": ticker.get("bid"),
-                "ask": ticker.get("ask"),
-                "volume": ticker.get("baseVolume"),
-                "timestamp": datetime.utcnow().isoformat(),
-            }
+            ticker = await self.exchange.fetch_ticker(symbol)
+            return _format_ticker(symbol, ticker)
         except Exception as e:
             raise Exception(f"Error fetching ticker for {symbol}: {str(e)}")
-    
+
+    async def fetch_tickers(self, symbols: Sequence[str]) -> Dict[str, Dict]:
+        """
+        Fetch tickers for many symbols.
+
+        Uses the exchange's bulk endpoint when it has one (a single request),
+        otherwise one concurrent request per symbol. Symbols that fail are
+        logged and left out of the result.
+        """
+        if not symbols:
+            return {}
+        if self.exchange.has.get("fetchTickers"):
+            try:
+                await self.load_markets()
+                tickers = await self.exchange.fetch_tickers(list(symbols))
+                return {s: _format_ticker(s, tickers[s]) for s in symbols if s in tickers}
+            except Exception as e:
+                logger.warning("Bulk ticker fetch on %s failed, falling back per symbol: %s", self.exchange_id, e)
+        return await self._gather(symbols, self.fetch_ticker)
+
     async def fetch_ohlcv(
-        self, 
-        symbol: str, 
-        timeframe: str = "1h", 
-        limit: int = 100
+        self,
+        symbol: str,
+        timeframe: str = "1h",
+        limit: int = 100,
+        since: Optional[int] = None,
     ) -> List[Dict]:
-        """Fetch OHLCV (candlestick) data."""
+        """Fetch OHLCV (candlestick) data, optionally starting at `since` (ms)."""
         try:
-            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
-            return [
-                {
-                    "timestamp": candle[0],
-                    "open": candle[1],
-                    "high": candle[2],
-                    "low": candle[3],
-                    "close": candle[4],
-                    "volume": candle[5],
-                }
-                for candle in ohlcv
-            ]
+            ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+            return _format_ohlcv(ohlcv)
         except Exception as e:
             raise Exception(f"Error fetching OHLCV for {symbol}: {str(e)}")
-    
+
+    async def fetch_ohlcv_many(
+        self,
+        symbols: Sequence[str],
+        timeframe: str = "1h",
+        limit: int = 100,
+        since: Optional[int] = None,
+    ) -> Dict[str, List[Dict]]:
+        """Fetch OHLCV for many symbols concurrently; failures are logged and skipped."""
+        return await self._gather(
+            symbols, lambda symbol: self.fetch_ohlcv(symbol, timeframe, limit, since)
+        )
+
+    async def _gather(self, symbols: Sequence[str], fetch) -> Dict[str, object]:
+        """Run one fetch per symbol with bounded concurrency."""
+        await self.load_markets()
+        semaphore = asyncio.Semaphore(settings.DATAFEED_MAX_CONCURRENCY)
+
+        async def run(symbol: str):
+            async with semaphore:
+                return await fetch(symbol)
+
+        results = await asyncio.gather(*(run(s) for s in symbols), return_exceptions=True)
+        out = {}
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                logger.warning("%s", result)
+            else:
+                out[symbol] = result
+        return out
+
     async def fetch_markets(self) -> List[str]:
         """Fetch available trading markets/symbols."""
         try:
-            markets = self.exchange.load_markets()
+            markets = await self.load_markets()
             return list(markets.keys())
         except Exception as e:
             raise Exception(f"Error fetching markets: {str(e)}")
@@ -0,0 +1,296 @@
+"""
+Mark-to-Market Service - Vectorized unrealized PnL for open positions with bulk flushes
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+import asyncpg
+import numpy as np
+
+from app.core.config import settings
+from app.services.quote_stream import QuoteBus, quote_bus, quote_price
+
+logger = logging.getLogger(__name__)
+
+OPEN_POSITIONS_SQL = """
+SELECT id, symbol, side, amount, entry_price, current_price
+FROM trading.positions
+WHERE is_open
+ORDER BY symbol, id
+"""
+
+# One statement per flush: join the snapshot arrays against the table by id
+UPDATE_MARKS_SQL = """
+UPDATE trading.positions AS p
+SET current_price = u.price, unrealized_pnl = u.pnl
+FROM unnest($1::integer[], $2::float8[], $3::float8[]) AS u(id, price, pnl)
+WHERE p.id = u.id AND p.is_open
+"""
+
+MAX_RETRY_DELAY = 30.0
+
+
+class _SymbolBook:
+    """Open positions in one symbol as parallel arrays."""
+
+    __slots__ = ("ids", "qty", "entry", "pnl", "price", "marked_at")
+
+    def __init__(self, ids: List[int], qty: List[float], entry: List[float]):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.qty = np.asarray(qty, dtype=np.float64)  # signed: long > 0, short < 0
+        self.entry = np.asarray(entry, dtype=np.float64)
+        self.pnl = np.zeros(len(ids), dtype=np.float64)
+        self.price = 0.0
+        self.marked_at = 0.0
+
+    def mark(self, price: float) -> None:
+        """Recompute every position's unrealized PnL at `price`."""
+        np.multiply(self.qty, price - self.entry, out=self.pnl)
+        self.price = price
+        self.marked_at = time.time()
+
+
+class MarkToMarketService:
+    """
+    Keep `current_price` and `unrealized_pnl` of open positions current.
+
+    Open positions are held in memory grouped by symbol, as arrays of
+    signed quantity and entry price, so a price change re-marks all of a
+    symbol's positions in one vectorized step. Prices come from every quote
+    published on the QuoteBus, plus a poll through MarketDataService for
+    symbols without a fresh quote. Re-marked symbols are only flagged
+    dirty; a flusher writes their snapshots to `trading.positions` every
+    `MTM_FLUSH_INTERVAL` seconds in a single bulk UPDATE, and the open set
+    is re-read every `MTM_RELOAD_INTERVAL` seconds to pick up opened and
+    closed positions.
+    """
+
+    def __init__(
+        self,
+        bus: Optional[QuoteBus] = None,
+        market_service=None,
+        database_url: Optional[str] = None,
+    ):
+        """Initialize mark-to-market service."""
+        self.bus = bus or quote_bus
+        self._market_service = market_service
+        self.database_url = database_url or settings.DATABASE_URL
+        self.pool: Optional[asyncpg.Pool] = None
+        self._books: Dict[str, _SymbolBook] = {}
+        self._prices: Dict[str, float] = {}
+        self._dirty: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._failures = 0
+        self.marks = 0
+        self.flushed_rows = 0
+        self.last_flush: Dict = {}
+
+    @property
+    def market_service(self):
+        """MarketDataService used for polling, created on first use."""
+        if self._market_service is None:
+            from app.services.market_data import MarketDataService
+            self._market_service = MarketDataService()
+        return self._market_service
+
+    async def connect(self) -> None:
+        """Open the asyncpg pool."""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=2)
+
+    # --- Positions ---
+
+    def load(self, rows) -> None:
+        """Replace the in-memory open positions (rows ordered by symbol)."""
+        grouped: Dict[str, tuple] = {}
+        for row in rows:
+            symbol = row["symbol"].upper()
+            ids, qty, entry = grouped.setdefault(symbol, ([], [], []))
+            sign = -1.0 if row["side"] == "sell" else 1.0
+            ids.append(row["id"])
+            qty.append(sign * float(row["amount"]))
+            entry.append(float(row["entry_price"]))
+            if symbol not in self._prices and row["current_price"] is not None:
+                self._prices[symbol] = float(row["current_price"])
+
+        books = {}
+        for symbol, (ids, qty, entry) in grouped.items():
+            book = books[symbol] = _SymbolBook(ids, qty, entry)
+            price = self._prices.get(symbol)
+            if price:
+                book.mark(price)
+                self._dirty.add(symbol)
+        self._books = books
+        self._dirty &= set(books)
+
+    async def reload(self) -> int:
+        """Re-read open positions from the database."""
+        await self.connect()
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(OPEN_POSITIONS_SQL)
+        self.load(rows)
+        return len(rows)
+
+    # --- Marking ---
+
+    def on_price(self, symbol: str, price: Optional[float]) -> None:
+        """Re-mark a symbol's positions if the price moved."""
+        if not price:
+            return
+        symbol = symbol.upper()
+        self._prices[symbol] = price
+        book = self._books.get(symbol)
+        if book is None:
+            return
+        if price == book.price:
+            book.marked_at = time.time()
+            return
+        book.mark(price)
+        self.marks += len(book.ids)
+        self._dirty.add(symbol)
+
+    def on_quote(self, symbol: str, quote: Dict) -> None:
+        """QuoteBus listener."""
+        self.on_price(symbol, quote_price(quote))
+
+    async def poll(self) -> None:
+        """Fetch quotes for held symbols that have not been marked recently."""
+        stale_before = time.time() - settings.MTM_POLL_INTERVAL
+        symbols = [s for s, book in self._books.items() if book.marked_at < stale_before]
+        if not symbols:
+            return
+        semaphore = asyncio.Semaphore(settings.DATAFEED_MAX_CONCURRENCY)
+
+        async def fetch(symbol: str):
+            async with semaphore:
+                return await self.market_service.fetch_quote(symbol)
+
+        quotes = await asyncio.gather(*(fetch(s) for s in symbols), return_exceptions=True)
+        for symbol, quote in zip(symbols, quotes):
+            if isinstance(quote, Exception):
+                logger.warning("Mark-to-market quote for %s failed: %s", symbol, quote)
+            else:
+                self.on_price(symbol, quote_price(quote))
+
+    # --- Flushing ---
+
+    def snapshot(self, symbols) -> tuple:
+        """Concatenated (ids, prices, pnl) arrays for the given symbols."""
+        books = [self._books[s] for s in symbols if s in self._books]
+        if not books:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty
+        ids = np.concatenate([b.ids for b in books])
+        prices = np.concatenate([np.full(len(b.ids), b.price) for b in books])
+        pnl = np.round(np.concatenate([b.pnl for b in books]), 8)
+        return ids, prices, pnl
+
+    async def flush(self) -> int:
+        """
+        Write dirty symbols' marks to trading.positions in one UPDATE.
+
+        Returns:
+            Number of position rows sent
+        """
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        ids, prices, pnl = self.snapshot(dirty)
+        started = time.perf_counter()
+        try:
+            await self.connect()
+            async with self.pool.acquire() as conn:
+                await conn.execute(UPDATE_MARKS_SQL, ids.tolist(), prices.tolist(), pnl.tolist())
+        except Exception:
+            # Re-marked symbols stay dirty for the next flush
+            self._dirty |= dirty
+            raise
+        self.flushed_rows += len(ids)
+        self.last_flush = {
+            "symbols": len(dirty),
+            "rows": len(ids),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "at": time.time(),
+        }
+        return len(ids)
+
+    async def _flush_loop(self) -> None:
+        """Flush on a short interval, backing off while the database is down."""
+        while True:
+            delay = min(MAX_RETRY_DELAY, settings.MTM_FLUSH_INTERVAL * 2 ** min(self._failures, 16))
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                if self._failures == 1:
+                    logger.warning("Mark-to-market flush failed, retrying: %s", e)
+
+    async def _reload_loop(self) -> None:
+        while True:
+            try:
+                await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Loading open positions failed: %s", e)
+            await asyncio.sleep(settings.MTM_RELOAD_INTERVAL)
+
+    async def _poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.MTM_POLL_INTERVAL)
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Mark-to-market poll failed: %s", e)
+
+    def start(self) -> None:
+        """Listen to the quote bus and start the reload, poll and flush loops."""
+        if self._tasks:
+            return
+        self.bus.add_listener(self.on_quote)
+        self._tasks = [
+            asyncio.ensure_future(self._reload_loop()),
+            asyncio.ensure_future(self._poll_loop()),
+            asyncio.ensure_future(self._flush_loop()),
+        ]
+
+    async def stop(self) -> None:
+        """Stop background loops, make a final flush and close the pool."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Final mark-to-market flush failed: %s", e)
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_stats(self) -> Dict:
+        """Positions held, pending dirty symbols and flush totals."""
+        return {
+            "symbols": len(self._books),
+            "positions": sum(len(b.ids) for b in self._books.values()),
+            "dirty_symbols": len(self._dirty),
+            "marks": self.marks,
+            "flushed_rows": self.flushed_rows,
+            "failures": self._failures,
+            "last_flush": self.last_flush,
+        }
+
+
+mark_to_market = MarkToMarketService()
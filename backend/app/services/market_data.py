@@ -1,3 +1,4 @@
+import asyncio
 import finnhub
 import logging
 from datetime import datetime
@@ -7,10 +8,14 @@ import time
 
 import httpx
 from app.core.config import settings
+from app.services.cache_service import cache_service, cached
+from app.services.cache_warmup import cache_warmup
+from app.services.quote_stream import quote_bus, trade_stream
 
 logger = logging.getLogger(__name__)
 
 FINNHUB_QUOTE_URL = "https://finnhub.io/api/v1/quote"
+INDICATORS_TTL = 300
 
 
 def _safe_float(val: Any, default: float = 0.0) -> float:
@@ -53,8 +58,72 @@ class MarketDataService:
             return data
 
     async def get_stock_quote(self, symbol: str) -> Dict:
-        """Get real-time stock quote using Finnhub."""
+        """
+        Get real-time stock quote for a client request.
+
+        Counts as demand for the pre-market warm-up and keeps the symbol
+        streamed for a while (a lease), so repeated requests are served
+        from the trade stream.
+        """
         symbol = symbol.upper()
+        cache_warmup.record_demand(symbol)
+        if trade_stream.is_running:
+            await trade_stream.lease(symbol)
+        return await self.fetch_quote(symbol)
+
+    async def fetch_quote(self, symbol: str) -> Dict:
+        """
+        Quote from the trade stream when live, else Finnhub REST (cached).
+
+        For internal pollers: records no demand and takes no upstream
+        subscription (callers that need one `acquire` it).
+        """
+        symbol = symbol.upper()
+        if trade_stream.is_connected:
+            streamed = quote_bus.get_quote(symbol, max_baseline_age=settings.QUOTE_STREAM_BASELINE_TTL)
+            if streamed is not None:
+                return streamed
+
+        quote = await self._get_quote_snapshot(symbol)
+        # Seed the stream baseline of streamed symbols; later trades update it in place
+        if trade_stream.is_streaming(symbol) and not quote.get("is_simulated"):
+            quote_bus.seed(symbol, quote)
+        return quote
+
+    async def get_stock_quotes(self, symbols: List[str]) -> Dict[str, Dict]:
+        """
+        Quotes for many symbols: streamed quotes first, then one cache round
+        trip, then concurrent upstream fetches for the misses only.
+        """
+        symbols = list(dict.fromkeys(s.upper() for s in symbols))
+        quotes: Dict[str, Dict] = {}
+        if trade_stream.is_connected:
+            for symbol in symbols:
+                streamed = quote_bus.get_quote(symbol, max_baseline_age=settings.QUOTE_STREAM_BASELINE_TTL)
+                if streamed is not None:
+                    quotes[symbol] = streamed
+        remaining = [s for s in symbols if s not in quotes]
+        if remaining:
+            hits, misses = await cache_service.get_cached_quotes(remaining)
+            quotes.update(hits)
+            if misses:
+                semaphore = asyncio.Semaphore(settings.DATAFEED_MAX_CONCURRENCY)
+
+                async def fetch(symbol: str) -> Dict:
+                    async with semaphore:
+                        return await self.fetch_quote(symbol)
+
+                results = await asyncio.gather(*(fetch(s) for s in misses), return_exceptions=True)
+                for symbol, result in zip(misses, results):
+                    if isinstance(result, Exception):
+                        logger.warning("Quote for %s failed: %s", symbol, result)
+                    else:
+                        quotes[symbol] = result
+        return quotes
+
+    @cached("quote", ttl=lambda params: cache_service.quote_ttl())
+    async def _get_quote_snapshot(self, symbol: str) -> Dict:
+        """Get a quote snapshot via Finnhub REST (cache-aside), simulated on failure."""
         try:
             quote = await self._fetch_quote_http(symbol)
             if not quote:
@@ -245,6 +314,7 @@ class MarketDataService:
             logger.warning(f"Error calculating Fibonacci levels: {e}")
             return {"levels": {}, "current_level": None}
 
+    @cached("indicators", ttl=INDICATORS_TTL)
     async def get_technical_indicators(self, symbol: str) -> Dict:
         """Calculate technical indicators using Finnhub candles."""
         try:
@@ -322,6 +392,7 @@ class MarketDataService:
                 "is_simulated": True
             }
 
+    @cached("ohlcv", ttl=lambda params: cache_service.ohlcv_ttl(params["resolution"]))
     async def get_ohlcv(self, symbol: str, resolution: str = 'D', days: int = 30) -> List[Dict]:
         """Get OHLCV (candlestick) data for a symbol."""
         try:
@@ -361,11 +432,13 @@ class MarketDataService:
                     "high": round(max(o, c) + random.uniform(0, 1), 2),
                     "low": round(min(o, c) - random.uniform(0, 1), 2),
                     "close": round(c, 2),
-                    "volume": random.randint(100000, 1000000)
+                    "volume": random.randint(100000, 1000000),
+                    "is_simulated": True
                 })
                 base_price = c
             return simulated
     
+    @cached("vix", ttl=lambda params: cache_service.quote_ttl())
     async def get_vix(self) -> Dict:
         """Get VIX (Volatility Index) data using Finnhub."""
         try:
@@ -401,8 +474,10 @@ class MarketDataService:
                 "risk_level": risk_level
             }
         except Exception as e:
-            return {"value": 14.08, "status": "low", "risk_level": "moderate"}
+            logger.warning("VIX fetch failed: %s", e)
+            return {"value": 14.08, "status": "low", "risk_level": "moderate", "is_simulated": True}
     
+    @cached("analysis", ttl=60)
     async def get_complete_analysis(self, symbol: str) -> Dict:
         """Get complete stock analysis with all indicators."""
         try:
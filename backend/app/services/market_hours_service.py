@@ -2,14 +2,245 @@
 Market Hours Service - Gestión de horarios de mercado NYSE/NASDAQ
 Basado en análisis de Robinhood: trading 24 horas y validación de horarios
 """
+import bisect
 import logging
-from datetime import datetime, time, timedelta
-from typing import Dict, Optional
+import time as _time
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
 import pytz
 
 logger = logging.getLogger(__name__)
 
-logger = logging.getLogger(__name__)
+# Años precalculados en el calendario de sesiones
+CALENDAR_START_YEAR = 2000
+CALENDAR_END_YEAR = 2040
+
+# Cierres extraordinarios de NYSE (no siguen ninguna regla)
+SPECIAL_CLOSURES = {
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),  # 11-S
+    date(2004, 6, 11),   # Funeral de Reagan
+    date(2007, 1, 2),    # Funeral de Ford
+    date(2012, 10, 29), date(2012, 10, 30),  # Huracán Sandy
+    date(2018, 12, 5),   # Funeral de George H. W. Bush
+    date(2025, 1, 9),    # Funeral de Carter
+}
+
+TimestampArray = Union[np.ndarray, pd.DatetimeIndex, List[int]]
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """n-ésimo día de la semana del mes (n=-1: el último)"""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    """Domingo de Pascua (algoritmo anónimo gregoriano)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day: date) -> date:
+    """Festivo en sábado se observa el viernes; en domingo, el lunes"""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year: int) -> set:
+    """Días festivos de NYSE de un año según las reglas vigentes"""
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),   # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),   # Presidents' Day
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),   # Independence Day
+        _nth_weekday(year, 9, 0, 1),   # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),  # Christmas
+    }
+    # Año Nuevo en sábado no se observa el viernes anterior
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return holidays
+
+
+def nyse_early_closes(year: int, holidays: set) -> set:
+    """Sesiones que cierran a las 13:00"""
+    candidates = {
+        date(year, 7, 3),
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1),  # Día después de Thanksgiving
+        date(year, 12, 24),
+    }
+    return {d for d in candidates if d.weekday() < 5 and d not in holidays}
+
+
+class SessionCalendar:
+    """
+    Calendario de sesiones precalculado para varios años.
+
+    Guarda arrays ordenados (epoch en segundos, UTC) de inicio de pre-market,
+    apertura, cierre y fin de after-hours por sesión. Las consultas escalares
+    usan bisect sobre listas; las vectoriales, np.searchsorted sobre arrays,
+    para marcar millones de timestamps de un backtest de una vez.
+    """
+    
+    MARKET_TZ = pytz.timezone('US/Eastern')
+    PRE_MARKET_OPEN = time(4, 0)
+    MARKET_OPEN = time(9, 30)
+    MARKET_CLOSE = time(16, 0)
+    EARLY_CLOSE = time(13, 0)
+    # After-hours dura 4 horas desde el cierre (hasta las 20:00, o 17:00 en cierre temprano)
+    AFTER_HOURS_LENGTH = 4 * 3600
+    
+    def __init__(self, start_year: int = CALENDAR_START_YEAR, end_year: int = CALENDAR_END_YEAR):
+        """Precalcular las sesiones de start_year a end_year inclusive"""
+        self.start_year = start_year
+        self.end_year = end_year
+        
+        holidays = set()
+        early = set()
+        for year in range(start_year, end_year + 1):
+            year_holidays = nyse_holidays(year) | {d for d in SPECIAL_CLOSURES if d.year == year}
+            holidays |= year_holidays
+            early |= nyse_early_closes(year, year_holidays)
+        self.holidays = frozenset(holidays)
+        self.early_closes = frozenset(early)
+        
+        days = pd.bdate_range(date(start_year, 1, 1), date(end_year, 12, 31))
+        days = days[~days.isin(pd.DatetimeIndex(sorted(holidays)))]
+        self.session_dates: List[date] = [d.date() for d in days]
+        self._date_index = {d: i for i, d in enumerate(self.session_dates)}
+        
+        def at(local_time: time) -> np.ndarray:
+            offset = pd.Timedelta(hours=local_time.hour, minutes=local_time.minute)
+            return (days + offset).tz_localize(self.MARKET_TZ).as_unit("s").asi8
+        
+        is_early = days.isin(pd.DatetimeIndex(sorted(early)))
+        self.pre_opens = at(self.PRE_MARKET_OPEN)
+        self.opens = at(self.MARKET_OPEN)
+        self.closes = np.where(is_early, at(self.EARLY_CLOSE), at(self.MARKET_CLOSE))
+        self.after_closes = self.closes + self.AFTER_HOURS_LENGTH
+        
+        # Listas Python para bisect: más rápidas que searchsorted en consultas escalares
+        self._pre_opens = self.pre_opens.tolist()
+        self._opens = self.opens.tolist()
+        self._closes = self.closes.tolist()
+        self._after_closes = self.after_closes.tolist()
+    
+    def __len__(self) -> int:
+        return len(self._opens)
+    
+    # --- Consultas escalares (epoch en segundos) ---
+    
+    def is_session_day(self, day: date) -> bool:
+        """Día con sesión (no fin de semana, festivo ni cierre extraordinario)"""
+        return day in self._date_index
+    
+    def phase(self, ts: float) -> str:
+        """Fase del mercado: regular, pre_market, after_hours o closed"""
+        i = bisect.bisect_right(self._pre_opens, ts) - 1
+        if i < 0 or ts >= self._after_closes[i]:
+            return "closed"
+        if ts < self._opens[i]:
+            return "pre_market"
+        if ts < self._closes[i]:
+            return "regular"
+        return "after_hours"
+    
+    def is_open(self, ts: float) -> bool:
+        """Mercado en horario regular"""
+        i = bisect.bisect_right(self._opens, ts) - 1
+        return i >= 0 and ts < self._closes[i]
+    
+    def session_of(self, ts: float) -> Optional[int]:
+        """Índice de la sesión regular que contiene ts, o None"""
+        i = bisect.bisect_right(self._opens, ts) - 1
+        return i if i >= 0 and ts < self._closes[i] else None
+    
+    def next_open(self, ts: float) -> Optional[int]:
+        """Próxima apertura estrictamente posterior a ts"""
+        i = bisect.bisect_right(self._opens, ts)
+        return self._opens[i] if i < len(self._opens) else None
+    
+    def next_close(self, ts: float) -> Optional[int]:
+        """Próximo cierre estrictamente posterior a ts"""
+        i = bisect.bisect_right(self._closes, ts)
+        return self._closes[i] if i < len(self._closes) else None
+    
+    # --- Consultas vectoriales ---
+    
+    @staticmethod
+    def _as_epoch(timestamps: TimestampArray) -> np.ndarray:
+        """Normalizar a epoch en segundos (int64); acepta datetime64 o enteros"""
+        arr = np.asarray(timestamps)
+        if arr.dtype.kind == "M":
+            return arr.astype("datetime64[s]").astype(np.int64)
+        return arr.astype(np.int64, copy=False)
+    
+    def session_ids(self, timestamps: TimestampArray, extended: bool = False) -> np.ndarray:
+        """Índice de sesión por timestamp (-1 fuera de sesión).
+
+        Con `extended` cuentan también pre-market y after-hours, útil para
+        agrupar barras por sesión al re-muestrear.
+        """
+        ts = self._as_epoch(timestamps)
+        starts, ends = (self.pre_opens, self.after_closes) if extended else (self.opens, self.closes)
+        idx = np.searchsorted(starts, ts, side="right") - 1
+        inside = (idx >= 0) & (ts < ends[np.maximum(idx, 0)])
+        return np.where(inside, idx, -1)
+    
+    def is_open_mask(self, timestamps: TimestampArray, extended: bool = False) -> np.ndarray:
+        """Máscara booleana de timestamps dentro de sesión"""
+        return self.session_ids(timestamps, extended) >= 0
+    
+    def next_open_array(self, timestamps: TimestampArray) -> np.ndarray:
+        """Próxima apertura por timestamp (-1 más allá del calendario)"""
+        ts = self._as_epoch(timestamps)
+        idx = np.searchsorted(self.opens, ts, side="right")
+        valid = idx < len(self.opens)
+        return np.where(valid, self.opens[np.minimum(idx, len(self.opens) - 1)], -1)
+    
+    def session_bounds(self, session_ids: np.ndarray) -> Dict[str, np.ndarray]:
+        """Apertura y cierre de cada id de sesión (ids -1 se devuelven como -1)"""
+        ids = np.asarray(session_ids)
+        safe = np.maximum(ids, 0)
+        valid = ids >= 0
+        return {
+            "open": np.where(valid, self.opens[safe], -1),
+            "close": np.where(valid, self.closes[safe], -1),
+        }
+
+
+_session_calendar: Optional[SessionCalendar] = None
+
+
+def get_session_calendar() -> SessionCalendar:
+    """Calendario compartido, construido en el primer uso"""
+    global _session_calendar
+    if _session_calendar is None:
+        _session_calendar = SessionCalendar()
+    return _session_calendar
+
 
 class MarketHoursService:
     """Servicio para gestionar horarios de mercado NYSE/NASDAQ"""
@@ -23,37 +254,15 @@ class MarketHoursService:
     # Zona horaria del mercado
     MARKET_TZ = pytz.timezone('US/Eastern')
     
-    def __init__(self):
-        """Inicializar servicio de horarios de mercado"""
-        self._holidays = self._load_holidays()
-    
-    def _load_holidays(self) -> set:
-        """Cargar días festivos del mercado (simplificado)"""
-        # En producción, usar librería como pandas_market_calendars
-        # Por ahora, días festivos comunes 2024-2025
-        holidays = {
-            datetime(2024, 1, 1).date(),   # New Year's Day
-            datetime(2024, 1, 15).date(),  # Martin Luther King Jr. Day
-            datetime(2024, 2, 19).date(),  # Presidents' Day
-            datetime(2024, 3, 29).date(),  # Good Friday
-            datetime(2024, 5, 27).date(),  # Memorial Day
-            datetime(2024, 6, 19).date(),  # Juneteenth
-            datetime(2024, 7, 4).date(),   # Independence Day
-            datetime(2024, 9, 2).date(),   # Labor Day
-            datetime(2024, 11, 28).date(),  # Thanksgiving
-            datetime(2024, 12, 25).date(), # Christmas
-            datetime(2025, 1, 1).date(),   # New Year's Day
-            datetime(2025, 1, 20).date(),  # Martin Luther King Jr. Day
-            datetime(2025, 2, 17).date(),  # Presidents' Day
-            datetime(2025, 4, 18).date(),  # Good Friday
-            datetime(2025, 5, 26).date(),  # Memorial Day
-            datetime(2025, 6, 19).date(),  # Juneteenth
-            datetime(2025, 7, 4).date(),   # Independence Day
-            datetime(2025, 9, 1).date(),   # Labor Day
-            datetime(2025, 11, 27).date(), # Thanksgiving
-            datetime(2025, 12, 25).date(), # Christmas
-        }
-        return holidays
+    def __init__(self, calendar: Optional[SessionCalendar] = None):
+        """Inicializar servicio de horarios de mercado (sin coste: el calendario se comparte)"""
+        self._calendar = calendar
+    
+    @property
+    def calendar(self) -> SessionCalendar:
+        if self._calendar is None:
+            self._calendar = get_session_calendar()
+        return self._calendar
     
     def _is_weekend(self, dt: datetime) -> bool:
         """Verificar si es fin de semana"""
@@ -61,69 +270,61 @@ class MarketHoursService:
     
     def _is_holiday(self, dt: datetime) -> bool:
         """Verificar si es día festivo"""
-        return dt.date() in self._holidays
+        return dt.date() in self.calendar.holidays
     
     def _is_market_day(self, dt: datetime) -> bool:
         """Verificar si es día de mercado (no fin de semana ni festivo)"""
-        if self._is_weekend(dt):
-            return False
-        if self._is_holiday(dt):
-            return False
-        return True
+        return self.calendar.is_session_day(dt.date())
     
     def _get_market_time(self, dt: Optional[datetime] = None) -> datetime:
         """Obtener tiempo actual en zona horaria del mercado"""
         if dt is None:
-            dt = datetime.now()
+            return datetime.now(self.MARKET_TZ)
         # Convertir a zona horaria del mercado
         if dt.tzinfo is None:
             dt = pytz.utc.localize(dt)
         return dt.astimezone(self.MARKET_TZ)
     
+    @staticmethod
+    def _timestamp(dt: Optional[datetime] = None) -> float:
+        """Epoch en segundos (datetimes sin zona se interpretan como UTC)"""
+        if dt is None:
+            return _time.time()
+        if dt.tzinfo is None:
+            dt = pytz.utc.localize(dt)
+        return dt.timestamp()
+    
+    def _from_timestamp(self, ts: Optional[int]) -> Optional[datetime]:
+        return datetime.fromtimestamp(ts, self.MARKET_TZ) if ts is not None else None
+    
     def is_market_open(self, dt: Optional[datetime] = None) -> bool:
         """Verificar si el mercado está abierto"""
-        market_dt = self._get_market_time(dt)
-        
-        if not self._is_market_day(market_dt):
-            return False
-        
-        current_time = market_dt.time()
-        return self.MARKET_OPEN <= current_time < self.MARKET_CLOSE
+        return self.calendar.is_open(self._timestamp(dt))
     
     def is_pre_market(self, dt: Optional[datetime] = None) -> bool:
         """Verificar si es pre-market"""
-        market_dt = self._get_market_time(dt)
-        
-        if not self._is_market_day(market_dt):
-            return False
-        
-        current_time = market_dt.time()
-        return self.PRE_MARKET_OPEN <= current_time < self.MARKET_OPEN
+        return self.calendar.phase(self._timestamp(dt)) == "pre_market"
     
     def is_after_hours(self, dt: Optional[datetime] = None) -> bool:
         """Verificar si es after-hours"""
-        market_dt = self._get_market_time(dt)
-        
-        if not self._is_market_day(market_dt):
-            return False
-        
-        current_time = market_dt.time()
-        return self.MARKET_CLOSE <= current_time < self.AFTER_HOURS_CLOSE
+        return self.calendar.phase(self._timestamp(dt)) == "after_hours"
     
     def is_extended_hours(self, dt: Optional[datetime] = None) -> bool:
         """Verificar si es extended hours (pre-market o after-hours)"""
-        return self.is_pre_market(dt) or self.is_after_hours(dt)
+        return self.calendar.phase(self._timestamp(dt)) in ("pre_market", "after_hours")
     
     def get_market_status(self, dt: Optional[datetime] = None) -> Dict:
         """Obtener estado completo del mercado"""
         market_dt = self._get_market_time(dt)
-        is_open = self.is_market_open(dt)
-        is_pre = self.is_pre_market(dt)
-        is_after = self.is_after_hours(dt)
+        ts = market_dt.timestamp()
+        phase = self.calendar.phase(ts)
+        is_open = phase == "regular"
+        is_pre = phase == "pre_market"
+        is_after = phase == "after_hours"
         
         # Calcular próximo open/close
-        next_open = self.get_next_open(market_dt)
-        next_close = self.get_next_close(market_dt)
+        next_open = self._from_timestamp(self.calendar.next_open(ts))
+        next_close = self._from_timestamp(self.calendar.next_close(ts))
         
         return {
             "is_open": is_open,
@@ -141,30 +342,11 @@ class MarketHoursService:
     
     def get_next_open(self, dt: Optional[datetime] = None) -> Optional[datetime]:
         """Obtener próximo horario de apertura del mercado"""
-        market_dt = self._get_market_time(dt)
-        candidate = market_dt.replace(hour=self.MARKET_OPEN.hour, minute=self.MARKET_OPEN.minute, second=0, microsecond=0)
-        
-        # Si ya pasó el open de hoy, buscar el siguiente día
-        if candidate <= market_dt or not self._is_market_day(candidate):
-            candidate += timedelta(days=1)
-            while not self._is_market_day(candidate):
-                candidate += timedelta(days=1)
-        
-        return candidate
+        return self._from_timestamp(self.calendar.next_open(self._timestamp(dt)))
     
     def get_next_close(self, dt: Optional[datetime] = None) -> Optional[datetime]:
         """Obtener próximo horario de cierre del mercado"""
-        market_dt = self._get_market_time(dt)
-        candidate = market_dt.replace(hour=self.MARKET_CLOSE.hour, minute=self.MARKET_CLOSE.minute, second=0, microsecond=0)
-        
-        # Si ya pasó el close de hoy, buscar el siguiente día
-        if candidate <= market_dt or not self._is_market_day(candidate):
-            candidate += timedelta(days=1)
-            while not self._is_market_day(candidate):
-                candidate += timedelta(days=1)
-            candidate = candidate.replace(hour=self.MARKET_CLOSE.hour, minute=self.MARKET_CLOSE.minute)
-        
-        return candidate
+        return self._from_timestamp(self.calendar.next_close(self._timestamp(dt)))
     
     def can_trade_now(self, order_type: str = "market") -> bool:
         """Verificar si se puede operar ahora según tipo de orden"""
@@ -210,3 +392,6 @@ class MarketHoursService:
                 "message": "Mercado cerrado",
                 "can_trade": False
             }
+
+
+market_hours_service = MarketHoursService()
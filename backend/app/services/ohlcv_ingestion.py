@@ -0,0 +1,379 @@
+"""
+OHLCV Ingestion Service - Bulk historical candle loading into TimescaleDB
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# (time, symbol, timeframe, open, high, low, close, volume)
+CandleRow = Tuple[datetime, str, str, float, float, float, float, float]
+
+STAGE_COLUMNS = ["time", "symbol", "timeframe", "open", "high", "low", "close", "volume"]
+
+# Finnhub resolution -> bar length in seconds (used to size request windows)
+FINNHUB_RESOLUTION_SECONDS = {
+    "1": 60,
+    "5": 5 * 60,
+    "15": 15 * 60,
+    "30": 30 * 60,
+    "60": 60 * 60,
+    "D": 24 * 60 * 60,
+    "W": 7 * 24 * 60 * 60,
+    "M": 31 * 24 * 60 * 60,
+}
+
+CREATE_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS ohlcv_stage (
+    time TIMESTAMPTZ NOT NULL,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    open DOUBLE PRECISION NOT NULL,
+    high DOUBLE PRECISION NOT NULL,
+    low DOUBLE PRECISION NOT NULL,
+    close DOUBLE PRECISION NOT NULL,
+    volume DOUBLE PRECISION NOT NULL
+) ON COMMIT DELETE ROWS
+"""
+
+# DISTINCT ON keeps a single row per key, otherwise ON CONFLICT DO UPDATE
+# would fail when a batch contains the same candle twice.
+UPSERT_FROM_STAGE_SQL = """
+INSERT INTO trading.ohlcv (time, symbol, timeframe, open, high, low, close, volume)
+SELECT DISTINCT ON (time, symbol, timeframe)
+    time, symbol, timeframe, open, high, low, close, volume
+FROM ohlcv_stage
+ORDER BY time, symbol, timeframe
+ON CONFLICT (time, symbol, timeframe) DO UPDATE SET
+    open = EXCLUDED.open,
+    high = EXCLUDED.high,
+    low = EXCLUDED.low,
+    close = EXCLUDED.close,
+    volume = EXCLUDED.volume
+"""
+
+GET_CHECKPOINT_SQL = """
+SELECT last_time FROM trading.ohlcv_ingest_checkpoints
+WHERE source = $1 AND symbol = $2 AND timeframe = $3
+"""
+
+SET_CHECKPOINT_SQL = """
+INSERT INTO trading.ohlcv_ingest_checkpoints (source, symbol, timeframe, last_time, updated_at)
+VALUES ($1, $2, $3, $4, NOW())
+ON CONFLICT (source, symbol, timeframe) DO UPDATE SET
+    last_time = GREATEST(trading.ohlcv_ingest_checkpoints.last_time, EXCLUDED.last_time),
+    updated_at = NOW()
+"""
+
+
+def _to_utc(ts: float) -> datetime:
+    """Convert an epoch timestamp in seconds to an aware UTC datetime."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+class OHLCVIngestionService:
+    """
+    Bulk loader for `trading.ohlcv`.
+
+    Candles are fetched per symbol, buffered into batches and written with a
+    binary COPY into a temporary staging table, then merged into the
+    hypertable with a single INSERT ... ON CONFLICT DO UPDATE. The checkpoint
+    for each (source, symbol, timeframe) is advanced in the same transaction
+    as the batch, so an interrupted run resumes exactly where it stopped.
+    Finnhub requests from all workers share one FINNHUB_RATE_LIMIT_PER_MIN
+    token bucket.
+    """
+
+    def __init__(
+        self,
+        database_url: Optional[str] = None,
+        workers: int = 8,
+        batch_size: int = 50_000,
+        fetch_queue_size: int = 4,
+    ):
+        """
+        Initialize ingestion service.
+
+        Args:
+            database_url: Postgres DSN (defaults to settings.DATABASE_URL)
+            workers: Number of symbols ingested concurrently
+            batch_size: Rows per COPY/upsert transaction
+            fetch_queue_size: Batches buffered between a symbol's fetcher and writer
+        """
+        self.database_url = database_url or settings.DATABASE_URL
+        self.workers = workers
+        self.batch_size = batch_size
+        self.fetch_queue_size = fetch_queue_size
+        self.pool: Optional[asyncpg.Pool] = None
+        self.finnhub_limiter = RateLimiter(settings.FINNHUB_RATE_LIMIT_PER_MIN / 60)
+        self._finnhub_client = None
+
+    @property
+    def finnhub_client(self):
+        """Finnhub client shared by every symbol, created on first use."""
+        if self._finnhub_client is None:
+            from app.services.market_data import MarketDataService
+            self._finnhub_client = MarketDataService().finnhub_client
+        return self._finnhub_client
+
+    async def connect(self):
+        """Open the asyncpg pool (one connection per worker)."""
+        if self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(
+            self.database_url,
+            min_size=1,
+            max_size=self.workers,
+            init=self._init_connection,
+        )
+
+    async def disconnect(self):
+        """Close the asyncpg pool."""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _init_connection(self, conn: asyncpg.Connection):
+        """Create the per-connection staging table."""
+        await conn.execute(CREATE_STAGE_SQL)
+
+    async def get_checkpoint(self, source: str, symbol: str, timeframe: str) -> Optional[datetime]:
+        """Return the last ingested candle time for a symbol, if any."""
+        await self.connect()
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(GET_CHECKPOINT_SQL, source, symbol, timeframe)
+
+    async def write_batch(self, source: str, symbol: str, timeframe: str, rows: List[CandleRow]) -> int:
+        """COPY a batch into staging, upsert it into trading.ohlcv and advance the checkpoint."""
+        if not rows:
+            return 0
+        await self.connect()
+        last_time = max(row[0] for row in rows)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table("ohlcv_stage", records=rows, columns=STAGE_COLUMNS)
+                await conn.execute(UPSERT_FROM_STAGE_SQL)
+                await conn.execute(SET_CHECKPOINT_SQL, source, symbol, timeframe, last_time)
+        return len(rows)
+
+    async def _fetch_finnhub(
+        self, symbol: str, resolution: str, start: datetime, end: datetime
+    ) -> AsyncIterator[List[CandleRow]]:
+        """Page through Finnhub stock candles in fixed-size time windows."""
+        client = self.finnhub_client
+        bar_seconds = FINNHUB_RESOLUTION_SECONDS.get(resolution, 24 * 60 * 60)
+        window = bar_seconds * 5000
+        cursor = int(start.timestamp())
+        stop = int(end.timestamp())
+
+        while cursor <= stop:
+            window_end = min(cursor + window, stop)
+            await self.finnhub_limiter.acquire()
+            res = await asyncio.to_thread(client.stock_candles, symbol, resolution, cursor, window_end)
+            if res.get("s") == "ok":
+                yield [
+                    (
+                        _to_utc(res["t"][i]),
+                        symbol,
+                        resolution,
+                        float(res["o"][i]),
+                        float(res["h"][i]),
+                        float(res["l"][i]),
+                        float(res["c"][i]),
+                        float(res["v"][i]),
+                    )
+                    for i in range(len(res["t"]))
+                ]
+            elif res.get("s") != "no_data":
+                raise Exception(f"Finnhub candles error for {symbol}: {res}")
+            cursor = window_end + 1
+
+    async def _fetch_ccxt(
+        self, symbol: str, timeframe: str, start: datetime, end: datetime, exchange_id: str
+    ) -> AsyncIterator[List[CandleRow]]:
+        """Page through exchange OHLCV with ccxt using the `since` cursor."""
+        from app.services.datafeed import DataFeedService
+
+        feed = DataFeedService(exchange_id)
+        since = int(start.timestamp() * 1000)
+        stop = int(end.timestamp() * 1000)
+
+        while since <= stop:
+            candles = await feed.fetch_ohlcv(symbol, timeframe, limit=1000, since=since)
+            candles = [c for c in candles if c["timestamp"] <= stop]
+            if not candles:
+                break
+            yield [
+                (
+                    _to_utc(c["timestamp"] / 1000),
+                    symbol,
+                    timeframe,
+                    float(c["open"]),
+                    float(c["high"]),
+                    float(c["low"]),
+                    float(c["close"]),
+                    float(c["volume"] or 0.0),
+                )
+                for c in candles
+            ]
+            since = candles[-1]["timestamp"] + 1
+
+    def _fetch(
+        self, source: str, symbol: str, timeframe: str, start: datetime, end: datetime, exchange_id: str
+    ) -> AsyncIterator[List[CandleRow]]:
+        """Select the candle fetcher for a source."""
+        if source == "finnhub":
+            return self._fetch_finnhub(symbol, timeframe, start, end)
+        if source == "ccxt":
+            return self._fetch_ccxt(symbol, timeframe, start, end, exchange_id)
+        raise ValueError(f"Unknown OHLCV source: {source}")
+
+    async def ingest_symbol(
+        self,
+        symbol: str,
+        timeframe: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        source: str = "finnhub",
+        exchange_id: str = "binance",
+        resume: bool = True,
+    ) -> Dict:
+        """
+        Ingest one symbol's history.
+
+        Fetching and writing overlap: the fetcher fills a bounded queue while
+        the writer drains it in `batch_size` chunks.
+
+        Returns:
+            Summary with rows written, last candle time and elapsed seconds
+        """
+        end = end or datetime.now(timezone.utc)
+        if resume:
+            checkpoint = await self.get_checkpoint(source, symbol, timeframe)
+            if checkpoint is not None and checkpoint >= start:
+                start = checkpoint
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.fetch_queue_size)
+        started = time.perf_counter()
+
+        async def produce():
+            try:
+                async for candles in self._fetch(source, symbol, timeframe, start, end, exchange_id):
+                    await queue.put(candles)
+            except asyncio.CancelledError:
+                # The writer stopped: nobody drains the queue, so no sentinel
+                raise
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        written = 0
+        buffer: List[CandleRow] = []
+        try:
+            while True:
+                candles = await queue.get()
+                if candles is None:
+                    break
+                buffer.extend(candles)
+                while len(buffer) >= self.batch_size:
+                    batch, buffer = buffer[:self.batch_size], buffer[self.batch_size:]
+                    written += await self.write_batch(source, symbol, timeframe, batch)
+            written += await self.write_batch(source, symbol, timeframe, buffer)
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+
+        elapsed = time.perf_counter() - started
+        last_time = await self.get_checkpoint(source, symbol, timeframe)
+        logger.info("Ingested %s rows for %s %s in %.2fs", written, symbol, timeframe, elapsed)
+        return {
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "rows": written,
+            "last_time": last_time.isoformat() if last_time else None,
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    async def ingest(
+        self,
+        symbols: List[str],
+        timeframe: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        source: str = "finnhub",
+        exchange_id: str = "binance",
+        resume: bool = True,
+    ) -> Dict:
+        """
+        Ingest many symbols with `workers` symbols in flight at once.
+
+        A failing symbol is reported in the summary without stopping the
+        others; re-running the same call resumes it from its checkpoint.
+        """
+        await self.connect()
+        semaphore = asyncio.Semaphore(self.workers)
+        started = time.perf_counter()
+
+        async def run(symbol: str) -> Dict:
+            async with semaphore:
+                try:
+                    return await self.ingest_symbol(symbol, timeframe, start, end, source, exchange_id, resume)
+                except Exception as e:
+                    logger.warning("OHLCV ingestion failed for %s: %s", symbol, e)
+                    return {"symbol": symbol, "timeframe": timeframe, "rows": 0, "error": str(e)}
+
+        results = await asyncio.gather(*(run(s) for s in symbols))
+        elapsed = time.perf_counter() - started
+        total_rows = sum(r["rows"] for r in results)
+        return {
+            "symbols": results,
+            "total_rows": total_rows,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_minute": int(total_rows / elapsed * 60) if elapsed > 0 else 0,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk load OHLCV history into trading.ohlcv")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--timeframe", default="D")
+    parser.add_argument("--start", required=True, help="ISO date, e.g. 2015-01-01")
+    parser.add_argument("--source", default="finnhub", choices=["finnhub", "ccxt"])
+    parser.add_argument("--exchange", default="binance")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    async def main():
+        service = OHLCVIngestionService(workers=args.workers, batch_size=args.batch_size)
+        start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+        try:
+            summary = await service.ingest(
+                args.symbols, args.timeframe, start, source=args.source, exchange_id=args.exchange
+            )
+            logger.info("Ingestion summary: %s", summary)
+        finally:
+            try:
+                await service.disconnect()
+            finally:
+                # ccxt sources hold shared aiohttp sessions until closed
+                from app.services.datafeed import close_exchanges
+                await close_exchanges()
+
+    asyncio.run(main())
@@ -1,9 +1,21 @@
 """
 Order Execution Service - Order management and execution
 """
-from typing import Dict, Optional
+import inspect
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from enum import Enum
 
+from app.core.config import settings
+from app.services.order_journal import OrderJournal, order_journal
+
+logger = logging.getLogger(__name__)
+
+# check(user_id, symbol, side, order_type, amount, price); raises to reject the order,
+# may return an awaitable that is awaited before the order is accepted
+PreTradeCheck = Callable[..., Optional[Awaitable[None]]]
+
 class OrderSide(str, Enum):
     BUY = "buy"
     SELL = "sell"
@@ -21,12 +33,144 @@ class OrderStatus(str, Enum):
     CANCELLED = "cancelled"
     REJECTED = "rejected"
 
+TERMINAL_STATUSES = frozenset({
+    OrderStatus.FILLED.value,
+    OrderStatus.CANCELLED.value,
+    OrderStatus.REJECTED.value,
+})
+
+
 class OrderExecutionService:
-    """Service for executing and managing trading orders."""
+    """
+    Service for executing and managing trading orders.
+
+    Orders are indexed by status and by (symbol, status); every status
+    change goes through `_transition`, which keeps both indexes in sync, so
+    open-order queries cost O(result size) rather than O(lifetime orders).
+    Terminal orders (filled, cancelled, rejected) are retained up to
+    `terminal_retention`; older ones are evicted and handed to `on_archive`.
+
+    With a `journal`, every state change is also appended to the
+    write-behind order journal, and `start` restores the journaled orders.
+
+    Pre-trade checks registered with `add_pre_trade_check` run before an
+    order is accepted and reject it by raising; listeners registered with
+    `add_listener` see every new order, fill update and status change.
+    """
     
-    def __init__(self):
+    def __init__(
+        self,
+        terminal_retention: Optional[int] = None,
+        on_archive: Optional[Callable[[Dict], None]] = None,
+        journal: Optional[OrderJournal] = None,
+    ):
         """Initialize order execution service."""
-        self.orders = {}  # In-memory order storage (replace with DB)
+        self.orders: Dict[str, Dict] = {}  # In-memory order storage (replace with DB)
+        # Insertion-ordered id -> order maps per index bucket
+        self._by_status: Dict[str, Dict[str, Dict]] = {}
+        self._by_symbol_status: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+        self._terminal: "OrderedDict[str, None]" = OrderedDict()
+        self.terminal_retention = (
+            settings.ORDER_TERMINAL_RETENTION if terminal_retention is None else terminal_retention
+        )
+        self.on_archive = on_archive
+        self.archived_count = 0
+        self.journal = journal
+        self._pre_trade_checks: List[PreTradeCheck] = []
+        self._listeners: List[Callable[[Dict], None]] = []
+    
+    def add_pre_trade_check(self, check: PreTradeCheck) -> None:
+        """
+        Register a check(user_id, symbol, side, order_type, amount, price) that raises to reject.
+
+        A check may return an awaitable (e.g. to look up missing data); it is
+        awaited before the order is accepted.
+        """
+        self._pre_trade_checks.append(check)
+    
+    def add_listener(self, callback: Callable[[Dict], None]) -> None:
+        """Register a callback(order) invoked on every order event."""
+        self._listeners.append(callback)
+    
+    def _notify(self, order: Dict) -> None:
+        for callback in self._listeners:
+            try:
+                callback(order)
+            except Exception as e:
+                logger.warning("Order listener failed for %s: %s", order["id"], e)
+    
+    async def start(self) -> None:
+        """Restore journaled orders and start the journal flusher."""
+        if self.journal is None:
+            return
+        self._restore(self.journal.open())
+        self.journal.snapshot_source = lambda: list(self.orders.values())
+        self.journal.start()
+    
+    async def stop(self) -> None:
+        """Flush and close the journal."""
+        if self.journal is not None:
+            await self.journal.stop()
+    
+    def _restore(self, orders: List[Dict]) -> None:
+        """Load recovered orders into memory and the indexes."""
+        for order in orders:
+            self.orders[order["id"]] = order
+            self._index(order)
+            if order["status"] in TERMINAL_STATUSES:
+                self._terminal[order["id"]] = None
+        self._evict_terminal()
+    
+    def _record(self, order: Dict) -> None:
+        """Append the order's current state to the journal."""
+        if self.journal is not None:
+            self.journal.append(order)
+    
+    def _index(self, order: Dict) -> None:
+        """Add an order to the status indexes."""
+        self._by_status.setdefault(order["status"], {})[order["id"]] = order
+        self._by_symbol_status.setdefault((order["symbol"], order["status"]), {})[order["id"]] = order
+    
+    def _unindex(self, order: Dict) -> None:
+        """Remove an order from the status indexes, dropping empty buckets."""
+        status_key, pair_key = order["status"], (order["symbol"], order["status"])
+        for index, key in ((self._by_status, status_key), (self._by_symbol_status, pair_key)):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(order["id"], None)
+                if not bucket:
+                    del index[key]
+    
+    def _transition(self, order: Dict, status: OrderStatus) -> Dict:
+        """Change an order's status, keeping indexes and retention in sync."""
+        if order["status"] == status.value:
+            return order
+        if order["status"] in TERMINAL_STATUSES:
+            raise ValueError(f"Order {order['id']} is already {order['status']}")
+        self._unindex(order)
+        order["status"] = status.value
+        self._index(order)
+        self._record(order)
+        self._notify(order)
+        if status.value in TERMINAL_STATUSES:
+            self._terminal[order["id"]] = None
+            self._evict_terminal()
+        return order
+    
+    def _evict_terminal(self) -> None:
+        """Archive the oldest terminal orders beyond the retention limit."""
+        while len(self._terminal) > self.terminal_retention:
+            order_id, _ = self._terminal.popitem(last=False)
+            order = self.orders.pop(order_id, None)
+            if order is None:
+                continue
+            self._unindex(order)
+            self.archived_count += 1
+            if self.on_archive is not None:
+                try:
+                    self.on_archive(order)
+                except Exception as e:
+                    logger.warning("Order archive hook failed for %s: %s", order_id, e)
     
     async def create_order(
         self,
@@ -35,10 +179,16 @@ class OrderExecutionService:
         order_type: OrderType,
         amount: float,
         price: Optional[float] = None,
+        user_id: Optional[int] = None,
     ) -> Dict:
-        """Create a new trading order."""
+        """Create a new trading order (pre-trade checks raise ValueError to reject it)."""
+        for check in self._pre_trade_checks:
+            result = check(user_id, symbol, side, order_type, amount, price)
+            if inspect.isawaitable(result):
+                await result
         order = {
             "id": self._generate_order_id(),
+            "user_id": user_id,
             "symbol": symbol,
             "side": side.value,
             "type": order_type.value,
@@ -48,41 +198,80 @@ class OrderExecutionService:
             "filled": 0.0,
         }
         
-        # TODO: Implement actual order execution via exchange
-        # For now, just store the order
+        # Orders are sent to an exchange by OrderRouter (app.services.order_router)
         self.orders[order["id"]] = order
+        self._index(order)
+        self._record(order)
+        self._notify(order)
         
         return order
     
+    async def update_order_status(
+        self,
+        order_id: str,
+        status: OrderStatus,
+        filled: Optional[float] = None,
+        average_price: Optional[float] = None,
+        exchange_order_id: Optional[str] = None,
+    ) -> Dict:
+        """Move an order to a new status (e.g. open, filled), optionally updating the fill."""
+        order = self.orders.get(order_id)
+        if order is None:
+            raise ValueError(f"Order {order_id} not found")
+        if order["status"] != status.value and order["status"] in TERMINAL_STATUSES:
+            # Same check as _transition, before anything is mutated
+            raise ValueError(f"Order {order_id} is already {order['status']}")
+        if exchange_order_id is not None:
+            order["exchange_order_id"] = exchange_order_id
+        if average_price is not None:
+            order["average_price"] = average_price
+        if filled is not None:
+            order["filled"] = filled
+        if order["status"] == status.value and (filled is not None or exchange_order_id is not None):
+            # Fill progress or exchange ack without a status change
+            self._record(order)
+            self._notify(order)
+        return self._transition(order, status)
+    
     async def cancel_order(self, order_id: str) -> Dict:
         """Cancel an existing order."""
         if order_id not in self.orders:
             raise ValueError(f"Order {order_id} not found")
         
         order = self.orders[order_id]
-        order["status"] = OrderStatus.CANCELLED.value
-        
-        # TODO: Implement actual order cancellation via exchange
+        self._transition(order, OrderStatus.CANCELLED)
         
         return order
     
     async def get_order(self, order_id: str) -> Optional[Dict]:
-        """Get order details by ID."""
+        """Get order details by ID (archived terminal orders are no longer held)."""
         return self.orders.get(order_id)
     
+    async def get_orders(self, status: OrderStatus, symbol: Optional[str] = None) -> List[Dict]:
+        """Get orders in a status, optionally filtered by symbol, in creation order."""
+        if symbol:
+            bucket = self._by_symbol_status.get((symbol, status.value))
+        else:
+            bucket = self._by_status.get(status.value)
+        return list(bucket.values()) if bucket else []
+    
     async def get_open_orders(self, symbol: Optional[str] = None) -> list:
         """Get all open orders, optionally filtered by symbol."""
-        open_orders = [
-            order for order in self.orders.values()
-            if order["status"] == OrderStatus.OPEN.value
-        ]
-        
-        if symbol:
-            open_orders = [o for o in open_orders if o["symbol"] == symbol]
-        
-        return open_orders
+        return await self.get_orders(OrderStatus.OPEN, symbol)
+    
+    def get_stats(self) -> Dict:
+        """Order counts per status plus retention figures."""
+        return {
+            "orders": len(self.orders),
+            "by_status": {status: len(bucket) for status, bucket in self._by_status.items()},
+            "terminal_retained": len(self._terminal),
+            "archived": self.archived_count,
+        }
     
     def _generate_order_id(self) -> str:
         """Generate a unique order ID."""
         import uuid
         return str(uuid.uuid4())
+
+
+order_execution_service = OrderExecutionService(journal=order_journal)
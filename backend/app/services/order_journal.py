@@ -0,0 +1,303 @@
+"""
+Order Journal - Append-only write-behind persistence for orders
+"""
+import asyncio
+import logging
+import os
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional
+
+import asyncpg
+
+from app.core.config import settings
+from app.core.serialization import json_codec
+
+logger = logging.getLogger(__name__)
+
+# One row per order per batch: multi-row upsert from parallel arrays
+UPSERT_ORDERS_SQL = """
+INSERT INTO trading.orders (
+    client_order_id, symbol, side, order_type, amount, price,
+    status, filled_amount, average_price, exchange_order_id, user_id
+)
+SELECT * FROM unnest(
+    $1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[], $5::numeric[],
+    $6::numeric[], $7::varchar[], $8::numeric[], $9::numeric[], $10::varchar[], $11::integer[]
+)
+ON CONFLICT (client_order_id) DO UPDATE SET
+    price = EXCLUDED.price,
+    status = EXCLUDED.status,
+    filled_amount = EXCLUDED.filled_amount,
+    average_price = EXCLUDED.average_price,
+    exchange_order_id = EXCLUDED.exchange_order_id
+"""
+
+MAX_RETRY_DELAY = 30.0
+
+# Rows the database will never accept (e.g. unknown user_id); anything else is retried
+DATA_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+
+def _decimal(value) -> Optional[Decimal]:
+    """asyncpg numeric parameters must be Decimal."""
+    return None if value is None else Decimal(str(value))
+
+
+class OrderJournal:
+    """
+    Write-behind journal for `trading.orders`.
+
+    `append` is synchronous and cheap: the order state is written to an
+    append-only local file (buffered) and kept as the pending row for its id,
+    so several events for one order coalesce into a single upsert. A flusher
+    task fsyncs the file and then upserts all pending rows in batched
+    multi-row statements every `flush_interval`, appending a `persisted`
+    marker once the database has them. On startup the file is replayed:
+    the latest state of every order is restored, and the entries after the
+    last marker are queued for upsert again (upserts are idempotent).
+
+    The file is compacted into a snapshot of the live orders once it grows
+    past `max_bytes` and nothing is pending.
+
+    Nothing is buffered until the journal is opened. Connection errors keep
+    every row for the next flush; if a batch is rejected for a data reason,
+    its rows are retried one by one and the ones the database refuses are
+    logged and dropped so they cannot stall the rows behind them.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        database_url: Optional[str] = None,
+        flush_interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        fsync: Optional[bool] = None,
+    ):
+        """Initialize order journal."""
+        self.path = path or settings.ORDER_JOURNAL_PATH
+        self.database_url = database_url or settings.DATABASE_URL
+        self.flush_interval = flush_interval or settings.ORDER_JOURNAL_FLUSH_INTERVAL
+        self.batch_size = batch_size or settings.ORDER_JOURNAL_BATCH_SIZE
+        self.max_bytes = max_bytes or settings.ORDER_JOURNAL_MAX_BYTES
+        self.fsync = settings.ORDER_JOURNAL_FSYNC if fsync is None else fsync
+        self.pool: Optional[asyncpg.Pool] = None
+        self.snapshot_source: Optional[Callable[[], Iterable[Dict]]] = None
+        self._codec = json_codec()
+        self._file = None
+        self._seq = 0
+        self._pending: Dict[str, Dict] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._failures = 0
+        self.persisted_seq = 0
+        self.flushed_rows = 0
+        self.dropped_rows = 0
+
+    # --- File ---
+
+    def _write(self, record: Dict) -> None:
+        self._file.write(self._codec.encode(record) + b"\n")
+
+    def open(self) -> List[Dict]:
+        """
+        Open the journal file, replaying it.
+
+        Returns:
+            Latest state of every journaled order, in journal order
+        """
+        orders: Dict[str, Dict] = {}
+        seqs: Dict[str, int] = {}
+        persisted = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        record = self._codec.decode(line)
+                    except ValueError:
+                        # Torn last write from a crash
+                        logger.warning("Skipping unreadable order journal line")
+                        continue
+                    if "persisted" in record:
+                        persisted = max(persisted, record["persisted"])
+                        continue
+                    order = record["order"]
+                    orders[order["id"]] = order
+                    seqs[order["id"]] = record["seq"]
+                    self._seq = max(self._seq, record["seq"])
+        else:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self.persisted_seq = persisted
+        self._pending = {oid: order for oid, order in orders.items() if seqs[oid] > persisted}
+        self._file = open(self.path, "ab")
+        if orders:
+            logger.info(
+                "Recovered %s orders from journal (%s not yet persisted)", len(orders), len(self._pending)
+            )
+        return list(orders.values())
+
+    def append(self, order: Dict) -> None:
+        """Journal the current state of an order (acknowledged in memory)."""
+        if self._file is None:
+            return  # not opened (journal disabled or stopped)
+        order = dict(order)
+        self._seq += 1
+        self._pending[order["id"]] = order
+        self._write({"seq": self._seq, "order": order})
+
+    async def _sync_file(self) -> None:
+        """Push buffered journal lines to disk."""
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync:
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+
+    def _compact(self) -> None:
+        """Rewrite the journal as a snapshot of the live orders."""
+        if self.snapshot_source is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for order in self.snapshot_source():
+                f.write(self._codec.encode({"seq": self._seq, "order": order}) + b"\n")
+            f.write(self._codec.encode({"persisted": self._seq}) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        logger.info("Compacted order journal %s", self.path)
+
+    # --- Database ---
+
+    async def connect(self) -> None:
+        """Open the asyncpg pool."""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=2)
+
+    async def _upsert(self, rows: List[Dict]) -> None:
+        """Upsert orders in batches of `batch_size`, in one transaction."""
+        await self.connect()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start:start + self.batch_size]
+                    await conn.execute(
+                        UPSERT_ORDERS_SQL,
+                        [o["id"] for o in batch],
+                        [o["symbol"] for o in batch],
+                        [o["side"] for o in batch],
+                        [o["type"] for o in batch],
+                        [_decimal(o["amount"]) for o in batch],
+                        [_decimal(o.get("price")) for o in batch],
+                        [o["status"] for o in batch],
+                        [_decimal(o.get("filled", 0.0)) for o in batch],
+                        [_decimal(o.get("average_price")) for o in batch],
+                        [o.get("exchange_order_id") for o in batch],
+                        [o.get("user_id") for o in batch],
+                    )
+
+    async def flush(self) -> int:
+        """
+        Sync the journal file and upsert pending orders.
+
+        Returns:
+            Number of orders written to the database
+        """
+        await self._sync_file()
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        seq = self._seq
+        rows = list(pending.values())
+        try:
+            await self._upsert(rows)
+            written = len(rows)
+        except DATA_ERRORS as e:
+            logger.warning("Order batch rejected (%s), writing %s rows one by one", e, len(rows))
+            written = await self._upsert_each(rows)
+        except Exception:
+            self._requeue(rows)
+            raise
+        self.persisted_seq = seq
+        self.flushed_rows += written
+        if self._file is not None:
+            self._write({"persisted": seq})
+            if not self._pending and os.path.getsize(self.path) > self.max_bytes:
+                self._compact()
+        return written
+
+    def _requeue(self, rows: List[Dict]) -> None:
+        """Keep rows for the next attempt; newer events for the same order win."""
+        for order in rows:
+            self._pending.setdefault(order["id"], order)
+
+    async def _upsert_each(self, rows: List[Dict]) -> int:
+        """Upsert rows one at a time, dropping the ones refused for data reasons."""
+        written = 0
+        for index, order in enumerate(rows):
+            try:
+                await self._upsert([order])
+                written += 1
+            except DATA_ERRORS as e:
+                self.dropped_rows += 1
+                logger.error("Dropping order %s from the database write: %s", order["id"], e)
+            except Exception:
+                self._requeue(rows[index:])
+                raise
+        return written
+
+    async def _flush_loop(self) -> None:
+        """Flush on a short interval, backing off while the database is down."""
+        while True:
+            delay = min(MAX_RETRY_DELAY, self.flush_interval * 2 ** min(self._failures, 16))
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                if self._failures == 1:
+                    logger.warning("Order journal flush failed, retrying: %s", e)
+
+    def start(self) -> None:
+        """Start the background flusher."""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the flusher, make a final flush attempt and close everything."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Final order journal flush failed (kept in journal): %s", e)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_stats(self) -> Dict:
+        """Pending rows, last persisted sequence and totals."""
+        return {
+            "pending": len(self._pending),
+            "seq": self._seq,
+            "persisted_seq": self.persisted_seq,
+            "flushed_rows": self.flushed_rows,
+            "dropped_rows": self.dropped_rows,
+            "failures": self._failures,
+        }
+
+
+order_journal = OrderJournal()
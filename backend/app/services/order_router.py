@@ -0,0 +1,685 @@
+"""
+Order Router - Per-exchange submission queues with batching and latency tracking
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import ccxt.async_support as ccxt
+
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+from app.services.cache_metrics import LATENCY_BUCKETS_MS, Histogram
+from app.services.order_execution import (
+    OrderExecutionService,
+    OrderSide,
+    OrderStatus,
+    OrderType,
+    TERMINAL_STATUSES,
+    order_execution_service,
+)
+
+logger = logging.getLogger(__name__)
+
+# Order lifecycle stages, in order
+STAGES = ("accepted", "sent", "acked", "filled")
+# Latency histograms: (name, from stage, to stage)
+SPANS = (
+    ("queue_ms", "accepted", "sent"),
+    ("exchange_ms", "sent", "acked"),
+    ("order_to_ack_ms", "accepted", "acked"),
+    ("ack_to_fill_ms", "acked", "filled"),
+)
+
+# ccxt order types for our order types (stop/take-profit go out as triggered market orders)
+CCXT_ORDER_TYPES = {
+    OrderType.MARKET.value: "market",
+    OrderType.LIMIT.value: "limit",
+    OrderType.STOP_LOSS.value: "market",
+    OrderType.TAKE_PROFIT.value: "market",
+}
+# ccxt unified trigger-price params for stop-loss and take-profit orders
+CCXT_TRIGGER_PARAMS = {
+    OrderType.STOP_LOSS.value: "stopLossPrice",
+    OrderType.TAKE_PROFIT.value: "takeProfitPrice",
+}
+# ccxt order statuses for our ack statuses (anything else is still open)
+CCXT_STATUSES = {
+    "closed": "filled",
+    "canceled": "cancelled",
+    "expired": "cancelled",
+    "rejected": "rejected",
+}
+
+
+class ExchangeGateway:
+    """
+    Exchange adapter used by the router.
+
+    `create_order` returns an ack dict with `exchange_order_id` and, when
+    the exchange reports it, `status` ("open", "filled", "cancelled" or
+    "rejected"), `filled` and `average_price`. Gateways with
+    `supports_batch` also implement the `*_orders` batch calls, taking up
+    to `max_batch` requests each. Gateways with `supports_fetch` implement
+    `fetch_order`, returning the same dict for an order's current state;
+    the router polls orders acked open through it. Failures are raised as
+    exceptions (or, per order in a batch, returned as `{"error": ...}`).
+    """
+
+    name = "gateway"
+    supports_batch = False
+    supports_fetch = False
+    max_batch = 1
+    rate_limit: Optional[float] = None  # requests per second, None = unlimited
+
+    async def create_order(self, order: Dict) -> Dict:
+        raise NotImplementedError
+
+    async def cancel_order(self, order: Dict) -> None:
+        raise NotImplementedError
+
+    async def create_orders(self, orders: List[Dict]) -> List[Dict]:
+        raise NotImplementedError
+
+    async def cancel_orders(self, orders: List[Dict]) -> None:
+        raise NotImplementedError
+
+    async def fetch_order(self, order: Dict) -> Dict:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class CcxtGateway(ExchangeGateway):
+    """Authenticated ccxt session; batches when the exchange has createOrders/cancelOrders."""
+
+    def __init__(self, exchange_id: str):
+        self.name = exchange_id
+        exchange_class = getattr(ccxt, exchange_id)
+        self.exchange = exchange_class({
+            'apiKey': getattr(settings, f"{exchange_id.upper()}_API_KEY", ""),
+            'secret': getattr(settings, f"{exchange_id.upper()}_API_SECRET", ""),
+            # ccxt spaces requests to the exchange's own limit
+            'enableRateLimit': True,
+        })
+        self.supports_batch = bool(self.exchange.has.get("createOrders"))
+        self.supports_fetch = bool(self.exchange.has.get("fetchOrder"))
+        self.max_batch = settings.ORDER_ROUTER_MAX_BATCH if self.supports_batch else 1
+
+    @staticmethod
+    def _request(order: Dict) -> Dict:
+        params = {}
+        trigger = CCXT_TRIGGER_PARAMS.get(order["type"])
+        if trigger is not None:
+            params[trigger] = order["price"]
+        return {
+            "symbol": order["symbol"],
+            "type": CCXT_ORDER_TYPES[order["type"]],
+            "side": order["side"],
+            "amount": order["amount"],
+            "price": order["price"] if order["type"] == OrderType.LIMIT.value else None,
+            "params": params,
+        }
+
+    @staticmethod
+    def _ack(result: Dict) -> Dict:
+        return {
+            "exchange_order_id": str(result.get("id")),
+            "status": CCXT_STATUSES.get(result.get("status"), "open"),
+            "filled": result.get("filled"),
+            "average_price": result.get("average"),
+        }
+
+    async def create_order(self, order: Dict) -> Dict:
+        request = self._request(order)
+        result = await self.exchange.create_order(
+            request["symbol"], request["type"], request["side"], request["amount"],
+            request["price"], request["params"],
+        )
+        return self._ack(result)
+
+    async def create_orders(self, orders: List[Dict]) -> List[Dict]:
+        results = await self.exchange.create_orders([self._request(o) for o in orders])
+        return [self._ack(r) for r in results]
+
+    async def cancel_order(self, order: Dict) -> None:
+        await self.exchange.cancel_order(order["exchange_order_id"], order["symbol"])
+
+    async def fetch_order(self, order: Dict) -> Dict:
+        return self._ack(await self.exchange.fetch_order(order["exchange_order_id"], order["symbol"]))
+
+    async def cancel_orders(self, orders: List[Dict]) -> None:
+        if self.exchange.has.get("cancelOrders") and len({o["symbol"] for o in orders}) == 1:
+            await self.exchange.cancel_orders([o["exchange_order_id"] for o in orders], orders[0]["symbol"])
+        else:
+            await asyncio.gather(*(self.cancel_order(o) for o in orders))
+
+    async def close(self) -> None:
+        await self.exchange.close()
+
+
+class PaperGateway(ExchangeGateway):
+    """Routes orders to the in-process paper-trading engine; fills arrive via its listener."""
+
+    name = "paper"
+
+    def __init__(self, engine=None):
+        self._engine = engine
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from app.engine.paper_trading import paper_trading_engine
+            self._engine = paper_trading_engine
+        return self._engine
+
+    async def create_order(self, order: Dict) -> Dict:
+        await self.engine.submit(order)
+        return {"exchange_order_id": order["id"]}
+
+    async def cancel_order(self, order: Dict) -> None:
+        await self.engine.cancel_order(order["id"])
+
+
+class SimulatedGateway(ExchangeGateway):
+    """
+    Stand-in exchange with configurable latency, batching and rejects.
+
+    Used for local development and for measuring the pipeline under load
+    without touching a real venue.
+    """
+
+    def __init__(
+        self,
+        name: str = "sim",
+        latency_ms: float = 5.0,
+        jitter_ms: float = 1.0,
+        supports_batch: bool = True,
+        max_batch: int = 20,
+        rate_limit: Optional[float] = None,
+        reject_rate: float = 0.0,
+        fill_market_orders: bool = True,
+    ):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.supports_batch = supports_batch
+        self.max_batch = max_batch if supports_batch else 1
+        self.rate_limit = rate_limit
+        self.reject_rate = reject_rate
+        self.fill_market_orders = fill_market_orders
+        self._next_id = 0
+
+    async def _round_trip(self) -> None:
+        await asyncio.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+    def _ack(self, order: Dict) -> Dict:
+        if self.reject_rate and random.random() < self.reject_rate:
+            raise ValueError(f"Simulated reject for {order['id']}")
+        self._next_id += 1
+        filled = self.fill_market_orders and order["type"] == OrderType.MARKET.value
+        return {
+            "exchange_order_id": f"{self.name}-{self._next_id}",
+            "status": "filled" if filled else "open",
+            "filled": order["amount"] if filled else 0.0,
+            "average_price": order.get("price") if filled else None,
+        }
+
+    async def create_order(self, order: Dict) -> Dict:
+        await self._round_trip()
+        return self._ack(order)
+
+    async def create_orders(self, orders: List[Dict]) -> List[Dict]:
+        await self._round_trip()
+        acks = []
+        for order in orders:
+            try:
+                acks.append(self._ack(order))
+            except ValueError as e:
+                acks.append({"error": str(e)})
+        return acks
+
+    async def cancel_order(self, order: Dict) -> None:
+        await self._round_trip()
+
+    async def cancel_orders(self, orders: List[Dict]) -> None:
+        await self._round_trip()
+
+
+class _Lane:
+    """Queue, worker, rate limiter and metrics for one exchange."""
+
+    def __init__(self, gateway: ExchangeGateway, queue_size: int):
+        self.gateway = gateway
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.limiter = RateLimiter(gateway.rate_limit) if gateway.rate_limit else None
+        self.worker: Optional[asyncio.Task] = None
+        self.histograms = {name: Histogram(LATENCY_BUCKETS_MS) for name, _, _ in SPANS}
+        self.counters = {"accepted": 0, "sent": 0, "acked": 0, "rejected": 0,
+                         "filled": 0, "cancelled": 0, "batches": 0, "polls": 0, "poll_failures": 0}
+
+
+class OrderRouter:
+    """
+    Routes orders from OrderExecutionService to exchanges.
+
+    Each exchange gets its own bounded queue and worker, so a slow venue
+    never delays another. A worker drains whatever is queued (up to
+    ORDER_ROUTER_MAX_INFLIGHT requests) and sends it concurrently: as batch
+    calls of up to `max_batch` when the gateway supports them, otherwise
+    one call per request, each call waiting on the exchange's rate limiter.
+    Every order is timestamped at accepted, sent, acked and filled; the
+    spans between them feed per-exchange latency histograms. Orders acked
+    open on a gateway that `supports_fetch` are polled every
+    ORDER_ROUTER_POLL_INTERVAL (through the lane's rate limiter) until the
+    exchange reports them filled, cancelled or rejected. A cancel for an
+    order that has not been acked yet is held until the ack: it is sent
+    once the order is open on the exchange, and dropped if the ack already
+    finished the order.
+    """
+
+    def __init__(self, orders: Optional[OrderExecutionService] = None, queue_size: Optional[int] = None):
+        """Initialize order router."""
+        self.orders = orders or order_execution_service
+        self.queue_size = queue_size or settings.ORDER_ROUTER_QUEUE_SIZE
+        self._gateways: Dict[str, ExchangeGateway] = {}
+        self._lanes: Dict[str, _Lane] = {}
+        self._timeline: Dict[str, Dict[str, float]] = {}
+        self._order_lane: Dict[str, str] = {}
+        self._acks: Dict[str, asyncio.Future] = {}
+        self._open: Dict[str, str] = {}  # order id -> exchange, polled until terminal
+        self._cancel_on_ack: Set[str] = set()  # cancelled before the exchange acked them
+        self._poller: Optional[asyncio.Task] = None
+
+    def register_gateway(self, gateway: ExchangeGateway) -> None:
+        """Use a specific gateway (paper, simulated, custom) for an exchange name."""
+        self._gateways[gateway.name] = gateway
+
+    def _gateway(self, exchange: str) -> ExchangeGateway:
+        gateway = self._gateways.get(exchange)
+        if gateway is None:
+            gateway = PaperGateway() if exchange == "paper" else CcxtGateway(exchange)
+            self._gateways[exchange] = gateway
+        return gateway
+
+    def _lane(self, exchange: str) -> _Lane:
+        lane = self._lanes.get(exchange)
+        if lane is None:
+            lane = self._lanes[exchange] = _Lane(self._gateway(exchange), self.queue_size)
+        if lane.worker is None or lane.worker.done():
+            lane.worker = asyncio.create_task(self._work(exchange, lane))
+        return lane
+
+    def _stamp(self, order_id: str, stage: str) -> None:
+        """Record a lifecycle stage and observe the spans that end there."""
+        timeline = self._timeline.get(order_id)
+        if timeline is None or stage in timeline:
+            return
+        timeline[stage] = time.perf_counter()
+        lane = self._lanes.get(self._order_lane.get(order_id, ""))
+        if lane is None:
+            return
+        lane.counters[stage] += 1
+        for name, start, end in SPANS:
+            if end == stage and start in timeline:
+                lane.histograms[name].observe((timeline[stage] - timeline[start]) * 1000)
+
+    def _finish(self, order_id: str) -> None:
+        """Drop tracking state once an order is terminal."""
+        self._timeline.pop(order_id, None)
+        self._order_lane.pop(order_id, None)
+        self._open.pop(order_id, None)
+        self._cancel_on_ack.discard(order_id)
+        future = self._acks.pop(order_id, None)
+        if future is not None and not future.done():
+            future.set_result(self.orders.orders.get(order_id))
+
+    async def place_order(
+        self,
+        exchange: str,
+        symbol: str,
+        side: OrderSide,
+        order_type: OrderType,
+        amount: float,
+        price: Optional[float] = None,
+        user_id: Optional[int] = None,
+    ) -> Dict:
+        """Create an order and queue it for `exchange`."""
+        order = await self.orders.create_order(symbol, side, order_type, amount, price, user_id=user_id)
+        await self.submit(order, exchange)
+        return order
+
+    async def submit(self, order: Dict, exchange: str) -> asyncio.Future:
+        """
+        Queue a pending order for submission.
+
+        Returns:
+            Future resolved with the order once the exchange acks (or rejects) it
+        """
+        lane = self._lane(exchange)
+        self._timeline[order["id"]] = {}
+        self._order_lane[order["id"]] = exchange
+        self._stamp(order["id"], "accepted")
+        future = asyncio.get_running_loop().create_future()
+        self._acks[order["id"]] = future
+        await lane.queue.put(("create", order))
+        return future
+
+    async def cancel(self, order_id: str) -> None:
+        """Queue a cancel for a routed order (held until the exchange acks it)."""
+        order = self.orders.orders.get(order_id)
+        exchange = self._order_lane.get(order_id)
+        if order is None or exchange is None:
+            raise ValueError(f"Order {order_id} is not routed")
+        if order_id in self._acks:
+            # No exchange order id yet; _on_ack sends (or drops) the cancel
+            self._cancel_on_ack.add(order_id)
+            return
+        await self._lane(exchange).queue.put(("cancel", order))
+
+    def on_fill(self, order: Dict, fill: Optional[Dict] = None) -> None:
+        """Fill notification (e.g. from the paper engine's fill listener)."""
+        if order["id"] in self._timeline:
+            # A fill implies the exchange accepted the order
+            self._stamp(order["id"], "acked")
+            self._stamp(order["id"], "filled")
+            self._finish(order["id"])
+
+    async def _drain(self, lane: _Lane) -> List[Tuple[str, Dict]]:
+        """Wait for one request, then take whatever else is queued up to ORDER_ROUTER_MAX_INFLIGHT."""
+        batch = [await lane.queue.get()]
+        while len(batch) < settings.ORDER_ROUTER_MAX_INFLIGHT and not lane.queue.empty():
+            batch.append(lane.queue.get_nowait())
+        return batch
+
+    async def _work(self, exchange: str, lane: _Lane) -> None:
+        while True:
+            batch = await self._drain(lane)
+            # Creates go out before cancels, so a cancel never overtakes its order
+            creates = [order for kind, order in batch if kind == "create"]
+            cancels = [order for kind, order in batch if kind == "cancel"]
+            try:
+                if creates:
+                    await self._dispatch(lane, creates, self._create_batch, self._create_one)
+                if cancels:
+                    await self._dispatch(lane, cancels, self._cancel_batch, self._cancel_one)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Order router lane %s failed on a batch: %s", exchange, e)
+            finally:
+                for _ in batch:
+                    lane.queue.task_done()
+
+    async def _dispatch(self, lane: _Lane, orders: List[Dict], send_batch, send_one) -> None:
+        """
+        Send requests as batch calls of up to `max_batch` when the gateway
+        supports it, otherwise as concurrent single calls; every call takes
+        a token from the lane's rate limiter first.
+        """
+        gateway = lane.gateway
+        if gateway.supports_batch:
+            calls = [orders[i:i + gateway.max_batch] for i in range(0, len(orders), gateway.max_batch)]
+        else:
+            calls = [[order] for order in orders]
+        tasks = []
+        for chunk in calls:
+            if lane.limiter is not None:
+                await lane.limiter.acquire()
+            if len(chunk) > 1:
+                lane.counters["batches"] += 1
+                tasks.append(asyncio.ensure_future(send_batch(lane, chunk)))
+            else:
+                tasks.append(asyncio.ensure_future(send_one(lane, chunk[0])))
+        await asyncio.gather(*tasks)
+
+    async def _create_one(self, lane: _Lane, order: Dict) -> None:
+        self._stamp(order["id"], "sent")
+        try:
+            ack = await lane.gateway.create_order(order)
+        except Exception as e:
+            ack = e
+        await self._on_ack(lane, order, ack)
+
+    async def _create_batch(self, lane: _Lane, orders: List[Dict]) -> None:
+        for order in orders:
+            self._stamp(order["id"], "sent")
+        try:
+            acks = list(await lane.gateway.create_orders(orders))
+        except Exception as e:
+            acks = [e] * len(orders)
+        if len(acks) != len(orders):
+            logger.warning("Batch create on %s returned %s acks for %s orders",
+                           lane.gateway.name, len(acks), len(orders))
+            acks = acks[:len(orders)] + [ValueError("No ack in batch response")] * (len(orders) - len(acks))
+        for order, ack in zip(orders, acks):
+            await self._on_ack(lane, order, ack)
+
+    async def _cancel_one(self, lane: _Lane, order: Dict) -> None:
+        try:
+            await lane.gateway.cancel_order(order)
+        except Exception as e:
+            logger.warning("Cancel of %s on %s failed: %s", order["id"], lane.gateway.name, e)
+            return
+        await self._on_cancelled(lane, order)
+
+    async def _cancel_batch(self, lane: _Lane, orders: List[Dict]) -> None:
+        try:
+            await lane.gateway.cancel_orders(orders)
+        except Exception as e:
+            logger.warning("Batch cancel of %s orders on %s failed: %s", len(orders), lane.gateway.name, e)
+            return
+        for order in orders:
+            await self._on_cancelled(lane, order)
+
+    async def _on_cancelled(self, lane: _Lane, order: Dict) -> None:
+        if order["status"] not in TERMINAL_STATUSES:
+            await self.orders.cancel_order(order["id"])
+        lane.counters["cancelled"] += 1
+        self._finish(order["id"])
+
+    async def _on_ack(self, lane: _Lane, order: Dict, ack) -> None:
+        """Apply an exchange ack (or rejection) to the order."""
+        order_id = order["id"]
+        if isinstance(ack, Exception) or "error" in ack:
+            lane.counters["rejected"] += 1
+            logger.warning("Order %s rejected by %s: %s", order_id, lane.gateway.name,
+                           ack if isinstance(ack, Exception) else ack["error"])
+            if order["status"] == OrderStatus.PENDING.value:
+                await self.orders.update_order_status(order_id, OrderStatus.REJECTED)
+            self._finish(order_id)
+            return
+
+        self._stamp(order_id, "acked")
+        future = self._acks.pop(order_id, None)
+        if ack.get("status") == "filled":
+            await self._on_filled(order, ack)
+        elif ack.get("status") in ("cancelled", "rejected"):
+            await self._on_closed(lane, order, ack)
+        elif order["status"] not in TERMINAL_STATUSES:
+            await self.orders.update_order_status(
+                order_id, OrderStatus.OPEN, exchange_order_id=ack.get("exchange_order_id")
+            )
+            if lane.gateway.supports_fetch:
+                self._watch(order_id)
+            if order_id in self._cancel_on_ack:
+                self._cancel_on_ack.discard(order_id)
+                # Called from the lane's own worker: never block on its queue
+                try:
+                    lane.queue.put_nowait(("cancel", order))
+                except asyncio.QueueFull:
+                    asyncio.ensure_future(lane.queue.put(("cancel", order)))
+        else:
+            # Filled or cancelled while the ack was in flight (paper engine)
+            if order["status"] == OrderStatus.FILLED.value:
+                self._stamp(order_id, "filled")
+            self._finish(order_id)
+        if future is not None and not future.done():
+            future.set_result(order)
+
+    async def _on_filled(self, order: Dict, ack: Dict) -> None:
+        await self.orders.update_order_status(
+            order["id"], OrderStatus.FILLED,
+            filled=ack.get("filled") or order["amount"],
+            average_price=ack.get("average_price"),
+            exchange_order_id=ack.get("exchange_order_id"),
+        )
+        self._stamp(order["id"], "filled")
+        self._finish(order["id"])
+
+    async def _on_closed(self, lane: _Lane, order: Dict, ack: Dict) -> None:
+        """The exchange cancelled, expired or rejected the order."""
+        rejected = ack["status"] == "rejected"
+        if order["status"] not in TERMINAL_STATUSES:
+            await self.orders.update_order_status(
+                order["id"], OrderStatus.REJECTED if rejected else OrderStatus.CANCELLED,
+                filled=ack.get("filled"),
+                average_price=ack.get("average_price"),
+                exchange_order_id=ack.get("exchange_order_id"),
+            )
+        lane.counters["rejected" if rejected else "cancelled"] += 1
+        self._finish(order["id"])
+
+    # --- Open order polling ---
+
+    def _watch(self, order_id: str) -> None:
+        """Poll an order acked open until the exchange reports it terminal."""
+        self._open[order_id] = self._order_lane[order_id]
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll_loop())
+
+    async def _poll_loop(self) -> None:
+        while self._open:
+            await asyncio.sleep(settings.ORDER_ROUTER_POLL_INTERVAL)
+            by_lane: Dict[str, List[Dict]] = {}
+            for order_id, exchange in list(self._open.items()):
+                order = self.orders.orders.get(order_id)
+                if order is None or order["status"] in TERMINAL_STATUSES:
+                    # Finished outside the router (e.g. cancelled directly, or archived)
+                    if order is not None and order["status"] == OrderStatus.FILLED.value:
+                        self._stamp(order_id, "filled")
+                    self._finish(order_id)
+                    continue
+                by_lane.setdefault(exchange, []).append(order)
+            await asyncio.gather(
+                *(self._poll_lane(self._lanes[exchange], orders) for exchange, orders in by_lane.items())
+            )
+
+    async def _poll_lane(self, lane: _Lane, orders: List[Dict]) -> None:
+        """Fetch open orders, ORDER_ROUTER_MAX_INFLIGHT at a time, each through the rate limiter."""
+        step = settings.ORDER_ROUTER_MAX_INFLIGHT
+        for start in range(0, len(orders), step):
+            tasks = []
+            for order in orders[start:start + step]:
+                if lane.limiter is not None:
+                    await lane.limiter.acquire()
+                tasks.append(asyncio.ensure_future(self._poll_one(lane, order)))
+            await asyncio.gather(*tasks)
+
+    async def _poll_one(self, lane: _Lane, order: Dict) -> None:
+        try:
+            state = await lane.gateway.fetch_order(order)
+        except Exception as e:
+            lane.counters["poll_failures"] += 1
+            logger.warning("Polling order %s on %s failed: %s", order["id"], lane.gateway.name, e)
+            return
+        lane.counters["polls"] += 1
+        if order["id"] not in self._open or order["status"] in TERMINAL_STATUSES:
+            return  # settled while the fetch was in flight
+        status = state.get("status")
+        if status == "filled":
+            await self._on_filled(order, state)
+        elif status in ("cancelled", "rejected"):
+            await self._on_closed(lane, order, state)
+        elif state.get("filled") and state["filled"] != order.get("filled"):
+            # Partial fill: progress on the open order
+            await self.orders.update_order_status(
+                order["id"], OrderStatus.OPEN,
+                filled=state["filled"], average_price=state.get("average_price"),
+            )
+
+    async def stop(self) -> None:
+        """Stop the workers and the poller and close gateway sessions; queued orders stay pending."""
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        workers = [lane.worker for lane in self._lanes.values() if lane.worker is not None]
+        for task in workers:
+            task.cancel()
+        for task in workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for gateway in self._gateways.values():
+            try:
+                await gateway.close()
+            except Exception as e:
+                logger.warning("Error closing gateway %s: %s", gateway.name, e)
+
+    def get_stats(self) -> Dict:
+        """Per-exchange queue depth, counters and latency histograms."""
+        return {
+            exchange: {
+                "queued": lane.queue.qsize(),
+                "polling": sum(1 for exchange_name in self._open.values() if exchange_name == exchange),
+                "cancels_awaiting_ack": sum(
+                    1 for order_id in self._cancel_on_ack if self._order_lane.get(order_id) == exchange
+                ),
+                "batching": lane.gateway.supports_batch,
+                **lane.counters,
+                **{name: histogram.snapshot() for name, histogram in lane.histograms.items()},
+            }
+            for exchange, lane in self._lanes.items()
+        }
+
+
+order_router = OrderRouter()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure order-to-ack latency against a simulated exchange")
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--batch", type=int, default=20, help="Max batch size (1 disables batching)")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second limit")
+    args = parser.parse_args()
+
+    async def main():
+        orders = OrderExecutionService(terminal_retention=args.orders)
+        router = OrderRouter(orders=orders, queue_size=args.orders)
+        router.register_gateway(SimulatedGateway(
+            latency_ms=args.latency_ms,
+            supports_batch=args.batch > 1,
+            max_batch=args.batch,
+            rate_limit=args.rate,
+        ))
+        started = time.perf_counter()
+        futures = [
+            await router.submit(
+                await orders.create_order("SIM", OrderSide.BUY, OrderType.LIMIT, 1.0, 100.0), "sim"
+            )
+            for _ in range(args.orders)
+        ]
+        await asyncio.gather(*futures)
+        elapsed = time.perf_counter() - started
+        stats = router.get_stats()["sim"]
+        await router.stop()
+        print({
+            "orders": args.orders,
+            "elapsed_seconds": round(elapsed, 3),
+            "orders_per_second": int(args.orders / elapsed),
+            "batches": stats["batches"],
+            "order_to_ack_ms": {k: stats["order_to_ack_ms"][k] for k in ("avg", "p50", "p90", "p99", "max")},
+        })
+
+    asyncio.run(main())
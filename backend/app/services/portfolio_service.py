@@ -0,0 +1,488 @@
+"""
+Portfolio Service - Per-user portfolio snapshots kept current by fills and quotes
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from app.core.config import settings
+from app.services.order_execution import (
+    OrderExecutionService,
+    OrderSide,
+    TERMINAL_STATUSES,
+    order_execution_service,
+)
+from app.services.quote_stream import QuoteBus, quote_bus, quote_price
+
+logger = logging.getLogger(__name__)
+
+# One row per symbol: signed quantity and signed cost basis of the open lots
+PORTFOLIO_SQL = """
+SELECT
+    symbol,
+    SUM(CASE WHEN side = 'sell' THEN -amount ELSE amount END)::float8 AS qty,
+    SUM(CASE WHEN side = 'sell' THEN -amount ELSE amount END * entry_price)::float8 AS cost,
+    MAX(current_price)::float8 AS current_price
+FROM trading.positions
+WHERE user_id = $1 AND is_open
+GROUP BY symbol
+ORDER BY symbol
+"""
+
+OPEN_LOTS_SQL = """
+SELECT id, side, amount::float8 AS amount
+FROM trading.positions
+WHERE user_id = $1 AND symbol = $2 AND is_open
+FOR UPDATE
+"""
+
+INSERT_LOT_SQL = """
+INSERT INTO trading.positions (user_id, symbol, side, amount, entry_price, current_price)
+VALUES ($1, $2, $3, $4, $5, $5)
+"""
+
+# Partial reduction: every open lot shrinks by the same factor, keeping the average entry
+SCALE_LOTS_SQL = """
+UPDATE trading.positions SET amount = amount * $2 WHERE id = ANY($1::integer[])
+"""
+
+CLOSE_LOTS_SQL = """
+UPDATE trading.positions SET is_open = FALSE, closed_at = NOW() WHERE id = ANY($1::integer[])
+"""
+
+# Rows that can never be written (bad user id, out-of-range values) are dropped, not retried
+DATA_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+MAX_RETRY_DELAY = 30.0
+
+
+class _Holding:
+    """One symbol in a user's portfolio."""
+
+    __slots__ = ("qty", "cost", "price", "previous_close")
+
+    def __init__(self, qty: float, cost: float, price: float, previous_close: float):
+        self.qty = qty  # signed
+        self.cost = cost  # signed cost basis (qty * average entry)
+        self.price = price
+        self.previous_close = previous_close
+
+    @property
+    def value(self) -> float:
+        return self.qty * self.price
+
+    @property
+    def pnl(self) -> float:
+        return self.value - self.cost
+
+    @property
+    def pnl_daily(self) -> float:
+        return self.qty * (self.price - self.previous_close) if self.previous_close else 0.0
+
+
+class _Fill:
+    """A fill delta applied to a user's holdings, kept until it is in trading.positions."""
+
+    __slots__ = ("seq", "user_id", "symbol", "signed", "price", "persisted")
+
+    def __init__(self, seq: int, user_id: int, symbol: str, signed: float, price: float):
+        self.seq = seq
+        self.user_id = user_id
+        self.symbol = symbol  # as the order has it (the snapshot key is upper-cased)
+        self.signed = signed
+        self.price = price
+        self.persisted = False
+
+
+class _Snapshot:
+    """A user's holdings plus totals maintained on every change."""
+
+    __slots__ = ("holdings", "value", "pnl", "pnl_daily", "loaded_at", "priced_at", "view")
+
+    def __init__(self, holdings: Dict[str, _Holding]):
+        self.holdings = holdings
+        self.value = sum(h.value for h in holdings.values())
+        self.pnl = sum(h.pnl for h in holdings.values())
+        self.pnl_daily = sum(h.pnl_daily for h in holdings.values())
+        self.loaded_at = time.time()
+        self.priced_at = time.time()
+        self.view: Optional[Dict] = None  # rendered response, dropped on change
+
+    def apply(self, holding: _Holding, qty: float, cost: float, price: float, previous_close: float) -> None:
+        """Change one holding, adjusting the totals by the difference."""
+        before = (holding.value, holding.pnl, holding.pnl_daily)
+        holding.qty, holding.cost, holding.price, holding.previous_close = qty, cost, price, previous_close
+        self.value += holding.value - before[0]
+        self.pnl += holding.pnl - before[1]
+        self.pnl_daily += holding.pnl_daily - before[2]
+        self.view = None
+
+
+class PortfolioService:
+    """
+    Portfolio views served from per-user snapshots.
+
+    A snapshot is built from one aggregated query over `trading.positions`
+    (one row per symbol) and priced with one batched quote lookup. After
+    that it is updated in place: quotes published on the QuoteBus re-price
+    the holders of that symbol, and fills from OrderExecutionService adjust
+    the user's quantity and cost basis, each changing the totals by the
+    difference only. The rendered response is cached until something
+    changes, so polling costs a dict lookup. Snapshots are rebuilt from
+    the database after `PORTFOLIO_SNAPSHOT_TTL` seconds, re-priced on
+    read when no quote arrived for `PORTFOLIO_REPRICE_INTERVAL` seconds,
+    and at most `PORTFOLIO_MAX_SNAPSHOTS` are kept (least recently read
+    evicted).
+
+    Fills are also written to `trading.positions` by one ordered writer
+    (a new lot on increase, lots scaled down on reduction, closed when
+    flat). Each fill stays in a per-user log until written; a rebuild
+    reads the table under the writer's lock and replays every logged fill
+    the query could not have seen, so fills written late, or arriving
+    while a rebuild is in flight, are not lost.
+    """
+
+    def __init__(
+        self,
+        orders: Optional[OrderExecutionService] = None,
+        bus: Optional[QuoteBus] = None,
+        market_service=None,
+        database_url: Optional[str] = None,
+    ):
+        """Initialize portfolio service."""
+        self.orders = orders or order_execution_service
+        self.bus = bus or quote_bus
+        self._market_service = market_service
+        self.database_url = database_url or settings.DATABASE_URL
+        self.pool: Optional[asyncpg.Pool] = None
+        self._snapshots: "OrderedDict[int, _Snapshot]" = OrderedDict()  # least recently read first
+        self._holders: Dict[str, Set[int]] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._filled: Dict[str, Tuple[float, float]] = {}  # order id -> (quantity, average) already applied
+        self._fills: Dict[int, List[_Fill]] = {}  # per user, in order, until written
+        self._seq = 0
+        self._writes: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._attached = False
+        self.persisted_fills = 0
+        self.dropped_fills = 0
+        self.builds = 0
+        self.reads = 0
+
+    @property
+    def market_service(self):
+        """MarketDataService used for pricing, created on first use."""
+        if self._market_service is None:
+            from app.services.market_data import MarketDataService
+            self._market_service = MarketDataService()
+        return self._market_service
+
+    async def connect(self) -> None:
+        """Open the asyncpg pool."""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=4)
+
+    # --- Snapshots ---
+
+    async def _build(self, user_id: int) -> _Snapshot:
+        """One aggregated query plus one batched quote lookup, then unwritten fills replayed."""
+        await self.connect()
+        # Under the writer's lock, so each logged fill is either in the rows or still unwritten
+        async with self._write_lock:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(PORTFOLIO_SQL, user_id)
+            seq = self._seq
+            unwritten = {fill.seq for fill in self._fills.get(user_id, ()) if not fill.persisted}
+        rows = [row for row in rows if row["qty"]]
+        quotes = await self.market_service.get_stock_quotes([row["symbol"] for row in rows])
+
+        holdings = {}
+        for row in rows:
+            symbol = row["symbol"].upper()
+            quote = quotes.get(symbol) or {}
+            price = quote_price(quote) or row["current_price"] or row["cost"] / row["qty"]
+            holdings[symbol] = _Holding(row["qty"], row["cost"], price, quote.get("previous_close") or 0.0)
+        self.builds += 1
+        snapshot = _Snapshot(holdings)
+        for fill in self._fills.get(user_id, ()):
+            if fill.seq in unwritten or fill.seq > seq:
+                self._apply_fill(snapshot, fill.symbol.upper(), fill.signed, fill.price)
+        return snapshot
+
+    def _forget(self, user_id: int) -> None:
+        previous = self._snapshots.pop(user_id, None)
+        if previous is not None:
+            for symbol in previous.holdings:
+                holders = self._holders.get(symbol)
+                if holders is not None:
+                    holders.discard(user_id)
+                    if not holders:
+                        del self._holders[symbol]
+
+    def _install(self, user_id: int, snapshot: _Snapshot) -> None:
+        self._forget(user_id)
+        self._snapshots[user_id] = snapshot
+        for symbol in snapshot.holdings:
+            self._holders.setdefault(symbol, set()).add(user_id)
+        # Evict the least recently read snapshots beyond the bound
+        while len(self._snapshots) > settings.PORTFOLIO_MAX_SNAPSHOTS:
+            self._forget(next(iter(self._snapshots)))
+
+    async def _load(self, user_id: int) -> _Snapshot:
+        """Build and install a snapshot; runs as its own task so no reader can cancel it."""
+        try:
+            snapshot = await self._build(user_id)
+            self._install(user_id, snapshot)
+            return snapshot
+        finally:
+            del self._loading[user_id]
+            self._trim(user_id)
+
+    async def _snapshot(self, user_id: int) -> _Snapshot:
+        """Current snapshot, building it once even under concurrent reads."""
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is not None and time.time() - snapshot.loaded_at < settings.PORTFOLIO_SNAPSHOT_TTL:
+            self._snapshots.move_to_end(user_id)
+            return snapshot
+        future = self._loading.get(user_id)
+        if future is None:
+            future = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+        try:
+            # A reader that goes away (client disconnect) must not cancel the shared build
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if snapshot is None:
+                raise
+            # Keep serving the expired snapshot (still updated by fills and quotes)
+            logger.warning("Rebuilding portfolio for user %s failed: %s", user_id, e)
+            return snapshot
+
+    async def _reprice(self, snapshot: _Snapshot) -> None:
+        """Re-price every holding with one batched quote lookup."""
+        quotes = await self.market_service.get_stock_quotes(list(snapshot.holdings))
+        for symbol, quote in quotes.items():
+            self._price_holding(snapshot, symbol, quote)
+        snapshot.priced_at = time.time()
+
+    @staticmethod
+    def _price_holding(snapshot: _Snapshot, symbol: str, quote: Dict) -> None:
+        holding = snapshot.holdings.get(symbol)
+        price = quote_price(quote)
+        if holding is None or not price:
+            return
+        previous_close = quote.get("previous_close") or holding.previous_close
+        if price != holding.price or previous_close != holding.previous_close:
+            snapshot.apply(holding, holding.qty, holding.cost, price, previous_close)
+
+    async def get_portfolio(self, user_id: int) -> Dict:
+        """Portfolio view for a user."""
+        self.reads += 1
+        snapshot = await self._snapshot(user_id)
+        if time.time() - snapshot.priced_at >= settings.PORTFOLIO_REPRICE_INTERVAL:
+            try:
+                await self._reprice(snapshot)
+            except Exception as e:
+                logger.warning("Repricing portfolio for user %s failed: %s", user_id, e)
+        if snapshot.view is None:
+            snapshot.view = self._render(snapshot)
+        return snapshot.view
+
+    @staticmethod
+    def _render(snapshot: _Snapshot) -> Dict:
+        start_of_day = snapshot.value - snapshot.pnl_daily
+        positions: List[Dict] = [
+            {
+                "symbol": symbol,
+                "amount": h.qty,
+                "entry": round(h.cost / h.qty, 4) if h.qty else 0.0,
+                "current": round(h.price, 4),
+                "pnl": round(h.pnl, 2),
+            }
+            for symbol, h in snapshot.holdings.items()
+            if h.qty
+        ]
+        return {
+            "balance": round(snapshot.value, 2),
+            "pnl": round(snapshot.pnl, 2),
+            "pnl_daily": round(snapshot.pnl_daily, 2),
+            "pnl_percent": round(snapshot.pnl_daily / abs(start_of_day) * 100, 2) if start_of_day else 0.0,
+            "positions": positions,
+            "updated_at": max(snapshot.priced_at, snapshot.loaded_at),
+        }
+
+    # --- Incremental updates ---
+
+    def on_quote(self, symbol: str, quote: Dict) -> None:
+        """QuoteBus listener: re-price the holders of a symbol."""
+        holders = self._holders.get(symbol)
+        if not holders:
+            return
+        for user_id in holders:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None:
+                self._price_holding(snapshot, symbol, quote)
+
+    def on_order(self, order: Dict) -> None:
+        """Order listener: apply new fill quantity to the user's snapshot and queue its write."""
+        filled = order.get("filled") or 0.0
+        applied, applied_average = self._filled.get(order["id"], (0.0, 0.0))
+        average = order.get("average_price") or order.get("price") or 0.0
+        if order["status"] in TERMINAL_STATUSES:
+            self._filled.pop(order["id"], None)
+        elif filled:
+            self._filled[order["id"]] = (filled, average)
+        delta = filled - applied
+        user_id = order.get("user_id")
+        if delta <= 0 or user_id is None:
+            return
+
+        # Price of this fill from the change in the cumulative average
+        price = (average * filled - applied_average * applied) / delta
+        signed = delta if order["side"] == OrderSide.BUY.value else -delta
+        if self._writes is not None:
+            self._seq += 1
+            fill = _Fill(self._seq, user_id, order["symbol"], signed, price)
+            self._fills.setdefault(user_id, []).append(fill)
+            self._writes.put_nowait(fill)
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is not None:
+            symbol = order["symbol"].upper()
+            if symbol not in snapshot.holdings:
+                self._holders.setdefault(symbol, set()).add(user_id)
+            self._apply_fill(snapshot, symbol, signed, price)
+
+    @staticmethod
+    def _apply_fill(snapshot: _Snapshot, symbol: str, signed: float, price: float) -> None:
+        """Add a signed fill quantity at `price` to one holding."""
+        holding = snapshot.holdings.get(symbol)
+        if holding is None:
+            holding = snapshot.holdings[symbol] = _Holding(0.0, 0.0, price, 0.0)
+        qty = holding.qty + signed
+        if holding.qty and (holding.qty > 0) != (signed > 0):
+            # Reducing: the remaining quantity keeps its average entry
+            cost = holding.cost / holding.qty * qty if abs(signed) <= abs(holding.qty) else qty * price
+        else:
+            cost = holding.cost + signed * price
+        snapshot.apply(holding, qty, cost, holding.price or price, holding.previous_close)
+
+    # --- Writing fills to trading.positions ---
+
+    async def _persist(self, fill: _Fill) -> None:
+        """Apply one fill to the user's open lots of the symbol, in one transaction."""
+        await self.connect()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                lots = await conn.fetch(OPEN_LOTS_SQL, fill.user_id, fill.symbol)
+                ids = [lot["id"] for lot in lots]
+                qty = sum(-lot["amount"] if lot["side"] == OrderSide.SELL.value else lot["amount"] for lot in lots)
+                after = qty + fill.signed
+                if qty and (qty > 0) != (fill.signed > 0):
+                    if abs(fill.signed) < abs(qty):
+                        await conn.execute(SCALE_LOTS_SQL, ids, after / qty)
+                        return
+                    await conn.execute(CLOSE_LOTS_SQL, ids)
+                    if abs(after) < 1e-12:
+                        return
+                    # Flipped: the remainder opens a new lot at the fill price
+                    fill_qty = after
+                else:
+                    fill_qty = fill.signed
+                side = OrderSide.BUY.value if fill_qty > 0 else OrderSide.SELL.value
+                await conn.execute(INSERT_LOT_SQL, fill.user_id, fill.symbol, side, abs(fill_qty), fill.price)
+
+    def _written(self, fill: _Fill) -> None:
+        fill.persisted = True
+        self._trim(fill.user_id)
+
+    def _trim(self, user_id: int) -> None:
+        """Forget written fills, unless a rebuild in flight may still need to replay them."""
+        log = self._fills.get(user_id)
+        if log is not None and user_id not in self._loading:
+            log[:] = [f for f in log if not f.persisted]
+            if not log:
+                del self._fills[user_id]
+
+    async def _write_loop(self) -> None:
+        """Write fills in arrival order, retrying with backoff while the database is down."""
+        failures = 0
+        while True:
+            fill = await self._writes.get()
+            while True:
+                try:
+                    async with self._write_lock:
+                        await self._persist(fill)
+                        self._written(fill)
+                    self.persisted_fills += 1
+                    failures = 0
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except DATA_ERRORS as e:
+                    logger.error("Dropping position write for user %s %s: %s", fill.user_id, fill.symbol, e)
+                    self.dropped_fills += 1
+                    self._written(fill)
+                    break
+                except Exception as e:
+                    failures += 1
+                    if failures == 1:
+                        logger.warning("Writing position for user %s %s failed, retrying: %s", fill.user_id, fill.symbol, e)
+                    await asyncio.sleep(min(MAX_RETRY_DELAY, 2 ** min(failures, 16) / 2))
+
+    def start(self) -> None:
+        """Follow fills and quotes, and write fills to trading.positions."""
+        if self._attached:
+            return
+        # Fills of restored working orders were written before the restart
+        for order in self.orders.orders.values():
+            if order["status"] not in TERMINAL_STATUSES and order.get("filled"):
+                self._filled[order["id"]] = (
+                    order["filled"], order.get("average_price") or order.get("price") or 0.0
+                )
+        self.orders.add_listener(self.on_order)
+        self.bus.add_listener(self.on_quote)
+        if settings.PORTFOLIO_PERSIST_FILLS:
+            self._writes = asyncio.Queue()
+            self._writer = asyncio.ensure_future(self._write_loop())
+        self._attached = True
+
+    async def stop(self) -> None:
+        """Write queued fills (best effort), stop the writer and close the database pool."""
+        if self._writer is not None:
+            try:
+                await asyncio.wait_for(self._drain(), timeout=5)
+            except asyncio.TimeoutError:
+                logger.warning("%s fills not written to trading.positions at shutdown", self._writes.qsize())
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _drain(self) -> None:
+        while not self._writes.empty() or any(not f.persisted for log in self._fills.values() for f in log):
+            await asyncio.sleep(0.05)
+
+    def get_stats(self) -> Dict:
+        """Snapshot counts, builds and reads."""
+        return {
+            "snapshots": len(self._snapshots),
+            "symbols": len(self._holders),
+            "builds": self.builds,
+            "reads": self.reads,
+            "pending_fills": sum(1 for log in self._fills.values() for f in log if not f.persisted),
+            "persisted_fills": self.persisted_fills,
+            "dropped_fills": self.dropped_fills,
+        }
+
+
+portfolio_service = PortfolioService()
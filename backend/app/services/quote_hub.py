@@ -0,0 +1,259 @@
+"""
+Quote Hub - Shared per-symbol fan-out for WebSocket quote subscribers
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from app.services.quote_stream import FinnhubTradeStream, QuoteBus, quote_bus, trade_stream
+
+logger = logging.getLogger(__name__)
+
+# Without a live trade stream (or while the market is closed) producers fall
+# back to polling every 10 seconds to respect free tier rate limits (60/min)
+POLL_INTERVAL = 10
+
+
+def compact_quote(quote: Dict) -> Dict:
+    """Short-key quote representation used by the multiplexed stream."""
+    return {
+        "p": quote["current_price"],
+        "c": quote.get("change", 0.0),
+        "cp": quote["percent_change"],
+        "h": quote.get("high"),
+        "l": quote.get("low"),
+        "o": quote.get("open"),
+        "pc": quote.get("previous_close"),
+        "t": quote["timestamp"],
+        "live": not quote.get("is_simulated", False),
+    }
+
+
+def quote_frame(symbol: str, quote: Dict) -> str:
+    """Serialize a quote into the WebSocket message format."""
+    return json.dumps({
+        "symbol": symbol,
+        "price": quote["current_price"],
+        "timestamp": quote["timestamp"],
+        "change_percent": quote["percent_change"],
+        "is_live": not quote.get("is_simulated", False),
+    })
+
+
+class QuoteHub:
+    """
+    One producer task per active symbol, broadcasting to many clients.
+
+    Each frame is serialized once and pushed to bounded per-client queues.
+    A client whose queue is full is dropped (it receives a None sentinel)
+    instead of slowing the producer down. The producer is cancelled when
+    the last subscriber of its symbol leaves.
+
+    Multiplexed clients share one queue across many symbols and receive
+    `(symbol, fields)` items: the full compact state on subscribe, then only
+    the fields that changed. Since a client is dropped rather than skipped
+    when it falls behind, every delta applies on top of the previous one.
+    """
+
+    def __init__(
+        self,
+        market_service=None,
+        bus: Optional[QuoteBus] = None,
+        stream: Optional[FinnhubTradeStream] = None,
+        client_queue_size: int = 32,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        """Initialize quote hub."""
+        self._market_service = market_service
+        self.bus = bus or quote_bus
+        self.stream = stream or trade_stream
+        self.client_queue_size = client_queue_size
+        self.poll_interval = poll_interval
+        self._clients: Dict[str, Set[asyncio.Queue]] = {}
+        self._mux_clients: Dict[str, Set[asyncio.Queue]] = {}
+        self._state: Dict[str, Dict] = {}
+        self._producers: Dict[str, asyncio.Task] = {}
+        self._last_frame: Dict[str, str] = {}
+        self.dropped_clients = 0
+
+    @property
+    def market_service(self):
+        """Shared MarketDataService, created on first use."""
+        if self._market_service is None:
+            from app.services.market_data import MarketDataService
+            self._market_service = MarketDataService()
+        return self._market_service
+
+    def subscribe(self, symbol: str) -> asyncio.Queue:
+        """Register a client queue, starting the symbol's producer if needed."""
+        symbol = symbol.upper()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.client_queue_size)
+        self._clients.setdefault(symbol, set()).add(queue)
+
+        last = self._last_frame.get(symbol)
+        if last is not None:
+            queue.put_nowait(last)
+
+        self._ensure_producer(symbol)
+        return queue
+
+    def unsubscribe(self, symbol: str, queue: asyncio.Queue) -> None:
+        """Remove a client queue, stopping the producer after the last one."""
+        symbol = symbol.upper()
+        clients = self._clients.get(symbol)
+        if clients is None:
+            return
+        clients.discard(queue)
+        self._maybe_stop_producer(symbol)
+
+    def subscribe_mux(self, symbol: str, queue: asyncio.Queue) -> None:
+        """Attach a multiplexed client's queue to a symbol."""
+        symbol = symbol.upper()
+        clients = self._mux_clients.setdefault(symbol, set())
+        if queue in clients:
+            return
+        clients.add(queue)
+
+        state = self._state.get(symbol)
+        if state is not None:
+            self._offer_mux(symbol, queue, dict(state))
+
+        self._ensure_producer(symbol)
+
+    def unsubscribe_mux(self, symbol: str, queue: asyncio.Queue) -> None:
+        """Detach a multiplexed client's queue from a symbol."""
+        symbol = symbol.upper()
+        clients = self._mux_clients.get(symbol)
+        if clients is None:
+            return
+        clients.discard(queue)
+        self._maybe_stop_producer(symbol)
+
+    def _ensure_producer(self, symbol: str) -> None:
+        """Start the symbol's producer if it is not running."""
+        if symbol not in self._producers:
+            self._producers[symbol] = asyncio.create_task(self._produce(symbol))
+
+    def _maybe_stop_producer(self, symbol: str) -> None:
+        """Stop the producer once no client of either kind is left."""
+        if not self._clients.get(symbol) and not self._mux_clients.get(symbol):
+            self._stop_producer(symbol)
+
+    def _stop_producer(self, symbol: str) -> None:
+        """Cancel a symbol's producer and drop its state."""
+        self._clients.pop(symbol, None)
+        self._mux_clients.pop(symbol, None)
+        self._last_frame.pop(symbol, None)
+        self._state.pop(symbol, None)
+        task = self._producers.pop(symbol, None)
+        if task is not None:
+            task.cancel()
+
+    def _drop(self, queue: asyncio.Queue) -> None:
+        """Replace a slow client's backlog with the drop sentinel."""
+        self.dropped_clients += 1
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _drop_mux(self, queue: asyncio.Queue) -> None:
+        """Drop a multiplexed client once: detach its queue from every symbol."""
+        for symbol, clients in list(self._mux_clients.items()):
+            if queue in clients:
+                clients.discard(queue)
+                if not clients and not self._clients.get(symbol):
+                    self._stop_producer(symbol)
+        self._drop(queue)
+
+    def _offer_mux(self, symbol: str, queue: asyncio.Queue, fields: Dict) -> bool:
+        """Queue a multiplexed update; drop the client if it is full."""
+        try:
+            queue.put_nowait((symbol, fields))
+            return True
+        except asyncio.QueueFull:
+            self._drop_mux(queue)
+            return False
+
+    def broadcast(self, symbol: str, quote: Dict) -> None:
+        """Push a quote to every client, dropping slow ones.
+
+        Classic clients get the pre-serialized frame on every update;
+        multiplexed clients only get the changed fields, if any.
+        """
+        frame = quote_frame(symbol, quote)
+        self._last_frame[symbol] = frame
+
+        clients = self._clients.get(symbol)
+        if clients:
+            slow = []
+            for queue in clients:
+                try:
+                    queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    slow.append(queue)
+            for queue in slow:
+                clients.discard(queue)
+                self._drop(queue)
+
+        state = compact_quote(quote)
+        previous = self._state.get(symbol)
+        self._state[symbol] = state
+        delta = state if previous is None else {
+            k: v for k, v in state.items() if previous.get(k) != v
+        }
+        # Timestamp alone moving is not a change worth sending
+        if delta and set(delta) != {"t"}:
+            mux_clients = self._mux_clients.get(symbol)
+            if mux_clients:
+                for queue in list(mux_clients):
+                    self._offer_mux(symbol, queue, delta)
+
+        self._maybe_stop_producer(symbol)
+
+    async def _produce(self, symbol: str):
+        """Feed a symbol's clients from the quote bus, polling when it is quiet."""
+        updates = None
+        acquired = False
+        try:
+            updates = self.bus.subscribe(symbol)
+            acquired = True
+            await self.stream.acquire(symbol)
+            # The initial snapshot is the client demand; later polls are internal
+            quote = await self.market_service.get_stock_quote(symbol)
+            self.broadcast(symbol, quote)
+
+            while True:
+                try:
+                    quote = await asyncio.wait_for(updates.get(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    quote = await self.market_service.fetch_quote(symbol)
+                self.broadcast(symbol, quote)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Quote producer for %s failed: %s", symbol, e)
+            # Wake the clients so they can reconnect to a fresh producer
+            for queue in list(self._clients.get(symbol, ())):
+                self._drop(queue)
+            for queue in list(self._mux_clients.get(symbol, ())):
+                self._drop_mux(queue)
+            if self._producers.get(symbol) is asyncio.current_task():
+                self._stop_producer(symbol)
+        finally:
+            if updates is not None:
+                self.bus.unsubscribe(symbol, updates)
+            if acquired:
+                await self.stream.release(symbol)
+
+    def get_stats(self) -> Dict:
+        """Active symbols, client counts and dropped clients."""
+        return {
+            "symbols": len(self._producers),
+            "clients": sum(len(c) for c in self._clients.values()),
+            "mux_subscriptions": sum(len(c) for c in self._mux_clients.values()),
+            "dropped_clients": self.dropped_clients,
+        }
+
+
+quote_hub = QuoteHub()
@@ -0,0 +1,364 @@
+"""
+Quote Stream Service - Push-based Finnhub trade ingestion and in-process quote bus
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import websockets
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _offer(queue: asyncio.Queue, item) -> None:
+    """Put an item on a bounded queue, dropping the oldest entry when full.
+
+    Quotes are conflatable: a slow reader only needs the latest price.
+    """
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(item)
+
+
+def quote_price(quote: Dict) -> Optional[float]:
+    """Last traded price of a quote, None for simulated or empty quotes."""
+    if quote.get("is_simulated"):
+        return None
+    return quote.get("current_price") or quote.get("price") or None
+
+
+class QuoteBus:
+    """In-memory last-quote table with per-symbol pub/sub."""
+
+    def __init__(self, subscriber_queue_size: int = 100):
+        """Initialize quote bus."""
+        self.subscriber_queue_size = subscriber_queue_size
+        self._quotes: Dict[str, Dict] = {}
+        self._seeded_at: Dict[str, float] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listeners: List[Callable[[str, Dict], None]] = []
+
+    def get_quote(self, symbol: str, max_baseline_age: Optional[float] = None) -> Optional[Dict]:
+        """
+        Get the last known quote for a symbol.
+
+        Args:
+            symbol: Stock symbol
+            max_baseline_age: Ignore the entry if its REST baseline (previous
+                close, open) is older than this many seconds
+
+        Returns:
+            Copy of the quote, or None if unknown or stale
+        """
+        symbol = symbol.upper()
+        quote = self._quotes.get(symbol)
+        if quote is None:
+            return None
+        if max_baseline_age is not None:
+            if time.monotonic() - self._seeded_at.get(symbol, 0.0) > max_baseline_age:
+                return None
+        return dict(quote)
+
+    def seed(self, symbol: str, quote: Dict) -> None:
+        """Store a full REST quote as the baseline that trades are applied to."""
+        symbol = symbol.upper()
+        self._quotes[symbol] = dict(quote)
+        self._seeded_at[symbol] = time.monotonic()
+
+    def forget(self, symbol: str) -> None:
+        """Drop a symbol's quote so it is no longer served from the bus."""
+        symbol = symbol.upper()
+        self._quotes.pop(symbol, None)
+        self._seeded_at.pop(symbol, None)
+
+    def apply_trade(self, symbol: str, price: float, timestamp_ms: int) -> Optional[Dict]:
+        """
+        Apply a trade to the symbol's quote and publish the result.
+
+        Trades for symbols without a baseline are ignored, since change and
+        percent change cannot be derived without the previous close.
+        """
+        symbol = symbol.upper()
+        quote = self._quotes.get(symbol)
+        if quote is None or price <= 0:
+            return None
+
+        previous_close = quote.get("previous_close") or price
+        change = price - previous_close
+        quote["current_price"] = price
+        quote["change"] = round(change, 4)
+        quote["percent_change"] = round(change / previous_close * 100, 4) if previous_close else 0.0
+        quote["high"] = max(quote.get("high") or price, price)
+        quote["low"] = min(quote.get("low") or price, price)
+        quote["timestamp"] = int(timestamp_ms / 1000)
+        quote.pop("is_simulated", None)
+        quote.pop("error", None)
+
+        self.publish(symbol, dict(quote))
+        return quote
+
+    def add_listener(self, callback: Callable[[str, Dict], None]) -> None:
+        """Register a callback(symbol, quote) invoked for every published quote."""
+        self._listeners.append(callback)
+
+    def publish(self, symbol: str, quote: Dict) -> None:
+        """Deliver a quote to every subscriber of the symbol."""
+        symbol = symbol.upper()
+        for queue in self._subscribers.get(symbol, ()):
+            _offer(queue, quote)
+        for callback in self._listeners:
+            try:
+                callback(symbol, quote)
+            except Exception as e:
+                logger.warning("Quote listener failed for %s: %s", symbol, e)
+
+    def subscribe(self, symbol: str) -> asyncio.Queue:
+        """Register a subscriber queue for a symbol."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.subscriber_queue_size)
+        self._subscribers.setdefault(symbol.upper(), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, symbol: str, queue: asyncio.Queue) -> None:
+        """Remove a subscriber queue."""
+        symbol = symbol.upper()
+        subscribers = self._subscribers.get(symbol)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[symbol]
+
+    def subscriber_count(self, symbol: str) -> int:
+        """Number of subscribers for a symbol."""
+        return len(self._subscribers.get(symbol.upper(), ()))
+
+
+class FinnhubTradeStream:
+    """
+    Single upstream Finnhub trade WebSocket feeding a QuoteBus.
+
+    One connection carries every subscribed symbol. On disconnect it
+    reconnects with exponential backoff and re-subscribes the full set.
+    The URL is configurable so tests can point it at a local server.
+
+    Upstream subscriptions are reference counted: long-lived consumers
+    (quote hub producers, paper feeds, strategy feeds) `acquire` and
+    `release` a symbol, one-off REST interest takes a `lease` that expires
+    after `QUOTE_STREAM_LEASE_TTL` seconds. A symbol is unsubscribed once
+    it has neither, and at most `QUOTE_STREAM_MAX_SYMBOLS` are streamed.
+    """
+
+    def __init__(
+        self,
+        bus: QuoteBus,
+        url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0,
+    ):
+        """Initialize trade stream."""
+        self.bus = bus
+        self.url = url or settings.FINNHUB_WS_URL
+        self.api_key = api_key if api_key is not None else (settings.FINNHUB_API_KEY or "").strip()
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.symbols: Set[str] = set()
+        self._refs: Dict[str, int] = {}
+        self._leases: Dict[str, float] = {}  # symbol -> monotonic expiry
+        self._ws = None
+        self._task: Optional[asyncio.Task] = None
+        self._expirer: Optional[asyncio.Task] = None
+        self.capped = 0
+        self._connected = asyncio.Event()
+
+    @property
+    def is_running(self) -> bool:
+        """Whether the stream task is running."""
+        return self._task is not None and not self._task.done()
+
+    @property
+    def is_connected(self) -> bool:
+        """Whether the upstream socket is currently open."""
+        return self._connected.is_set()
+
+    def _connect_url(self) -> str:
+        """Build the upstream URL with the API token."""
+        if not self.api_key:
+            return self.url
+        separator = "&" if "?" in self.url else "?"
+        return f"{self.url}{separator}token={self.api_key}"
+
+    async def start(self):
+        """Start the background stream task."""
+        if self.is_running:
+            return
+        self._task = asyncio.create_task(self._run())
+        self._expirer = asyncio.create_task(self._expire_loop())
+
+    async def stop(self):
+        """Stop the stream and close the upstream socket."""
+        for task in (self._task, self._expirer):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._expirer = None
+        self._connected.clear()
+        self._ws = None
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the upstream socket is open."""
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def subscribe(self, symbol: str):
+        """Add a symbol to the upstream subscription set."""
+        symbol = symbol.upper()
+        if symbol in self.symbols:
+            return
+        self.symbols.add(symbol)
+        await self._send({"type": "subscribe", "symbol": symbol})
+
+    async def unsubscribe(self, symbol: str):
+        """Remove a symbol from the upstream subscription set."""
+        symbol = symbol.upper()
+        if symbol not in self.symbols:
+            return
+        self.symbols.discard(symbol)
+        # Without trades the bus entry would go stale
+        self.bus.forget(symbol)
+        await self._send({"type": "unsubscribe", "symbol": symbol})
+
+    def is_streaming(self, symbol: str) -> bool:
+        """Whether trades for a symbol are subscribed upstream."""
+        return symbol.upper() in self.symbols
+
+    async def _ensure(self, symbol: str) -> bool:
+        """Subscribe a symbol upstream unless the symbol cap is reached."""
+        if symbol in self.symbols:
+            return True
+        if len(self.symbols) >= settings.QUOTE_STREAM_MAX_SYMBOLS:
+            self.capped += 1
+            if self.capped == 1:
+                logger.warning(
+                    "Finnhub stream at %s symbols, %s served by polling", settings.QUOTE_STREAM_MAX_SYMBOLS, symbol
+                )
+            return False
+        await self.subscribe(symbol)
+        return True
+
+    async def _maybe_unsubscribe(self, symbol: str) -> None:
+        if self._refs.get(symbol) or self._leases.get(symbol, 0.0) > time.monotonic():
+            return
+        self._leases.pop(symbol, None)
+        await self.unsubscribe(symbol)
+
+    async def acquire(self, symbol: str) -> bool:
+        """Hold an upstream subscription until `release`; False if not streamed (cap reached)."""
+        symbol = symbol.upper()
+        self._refs[symbol] = self._refs.get(symbol, 0) + 1
+        return await self._ensure(symbol)
+
+    async def release(self, symbol: str) -> None:
+        """Drop a hold taken with `acquire`."""
+        symbol = symbol.upper()
+        count = self._refs.get(symbol, 0) - 1
+        if count > 0:
+            self._refs[symbol] = count
+            return
+        self._refs.pop(symbol, None)
+        await self._maybe_unsubscribe(symbol)
+
+    async def lease(self, symbol: str, ttl: Optional[float] = None) -> bool:
+        """Stream a symbol for a while after a one-off request; False if not streamed."""
+        symbol = symbol.upper()
+        ttl = settings.QUOTE_STREAM_LEASE_TTL if ttl is None else ttl
+        self._leases[symbol] = max(self._leases.get(symbol, 0.0), time.monotonic() + ttl)
+        return await self._ensure(symbol)
+
+    async def _expire_loop(self):
+        """Unsubscribe symbols whose lease ran out and that nobody holds."""
+        while True:
+            await asyncio.sleep(max(1.0, settings.QUOTE_STREAM_LEASE_TTL / 4))
+            now = time.monotonic()
+            for symbol in [s for s, expiry in self._leases.items() if expiry <= now]:
+                await self._maybe_unsubscribe(symbol)
+
+    async def _send(self, message: Dict):
+        """Send a control message if connected (reconnects re-subscribe anyway)."""
+        if self._ws is None or not self.is_connected:
+            return
+        try:
+            await self._ws.send(json.dumps(message))
+        except Exception as e:
+            logger.warning("Finnhub stream send failed: %s", e)
+
+    def _handle_message(self, raw) -> None:
+        """Apply a Finnhub trade message to the bus.
+
+        Trades arrive batched; only the latest trade per symbol in a message
+        is applied, so a burst costs one publish per symbol.
+        """
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if message.get("type") != "trade":
+            return
+
+        latest: Dict[str, Dict] = {}
+        for trade in message.get("data") or []:
+            symbol = trade.get("s")
+            if not symbol:
+                continue
+            current = latest.get(symbol)
+            if current is None or trade.get("t", 0) >= current.get("t", 0):
+                latest[symbol] = trade
+
+        for symbol, trade in latest.items():
+            try:
+                self.bus.apply_trade(symbol, float(trade["p"]), int(trade.get("t") or time.time() * 1000))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    async def _run(self):
+        """Connect, subscribe and pump messages until cancelled."""
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with websockets.connect(self._connect_url()) as ws:
+                    self._ws = ws
+                    for symbol in list(self.symbols):
+                        await ws.send(json.dumps({"type": "subscribe", "symbol": symbol}))
+                    self._connected.set()
+                    delay = self.reconnect_delay
+                    logger.info("Finnhub trade stream connected (%s symbols)", len(self.symbols))
+                    async for raw in ws:
+                        self._handle_message(raw)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Finnhub trade stream error: %s", e)
+            finally:
+                self._connected.clear()
+                self._ws = None
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+quote_bus = QuoteBus()
+trade_stream = FinnhubTradeStream(quote_bus)
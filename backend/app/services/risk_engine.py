@@ -0,0 +1,470 @@
+"""
+Risk Engine - Incremental pre-trade risk checks against account limits
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Dict, Optional, Set, Tuple
+
+import asyncpg
+import pytz
+
+from app.core.config import settings
+from app.services.cache_metrics import LATENCY_BUCKETS_MS, Histogram
+from app.services.order_execution import (
+    OrderExecutionService,
+    OrderSide,
+    OrderType,
+    TERMINAL_STATUSES,
+    order_execution_service,
+)
+from app.services.quote_stream import quote_price
+
+logger = logging.getLogger(__name__)
+
+# Daily loss resets at midnight New York time
+RISK_DAY_TZ = pytz.timezone('US/Eastern')
+
+OPEN_POSITIONS_SQL = """
+SELECT user_id, symbol, side, amount, entry_price, current_price
+FROM trading.positions
+WHERE is_open
+"""
+
+
+class RiskLimitError(ValueError):
+    """An order was rejected by a pre-trade risk check."""
+
+    def __init__(self, check: str, message: str):
+        super().__init__(message)
+        self.check = check
+
+
+class RiskLimits:
+    """Per-account limits; notional values in quote currency, 0 disables a limit."""
+
+    __slots__ = (
+        "max_order_notional",
+        "max_position_notional",
+        "max_gross_exposure",
+        "max_net_exposure",
+        "max_open_order_notional",
+        "max_daily_loss",
+    )
+
+    def __init__(self, **overrides):
+        self.max_order_notional = settings.RISK_MAX_ORDER_NOTIONAL
+        self.max_position_notional = settings.RISK_MAX_POSITION_NOTIONAL
+        self.max_gross_exposure = settings.RISK_MAX_GROSS_EXPOSURE
+        self.max_net_exposure = settings.RISK_MAX_NET_EXPOSURE
+        self.max_open_order_notional = settings.RISK_MAX_OPEN_ORDER_NOTIONAL
+        self.max_daily_loss = settings.RISK_MAX_DAILY_LOSS
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Exposure:
+    """One account's position and working orders in one symbol."""
+
+    __slots__ = ("qty", "avg_price", "mark", "open_buy", "open_sell")
+
+    def __init__(self):
+        self.qty = 0.0  # signed: long > 0, short < 0
+        self.avg_price = 0.0
+        self.mark = 0.0  # price the position is currently valued at
+        self.open_buy = 0.0  # unfilled quantity of working buy orders
+        self.open_sell = 0.0
+
+
+class _Account:
+    """Running aggregates for one user."""
+
+    __slots__ = ("user_id", "limits", "positions", "gross", "net", "open_notional", "realized_today")
+
+    def __init__(self, user_id: Optional[int], limits: RiskLimits):
+        self.user_id = user_id
+        self.limits = limits
+        self.positions: Dict[str, _Exposure] = {}
+        self.gross = 0.0  # sum of |qty| * mark
+        self.net = 0.0  # sum of qty * mark
+        self.open_notional = 0.0  # unfilled notional of working orders
+        self.realized_today = 0.0
+
+    def exposure(self, symbol: str) -> _Exposure:
+        exposure = self.positions.get(symbol)
+        if exposure is None:
+            exposure = self.positions[symbol] = _Exposure()
+        return exposure
+
+
+class _Working:
+    """What the engine has accounted for one working order."""
+
+    __slots__ = ("account", "symbol", "sign", "price", "remaining", "filled", "average")
+
+    def __init__(self, account: _Account, symbol: str, sign: int, price: float, amount: float):
+        self.account = account
+        self.symbol = symbol
+        self.sign = sign
+        self.price = price  # reference price the reservation was made at
+        self.remaining = amount
+        self.filled = 0.0
+        self.average = 0.0
+
+
+class RiskEngine:
+    """
+    Pre-trade risk checks in constant time.
+
+    Per user it keeps running aggregates — gross and net exposure, notional
+    of working orders and realized P&L since midnight New York time — plus
+    per-symbol position and working quantity. They are updated from
+    OrderExecutionService events (new order, fill, cancel), so a check
+    only reads a handful of fields instead of re-summing positions and
+    orders. Positions are valued at the last fill or mark for the symbol
+    (`update_mark`).
+
+    `check_order` runs as a pre-trade check of OrderExecutionService and
+    raises RiskLimitError. Exposure and loss limits only block orders
+    that increase the position, so reducing risk is always allowed.
+    A market order on a symbol with no mark and no fill yet (e.g. a ccxt
+    pair, which the quote bus does not carry) is checked against a price
+    looked up once — ticker for pairs, cached quote for stocks — and kept
+    for `RISK_REFERENCE_PRICE_TTL` seconds; only that case is async.
+    """
+
+    def __init__(self, orders: Optional[OrderExecutionService] = None, database_url: Optional[str] = None):
+        """Initialize risk engine."""
+        self.orders = orders or order_execution_service
+        self.database_url = database_url or settings.DATABASE_URL
+        self.default_limits = RiskLimits()
+        self._accounts: Dict[Optional[int], _Account] = {}
+        self._working: Dict[str, _Working] = {}
+        self._marks: Dict[str, float] = {}
+        self._references: Dict[str, Tuple[float, float]] = {}  # symbol -> (looked-up price, at)
+        self._market_service = None
+        self._holders: Dict[str, Set[Optional[int]]] = {}
+        self._day_ends = 0.0
+        self.check_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.checks = 0
+        self.rejections: Dict[str, int] = {}
+        self._attached = False
+
+    def _account(self, user_id: Optional[int]) -> _Account:
+        account = self._accounts.get(user_id)
+        if account is None:
+            account = self._accounts[user_id] = _Account(user_id, self.default_limits)
+        return account
+
+    def set_limits(self, user_id: Optional[int], **limits) -> RiskLimits:
+        """Override limits for one user (unset limits keep the defaults)."""
+        account = self._account(user_id)
+        account.limits = RiskLimits(**limits)
+        return account.limits
+
+    def _roll_day(self, now: float) -> None:
+        """Reset daily P&L once per New York day."""
+        if now < self._day_ends:
+            return
+        local = datetime.fromtimestamp(now, RISK_DAY_TZ)
+        midnight = RISK_DAY_TZ.localize(datetime.combine(local.date() + timedelta(days=1), datetime.min.time()))
+        self._day_ends = midnight.timestamp()
+        for account in self._accounts.values():
+            account.realized_today = 0.0
+
+    # --- Checks ---
+
+    def _reject(self, check: str, message: str) -> None:
+        self.rejections[check] = self.rejections.get(check, 0) + 1
+        raise RiskLimitError(check, message)
+
+    def check_order(
+        self,
+        user_id: Optional[int],
+        symbol: str,
+        side: OrderSide,
+        order_type: OrderType,
+        amount: float,
+        price: Optional[float] = None,
+    ) -> Optional[Awaitable[None]]:
+        """
+        Raise RiskLimitError if the order would breach the user's limits.
+
+        Returns an awaitable instead when a reference price has to be looked
+        up first; the order is checked once it resolves.
+        """
+        started = time.perf_counter()
+        self.checks += 1
+        try:
+            if amount <= 0:
+                self._reject("amount", f"Order amount must be positive, got {amount}")
+            reference = price or self._reference(user_id, symbol)
+            if not reference:
+                return self._check_resolved(user_id, symbol, side, amount)
+            self._check(user_id, symbol, side, amount, reference)
+        finally:
+            self.check_latency_ms.observe((time.perf_counter() - started) * 1000)
+        return None
+
+    async def _check_resolved(self, user_id: Optional[int], symbol: str, side: OrderSide, amount: float) -> None:
+        reference = await self.resolve_price(symbol)
+        if not reference:
+            self._reject("price", f"No reference price for {symbol}")
+        self._check(user_id, symbol, side, amount, reference)
+
+    def _reference(self, user_id: Optional[int], symbol: str) -> Optional[float]:
+        """Position mark, else last fill/quote for the symbol, else a fresh looked-up price."""
+        account = self._accounts.get(user_id)
+        exposure = account.positions.get(symbol) if account is not None else None
+        if exposure is not None and exposure.mark:
+            return exposure.mark
+        mark = self._marks.get(symbol)
+        if mark:
+            return mark
+        looked_up = self._references.get(symbol)
+        if looked_up is not None and time.time() - looked_up[1] < settings.RISK_REFERENCE_PRICE_TTL:
+            return looked_up[0]
+        return None
+
+    async def resolve_price(self, symbol: str) -> Optional[float]:
+        """Look up a reference price: exchange ticker for pairs, cached quote for stocks."""
+        try:
+            if "/" in symbol:
+                from app.services.datafeed import DataFeedService
+                ticker = await DataFeedService(settings.RISK_REFERENCE_EXCHANGE).fetch_ticker(symbol)
+                price = ticker.get("price") or ticker.get("ask") or ticker.get("bid")
+            else:
+                if self._market_service is None:
+                    from app.services.market_data import MarketDataService
+                    self._market_service = MarketDataService()
+                quotes = await self._market_service.get_stock_quotes([symbol])
+                price = quote_price(quotes.get(symbol.upper()) or {})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Reference price lookup for %s failed: %s", symbol, e)
+            return None
+        if not price:
+            return None
+        self._references[symbol] = (float(price), time.time())
+        return float(price)
+
+    def _check(self, user_id: Optional[int], symbol: str, side: OrderSide, amount: float, reference: float) -> None:
+        self._roll_day(time.time())
+        account = self._account(user_id)
+        limits = account.limits
+        exposure = account.positions.get(symbol)
+        qty = exposure.qty if exposure is not None else 0.0
+        mark = exposure.mark if exposure is not None and exposure.mark else self._marks.get(symbol)
+
+        notional = amount * reference
+        if limits.max_order_notional and notional > limits.max_order_notional:
+            self._reject("order_notional", f"Order notional {notional:.2f} exceeds {limits.max_order_notional}")
+
+        signed = amount if side == OrderSide.BUY else -amount
+        after = qty + signed
+        if abs(after) <= abs(qty):
+            return  # reduces the position
+
+        if limits.max_open_order_notional and account.open_notional + notional > limits.max_open_order_notional:
+            self._reject(
+                "open_order_notional",
+                f"Working order notional would reach {account.open_notional + notional:.2f}, "
+                f"limit {limits.max_open_order_notional}",
+            )
+
+        # Worst case for the symbol: this order plus every working order on the same side fills
+        if exposure is not None:
+            worst = after + (exposure.open_buy if signed > 0 else -exposure.open_sell)
+        else:
+            worst = after
+        if limits.max_position_notional and abs(worst) * reference > limits.max_position_notional:
+            self._reject(
+                "position_notional",
+                f"{symbol} position notional would reach {abs(worst) * reference:.2f}, "
+                f"limit {limits.max_position_notional}",
+            )
+        held = qty * (mark or reference)
+        gross = account.gross - abs(held) + abs(after) * reference
+        if limits.max_gross_exposure and gross > limits.max_gross_exposure:
+            self._reject("gross_exposure", f"Gross exposure would reach {gross:.2f}, limit {limits.max_gross_exposure}")
+        net = account.net - held + after * reference
+        if limits.max_net_exposure and abs(net) > limits.max_net_exposure:
+            self._reject("net_exposure", f"Net exposure would reach {net:.2f}, limit {limits.max_net_exposure}")
+        if limits.max_daily_loss and -account.realized_today >= limits.max_daily_loss:
+            self._reject(
+                "daily_loss",
+                f"Daily loss {-account.realized_today:.2f} reached limit {limits.max_daily_loss}",
+            )
+
+    # --- Events ---
+
+    def on_order(self, order: Dict) -> None:
+        """Apply an order event: reserve new orders, book fills, release terminal ones."""
+        working = self._working.get(order["id"])
+        if working is None:
+            if order["status"] in TERMINAL_STATUSES and not order.get("filled"):
+                return
+            working = self._track(order)
+
+        filled = order.get("filled") or 0.0
+        if filled > working.filled:
+            delta = filled - working.filled
+            average = order.get("average_price") or working.price
+            # Price of this fill from the change in the cumulative average
+            price = (average * filled - working.average * working.filled) / delta
+            self._reserve(working, -min(delta, working.remaining))
+            working.remaining = max(0.0, working.remaining - delta)
+            working.filled, working.average = filled, average
+            self._apply_fill(working.account, working.symbol, working.sign * delta, price)
+
+        if order["status"] in TERMINAL_STATUSES:
+            self._reserve(working, -working.remaining)
+            del self._working[order["id"]]
+
+    def _track(self, order: Dict, filled: float = 0.0, average: float = 0.0) -> _Working:
+        """Start accounting for a working order, `filled` of it already booked."""
+        account = self._account(order.get("user_id"))
+        symbol = order["symbol"]
+        sign = 1 if order["side"] == OrderSide.BUY.value else -1
+        reference = order.get("price") or self._reference(account.user_id, symbol) or 0.0
+        working = self._working[order["id"]] = _Working(account, symbol, sign, reference, order["amount"])
+        working.remaining = max(0.0, order["amount"] - filled)
+        working.filled, working.average = filled, average
+        self._reserve(working, working.remaining)
+        return working
+
+    def _reserve(self, working: _Working, qty: float) -> None:
+        """Add (or with a negative qty, release) working quantity and notional."""
+        exposure = working.account.exposure(working.symbol)
+        if working.sign > 0:
+            exposure.open_buy = max(0.0, exposure.open_buy + qty)
+        else:
+            exposure.open_sell = max(0.0, exposure.open_sell + qty)
+        working.account.open_notional = max(0.0, working.account.open_notional + qty * working.price)
+
+    def _apply_fill(self, account: _Account, symbol: str, signed: float, price: float) -> None:
+        """Book a fill into the position, realized P&L and exposure totals."""
+        self._roll_day(time.time())
+        exposure = account.exposure(symbol)
+        qty = exposure.qty
+        after = qty + signed
+        if qty and (qty > 0) != (signed > 0):
+            closed = min(abs(signed), abs(qty))
+            account.realized_today += closed * (price - exposure.avg_price) * (1 if qty > 0 else -1)
+        if not after:
+            exposure.avg_price = 0.0
+        elif qty and (qty > 0) == (signed > 0):
+            exposure.avg_price = (exposure.avg_price * abs(qty) + price * abs(signed)) / abs(after)
+        elif not qty or (after > 0) != (qty > 0):
+            exposure.avg_price = price  # opened or flipped
+        account.gross += abs(after) * price - abs(qty) * exposure.mark
+        account.net += after * price - qty * exposure.mark
+        exposure.qty, exposure.mark = after, price
+        self._marks[symbol] = price
+        if after:
+            self._holders.setdefault(symbol, set()).add(account.user_id)
+
+    def update_mark(self, symbol: str, price: float) -> None:
+        """Revalue every holder of `symbol` at a new price (O(holders))."""
+        if not price:
+            return
+        self._marks[symbol] = price
+        for user_id in list(self._holders.get(symbol, ())):
+            account = self._accounts[user_id]
+            exposure = account.positions.get(symbol)
+            if exposure is None or not exposure.qty:
+                self._holders[symbol].discard(user_id)
+                continue
+            account.gross += abs(exposure.qty) * (price - exposure.mark)
+            account.net += exposure.qty * (price - exposure.mark)
+            exposure.mark = price
+
+    def on_quote(self, symbol: str, quote: Dict) -> None:
+        """QuoteBus listener: revalue holders at the quote's last price."""
+        self.update_mark(symbol, quote_price(quote))
+
+    def seed_position(self, user_id: Optional[int], symbol: str, qty: float, avg_price: float, mark: Optional[float] = None) -> None:
+        """Load an existing position (signed quantity) without booking P&L."""
+        account = self._account(user_id)
+        exposure = account.exposure(symbol)
+        mark = mark or avg_price
+        account.gross += abs(qty) * mark - abs(exposure.qty) * exposure.mark
+        account.net += qty * mark - exposure.qty * exposure.mark
+        exposure.qty, exposure.avg_price, exposure.mark = qty, avg_price, mark
+        self._marks.setdefault(symbol, mark)
+        if qty:
+            self._holders.setdefault(symbol, set()).add(user_id)
+
+    async def load_positions(self) -> int:
+        """Seed exposures from open rows in trading.positions."""
+        conn = await asyncpg.connect(self.database_url)
+        try:
+            rows = await conn.fetch(OPEN_POSITIONS_SQL)
+        finally:
+            await conn.close()
+        # A symbol may hold several open lots: seed their sum at the weighted entry
+        lots: Dict[Tuple[Optional[int], str], list] = {}
+        for row in rows:
+            sign = -1 if row["side"] == OrderSide.SELL.value else 1
+            qty = sign * float(row["amount"])
+            lot = lots.setdefault((row["user_id"], row["symbol"]), [0.0, 0.0, None])
+            lot[0] += qty
+            lot[1] += qty * float(row["entry_price"])
+            if row["current_price"] is not None:
+                lot[2] = float(row["current_price"])
+        for (user_id, symbol), (qty, cost, mark) in lots.items():
+            if qty:
+                self.seed_position(user_id, symbol, qty, cost / qty, mark)
+        return len(rows)
+
+    async def start(self) -> None:
+        """Seed positions, account for working orders and hook into order events."""
+        if self._attached:
+            return
+        try:
+            loaded = await self.load_positions()
+            logger.info("Risk engine loaded %s open positions", loaded)
+        except Exception as e:
+            logger.warning("Risk engine could not load positions: %s", e)
+        for order in list(self.orders.orders.values()):
+            if order["status"] not in TERMINAL_STATUSES and order["id"] not in self._working:
+                # Fills before the restart are already in the loaded positions
+                self._track(order, order.get("filled") or 0.0, order.get("average_price") or 0.0)
+        self.orders.add_pre_trade_check(self.check_order)
+        self.orders.add_listener(self.on_order)
+        self._attached = True
+
+    def get_account(self, user_id: Optional[int]) -> Dict:
+        """Current aggregates and limits for one user."""
+        account = self._account(user_id)
+        return {
+            "gross_exposure": round(account.gross, 2),
+            "net_exposure": round(account.net, 2),
+            "open_order_notional": round(account.open_notional, 2),
+            "realized_today": round(account.realized_today, 2),
+            "positions": {
+                symbol: {"qty": e.qty, "avg_price": e.avg_price, "mark": e.mark,
+                         "open_buy": e.open_buy, "open_sell": e.open_sell}
+                for symbol, e in account.positions.items()
+                if e.qty or e.open_buy or e.open_sell
+            },
+            "limits": account.limits.as_dict(),
+        }
+
+    def get_stats(self) -> Dict:
+        """Check counts, rejections by check and check latency."""
+        return {
+            "accounts": len(self._accounts),
+            "working_orders": len(self._working),
+            "checks": self.checks,
+            "rejections": dict(self.rejections),
+            "check_latency_ms": self.check_latency_ms.snapshot(),
+        }
+
+
+risk_engine = RiskEngine()
@@ -1,7 +1,76 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.api import api_router
+from app.core.serialization import FastJSONResponse
+from app.services.cache_service import cache_service
+from app.services.cache_warmup import cache_warmup
+from app.services.order_execution import order_execution_service
+from app.engine.paper_trading import paper_trading_engine
+from app.engine.strategy_runner import strategy_runner
+from app.engine.strategy_shards import strategy_shards
+from app.services.datafeed import close_exchanges
+from app.services.order_router import order_router
+from app.services.risk_engine import risk_engine
+from app.services.mark_to_market import mark_to_market
+from app.services.portfolio_service import portfolio_service
+from app.services.quote_stream import quote_bus, trade_stream
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Live quotes: one upstream Finnhub trade stream shared by all requests
+    finnhub_key = (settings.FINNHUB_API_KEY or "").strip()
+    if settings.QUOTE_STREAM_ENABLED and finnhub_key and finnhub_key != "demo":
+        await trade_stream.start()
+    # Connect the shared Redis pool off the request path and keep probing it
+    cache_service.start_health_probe()
+    # Proactively revalidate hot cache keys before they go stale
+    cache_service.start_refresher()
+    # Quotes fetched by other workers feed this worker's WebSocket subscribers
+    cache_service.add_update_listener("quote", quote_bus.publish)
+    cache_service.start_sync()
+    # Recover orders from the write-behind journal before accepting new ones
+    if settings.ORDER_JOURNAL_ENABLED:
+        await order_execution_service.start()
+    # Pre-trade limits: aggregates start from open positions and working orders
+    if settings.RISK_ENABLED:
+        await risk_engine.start()
+        quote_bus.add_listener(risk_engine.on_quote)
+    # Keep unrealized PnL of open positions current
+    if settings.MTM_ENABLED:
+        mark_to_market.start()
+    # Portfolio snapshots follow fills and quotes
+    portfolio_service.start()
+    # Match resting paper orders against live quotes
+    if settings.PAPER_TRADING_ENABLED:
+        paper_trading_engine.add_fill_listener(order_router.on_fill)
+        await paper_trading_engine.start()
+    # Run active strategies on shared bar feeds
+    if settings.STRATEGY_RUNNER_ENABLED:
+        if settings.STRATEGY_SHARDS > 0:
+            strategy_shards.start()
+        else:
+            strategy_runner.start()
+    # Prefetch watchlist and most-requested symbols before each open
+    if settings.WARMUP_ENABLED:
+        cache_warmup.start()
+    yield
+    await cache_warmup.stop()
+    await strategy_shards.stop()
+    await strategy_runner.stop()
+    await order_router.stop()
+    await mark_to_market.stop()
+    await portfolio_service.stop()
+    await paper_trading_engine.stop()
+    await order_execution_service.stop()
+    await cache_service.stop_sync()
+    await cache_service.stop_refresher()
+    await trade_stream.stop()
+    await close_exchanges()
+    await cache_service.disconnect()
+
 
 app = FastAPI(
     title="NUO TRADE API",
@@ -9,6 +78,8 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # CORS Configuration
@@ -0,0 +1,135 @@
+"""
+Order Router - Batching, lane isolation and cancel ordering against SimulatedGateway
+"""
+import asyncio
+
+import pytest
+
+from app.services.order_execution import OrderExecutionService, OrderSide, OrderStatus, OrderType
+from app.services.order_router import OrderRouter, SimulatedGateway
+
+
+class RecordingGateway(SimulatedGateway):
+    """SimulatedGateway that logs every call and, like a real venue, cancels by exchange id."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("jitter_ms", 0.0)
+        super().__init__(**kwargs)
+        self.calls = []
+
+    async def create_order(self, order):
+        self.calls.append(("create", [order["id"]]))
+        return await super().create_order(order)
+
+    async def create_orders(self, orders):
+        self.calls.append(("create", [o["id"] for o in orders]))
+        return await super().create_orders(orders)
+
+    async def cancel_order(self, order):
+        self.calls.append(("cancel", [order["exchange_order_id"]]))
+        await super().cancel_order(order)
+
+    async def cancel_orders(self, orders):
+        self.calls.append(("cancel", [o["exchange_order_id"] for o in orders]))
+        await super().cancel_orders(orders)
+
+
+@pytest.fixture
+def orders():
+    return OrderExecutionService()
+
+
+async def submit_limits(router, orders, exchange: str, count: int):
+    """Queue `count` limit orders; returns their ack futures."""
+    futures = []
+    for _ in range(count):
+        order = await orders.create_order("SIM", OrderSide.BUY, OrderType.LIMIT, 1.0, 100.0)
+        futures.append(await router.submit(order, exchange))
+    return futures
+
+
+async def submit_limit(router, orders, exchange: str = "sim"):
+    order = await orders.create_order("SIM", OrderSide.BUY, OrderType.LIMIT, 1.0, 100.0)
+    return order, await router.submit(order, exchange)
+
+
+@pytest.mark.asyncio
+async def test_queued_creates_go_out_as_batches_of_max_batch(orders):
+    router = OrderRouter(orders=orders)
+    gateway = RecordingGateway(latency_ms=1.0, max_batch=20)
+    router.register_gateway(gateway)
+
+    # Queued before the lane worker first runs, so one drain takes all of them
+    acked = await asyncio.gather(*await submit_limits(router, orders, "sim", 45))
+    await router.stop()
+
+    assert [len(ids) for _, ids in gateway.calls] == [20, 20, 5]
+    assert all(order["status"] == OrderStatus.OPEN.value for order in acked)
+    stats = router.get_stats()["sim"]
+    assert stats["batches"] == 3
+    assert stats["accepted"] == stats["sent"] == stats["acked"] == 45
+    assert stats["order_to_ack_ms"]["count"] == 45
+
+
+@pytest.mark.asyncio
+async def test_gateway_without_batching_gets_one_call_per_order(orders):
+    router = OrderRouter(orders=orders)
+    gateway = RecordingGateway(latency_ms=1.0, supports_batch=False)
+    router.register_gateway(gateway)
+
+    await asyncio.gather(*await submit_limits(router, orders, "sim", 5))
+    await router.stop()
+
+    assert [len(ids) for _, ids in gateway.calls] == [1] * 5
+    assert router.get_stats()["sim"]["batches"] == 0
+
+
+@pytest.mark.asyncio
+async def test_a_slow_exchange_does_not_delay_another_lane(orders):
+    router = OrderRouter(orders=orders)
+    router.register_gateway(RecordingGateway(name="slow", latency_ms=300.0))
+    router.register_gateway(RecordingGateway(name="fast", latency_ms=1.0))
+
+    slow = await submit_limits(router, orders, "slow", 3)
+    fast = await submit_limits(router, orders, "fast", 3)
+    await asyncio.wait_for(asyncio.gather(*fast), timeout=0.2)
+    assert not any(future.done() for future in slow)
+
+    await asyncio.gather(*slow)
+    await router.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_with_its_create_goes_out_after_the_ack(orders):
+    router = OrderRouter(orders=orders)
+    gateway = RecordingGateway(latency_ms=1.0)
+    router.register_gateway(gateway)
+
+    order, future = await submit_limit(router, orders)
+    await router.cancel(order["id"])
+    assert router.get_stats()["sim"]["cancels_awaiting_ack"] == 1
+
+    await future
+    await router._lanes["sim"].queue.join()
+    await router.stop()
+
+    assert [kind for kind, _ in gateway.calls] == ["create", "cancel"]
+    assert gateway.calls[1][1] == [order["exchange_order_id"]]
+    assert order["status"] == OrderStatus.CANCELLED.value
+    assert router.get_stats()["sim"]["cancels_awaiting_ack"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_of_an_order_rejected_on_ack_never_reaches_the_exchange(orders):
+    router = OrderRouter(orders=orders)
+    gateway = RecordingGateway(latency_ms=1.0, reject_rate=1.0)
+    router.register_gateway(gateway)
+
+    order, future = await submit_limit(router, orders)
+    await router.cancel(order["id"])
+    await asyncio.wait_for(future, timeout=1)
+    await router.stop()
+
+    assert [kind for kind, _ in gateway.calls] == ["create"]
+    assert order["status"] == OrderStatus.REJECTED.value
+
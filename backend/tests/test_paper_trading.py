@@ -0,0 +1,86 @@
+"""
+Paper Trading Engine - Ladder matching driven through replay
+"""
+import pytest
+
+from app.engine.paper_trading import PaperTradingEngine
+from app.services.order_execution import OrderExecutionService, OrderSide, OrderStatus, OrderType
+from app.services.quote_stream import QuoteBus
+
+
+def quote(bid: float, ask: float, **extra):
+    return {"current_price": (bid + ask) / 2, "bid": bid, "ask": ask, "timestamp": 1_700_000_000, **extra}
+
+
+@pytest.fixture
+def engine():
+    # Not started: no live feeds, matching is driven by replay only
+    paper = PaperTradingEngine(orders=OrderExecutionService(), bus=QuoteBus())
+    paper.fill_log = []
+    paper.add_fill_listener(lambda order, fill: paper.fill_log.append((order["id"], fill["price"])))
+    return paper
+
+
+@pytest.mark.asyncio
+async def test_limit_ladders_fill_best_price_first_then_arrival_order(engine):
+    far = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 98.0)
+    first = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 100.0)
+    second = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 100.0)
+    best = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 101.0)
+    sell = await engine.place_order("AAPL", OrderSide.SELL, OrderType.LIMIT, 1, 103.0)
+
+    filled = await engine.replay([
+        ("AAPL", quote(101.5, 102.0)),  # nothing crosses
+        ("AAPL", quote(99.5, 100.0)),   # ask down to 100: 101 first, then 100s in arrival order
+        ("AAPL", quote(103.0, 103.5)),  # bid up to the sell limit
+    ])
+
+    assert filled == 4
+    assert engine.fill_log == [
+        (best["id"], 100.0), (first["id"], 100.0), (second["id"], 100.0), (sell["id"], 103.0),
+    ]
+    assert far["status"] == OrderStatus.OPEN.value
+    assert engine.get_stats()["resting"] == {"AAPL": 1}
+
+
+@pytest.mark.asyncio
+async def test_stops_trigger_on_the_cross_and_fill_at_the_quote(engine):
+    buy_stop = await engine.place_order("MSFT", OrderSide.BUY, OrderType.STOP_LOSS, 1, 105.0)
+    sell_stop = await engine.place_order("MSFT", OrderSide.SELL, OrderType.STOP_LOSS, 1, 95.0)
+
+    assert await engine.replay([("MSFT", quote(99.0, 100.0))]) == 0
+    assert await engine.replay([("MSFT", quote(105.5, 106.0))]) == 1
+    assert await engine.replay([("MSFT", quote(94.0, 94.5))]) == 1
+
+    assert engine.fill_log == [(buy_stop["id"], 106.0), (sell_stop["id"], 94.0)]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_orders_are_skipped_and_simulated_quotes_ignored(engine):
+    cancelled = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 100.0)
+    resting = await engine.place_order("AAPL", OrderSide.BUY, OrderType.LIMIT, 1, 99.0)
+    await engine.cancel_order(cancelled["id"])
+
+    assert await engine.replay([("AAPL", quote(90.0, 90.0, is_simulated=True))]) == 0
+    assert engine.skipped_quotes == 1
+
+    assert await engine.replay([("AAPL", quote(98.5, 99.0))]) == 1
+    assert engine.fill_log == [(resting["id"], 99.0)]
+    assert cancelled["status"] == OrderStatus.CANCELLED.value
+
+
+@pytest.mark.asyncio
+async def test_market_orders_wait_for_a_quote_and_limits_cross_on_arrival(engine):
+    buy = await engine.place_order("AAPL", OrderSide.BUY, OrderType.MARKET, 2)
+    assert buy["status"] == OrderStatus.OPEN.value
+
+    async def ticks():
+        yield "AAPL", quote(100.0, 100.5)
+
+    assert await engine.replay(ticks()) == 1
+    assert buy["average_price"] == 100.5 and buy["filled"] == 2
+
+    # Marketable limit against the last quote fills on submit
+    sell = await engine.place_order("AAPL", OrderSide.SELL, OrderType.LIMIT, 1, 99.0)
+    assert sell["status"] == OrderStatus.FILLED.value
+    assert engine.fill_log[-1] == (sell["id"], 100.0)
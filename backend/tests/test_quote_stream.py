@@ -0,0 +1,128 @@
+"""
+Quote Stream - Reference counting and leases against a local WebSocket server
+"""
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+import websockets
+
+from app.core.config import settings
+from app.services.quote_stream import FinnhubTradeStream, QuoteBus
+
+
+class FakeFinnhub:
+    """Local stand-in for the Finnhub trade socket that records control messages."""
+
+    def __init__(self):
+        self.messages = []
+        self.clients = set()
+        self.server = None
+
+    async def handler(self, ws):
+        self.clients.add(ws)
+        try:
+            async for raw in ws:
+                self.messages.append(json.loads(raw))
+        finally:
+            self.clients.discard(ws)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    def sent(self, kind: str):
+        return [m["symbol"] for m in self.messages if m["type"] == kind]
+
+    async def push_trades(self, trades):
+        message = json.dumps({"type": "trade", "data": trades})
+        for ws in list(self.clients):
+            await ws.send(message)
+
+
+async def until(predicate, timeout: float = 3.0):
+    """Poll until the predicate holds (messages cross a real socket)."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.01)
+
+
+@pytest_asyncio.fixture
+async def upstream():
+    fake = FakeFinnhub()
+    async with websockets.serve(fake.handler, "127.0.0.1", 0) as server:
+        fake.server = server
+        yield fake
+
+
+@pytest.fixture
+def short_leases(monkeypatch):
+    # Before the stream starts: the expiry loop reads the TTL when it goes to sleep
+    monkeypatch.setattr(settings, "QUOTE_STREAM_LEASE_TTL", 0.2)
+
+
+@pytest_asyncio.fixture
+async def stream(upstream):
+    trade_stream = FinnhubTradeStream(QuoteBus(), url=upstream.url, api_key="")
+    await trade_stream.start()
+    assert await trade_stream.wait_connected(timeout=3)
+    yield trade_stream
+    await trade_stream.stop()
+
+
+@pytest.mark.asyncio
+async def test_acquire_subscribes_once_and_release_unsubscribes_after_last_holder(stream, upstream):
+    assert await stream.acquire("aapl")
+    assert await stream.acquire("AAPL")
+    await until(lambda: upstream.sent("subscribe") == ["AAPL"])
+
+    await stream.release("AAPL")
+    assert stream.is_streaming("AAPL")
+
+    await stream.release("AAPL")
+    await until(lambda: upstream.sent("unsubscribe") == ["AAPL"])
+    assert not stream.is_streaming("AAPL")
+    assert upstream.sent("subscribe") == ["AAPL"]
+
+
+@pytest.mark.asyncio
+async def test_lease_outlives_release_until_it_expires(short_leases, stream, upstream):
+    await stream.acquire("MSFT")
+    await stream.lease("MSFT")
+    await stream.release("MSFT")
+    assert stream.is_streaming("MSFT")
+    assert upstream.sent("unsubscribe") == []
+
+    # The expiry loop wakes at least once a second
+    await until(lambda: upstream.sent("unsubscribe") == ["MSFT"])
+    assert not stream.is_streaming("MSFT")
+
+
+@pytest.mark.asyncio
+async def test_symbol_cap_falls_back_to_polling(stream, upstream, monkeypatch):
+    monkeypatch.setattr(settings, "QUOTE_STREAM_MAX_SYMBOLS", 1)
+    assert await stream.acquire("AAPL")
+    assert not await stream.lease("MSFT")
+    assert stream.capped == 1
+    await until(lambda: upstream.sent("subscribe") == ["AAPL"])
+
+
+@pytest.mark.asyncio
+async def test_trades_update_the_bus_with_the_latest_trade_per_symbol(stream, upstream):
+    stream.bus.seed("AAPL", {"symbol": "AAPL", "current_price": 100.0, "previous_close": 100.0})
+    updates = stream.bus.subscribe("AAPL")
+    await stream.acquire("AAPL")
+
+    await upstream.push_trades([
+        {"s": "AAPL", "p": 101.0, "t": 1_000},
+        {"s": "AAPL", "p": 102.0, "t": 2_000},
+        {"s": "MSFT", "p": 50.0, "t": 2_000},  # no baseline: ignored
+    ])
+    quote = await asyncio.wait_for(updates.get(), timeout=3)
+    assert quote["current_price"] == 102.0
+    assert quote["percent_change"] == 2.0
+    assert updates.empty()
+    assert stream.bus.get_quote("MSFT") is None
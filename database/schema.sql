@@ -48,10 +48,14 @@ CREATE TABLE IF NOT EXISTS trading.orders (
     filled_amount DECIMAL(20, 8) DEFAULT 0,
     average_price DECIMAL(20, 8),
     exchange_order_id VARCHAR(255),
+    client_order_id VARCHAR(64) UNIQUE, -- in-memory order id (write-behind journal key)
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Existing databases created before client_order_id
+ALTER TABLE trading.orders ADD COLUMN IF NOT EXISTS client_order_id VARCHAR(64) UNIQUE;
+
 CREATE INDEX idx_orders_user_id ON trading.orders(user_id);
 CREATE INDEX idx_orders_strategy_id ON trading.orders(strategy_id);
 CREATE INDEX idx_orders_symbol ON trading.orders(symbol);
@@ -108,6 +112,16 @@ SELECT add_compression_policy('trading.ohlcv', INTERVAL '7 days', if_not_exists
 -- Add retention policy (keep data for 2 years)
 SELECT add_retention_policy('trading.ohlcv', INTERVAL '2 years', if_not_exists => TRUE);
 
+-- OHLCV Ingestion Checkpoints - last candle loaded per source/symbol/timeframe
+CREATE TABLE IF NOT EXISTS trading.ohlcv_ingest_checkpoints (
+    source VARCHAR(20) NOT NULL,
+    symbol VARCHAR(50) NOT NULL,
+    timeframe VARCHAR(10) NOT NULL,
+    last_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (source, symbol, timeframe)
+);
+
 -- Performance Metrics Table
 CREATE TABLE IF NOT EXISTS trading.performance_metrics (
     id SERIAL PRIMARY KEY,